@@ -1,9 +1,19 @@
 import pandas as pd
+import numpy as np
 import pathlib
 import os
+import logging
+import shutil
+
+from ecx_analytics.data_processor.storage import get_storage, partition_values, DEFAULT_STORAGE
+
+NUMBER_COLS = ['High', 'Low', 'Opening Price', 'Closing Price']
+CATEGORICAL_COLS = ['symbol', 'warehouse', 'warehouse_name']
+SORT_COLS = ['symbol', 'trade_date', 'production_year', 'warehouse']
+DEDUP_COLS = ['symbol', 'trade_date']
 
 class BronzeToSilver:
-    def __init__(self, data_path):
+    def __init__(self, data_path, storage=DEFAULT_STORAGE, downcast_floats=False, chunk_rows=None):
         self.data_path = data_path
         try:
             self.bronze_path = pathlib.Path.joinpath(self.data_path, "bronze")
@@ -13,10 +23,14 @@ class BronzeToSilver:
             self.silver_path = pathlib.Path.joinpath(self.data_path, "silver")
         except:
             print(f"Silver path does not exist! Please create directory")
+        self.storage = get_storage(storage)
+        # float32 keeps ~7 significant digits, enough for ECX prices but not bit-identical features
+        self.downcast_floats = downcast_floats
+        # when set, bronze is streamed in chunks of this many rows instead of loaded whole
+        self.chunk_rows = chunk_rows
 
-    def load_bronze_df(self, filename="ecx_bronze.pkl"):
-        file_path = pathlib.Path.joinpath(self.bronze_path, filename)
-        df = pd.read_pickle(file_path)
+    def load_bronze_df(self, name="ecx_bronze", columns=None):
+        df = self.storage.read(self.bronze_path, name, columns=columns)
         return df
     
     @staticmethod
@@ -45,11 +59,13 @@ class BronzeToSilver:
             "J1": "J1 Warehouse"
         }
 
-        return df['Warehouse'].replace(warehouse_name_dict)
+        # map the few distinct codes rather than every row
+        warehouse = df['Warehouse'].astype('category')
+        return warehouse.map(lambda w: warehouse_name_dict.get(w, w)).astype('category')
 
     @staticmethod
     def handle_percentages(df):
-        return df['Persetntage Change'].apply(lambda x: float(x.strip('%'))/100)
+        return df['Persetntage Change'].str.strip('%').astype(float) / 100
 
     @staticmethod
     def calculate_spread(df):
@@ -65,28 +81,101 @@ class BronzeToSilver:
 
     @staticmethod
     def clean_number_col(df, col):
-        return df[col].str.replace(',', '').astype(float)
+        return df[col].str.replace(',', '', regex=False).astype(float)
+
+    @staticmethod
+    def clean_number_cols(df, cols=NUMBER_COLS):
+        return df[cols].replace(',', '', regex=True).astype(float)
+
+    @staticmethod
+    def compact_dtypes(df, categorical_cols=CATEGORICAL_COLS, downcast_floats=False):
+        for c in categorical_cols:
+            df[c] = df[c].astype('category')
+        if downcast_floats:
+            float_cols = df.select_dtypes(include='float64').columns
+            df[float_cols] = df[float_cols].astype(np.float32)
+        return df
+
+    @staticmethod
+    def memory_report(before, df):
+        # before is df.memory_usage(deep=True, index=False) measured ahead of compact_dtypes
+        after = df.memory_usage(deep=True, index=False)
+        report = pd.DataFrame({'before_bytes': before, 'after_bytes': after})
+        report.loc['total'] = report.sum()
+        report['ratio'] = report['after_bytes'] / report['before_bytes']
+        return report
 
-    def conduct_cleaning(self, df):
-        for c in ['High','Low','Opening Price', 'Closing Price']:
-            df[c] = self.clean_number_col(df, c)
+    def clean_rows(self, df, log_memory=False):
+        df[NUMBER_COLS] = self.clean_number_cols(df)
         df['Trade Date'] = self.handle_clean_datetime_columns(df)
         df['warehouse_name'] = self.handle_warehouse_names(df)
         df['percentage_change'] = self.handle_percentages(df)
         df['spread'] = self.calculate_spread(df)
         df['mid_price'] = self.calculate_mid_price(df)
         df.drop(columns = ['Persetntage Change'], inplace=True)
+        df.drop(columns = ['source_file'], inplace=True, errors='ignore')
         df.rename(columns=lambda x: x.replace('(','').replace(')','').replace(' ','_').lower(), inplace=True)
-        df = df.sort_values(by=['symbol','trade_date','production_year', 'warehouse'])
-        df = df.drop_duplicates(subset=['symbol','trade_date'], keep="last")
+        if log_memory:
+            before = df.memory_usage(deep=True, index=False)
+        df = self.compact_dtypes(df, downcast_floats=self.downcast_floats)
+        if log_memory:
+            logging.info(f"Silver memory usage before and after compacting dtypes:\n{self.memory_report(before, df)}")
+        return df
+
+    @staticmethod
+    def deduplicate(df):
+        # multi-key sort_values is stable, so the last row per key is the same wherever the frame was split
+        df = df.sort_values(by=SORT_COLS)
+        df = df.drop_duplicates(subset=DEDUP_COLS, keep="last")
         return df
 
-    def store_as_pickle(self, df, filename="ecx_silver.pkl"):
-        file_path = pathlib.Path.joinpath(self.silver_path, filename)
-        df.to_pickle(file_path)
+    def conduct_cleaning(self, df, log_memory=False):
+        df = self.clean_rows(df, log_memory=log_memory)
+        df = self.deduplicate(df)
+        return df
+
+    def store_silver_df(self, df, name="ecx_silver"):
+        self.storage.write_partitioned(df, self.silver_path, name)
+
+    def spill_chunks(self, spill_name, chunk_rows):
+        categories = {c: set() for c in CATEGORICAL_COLS}
+        n_rows, n_chunks = 0, 0
+        for i, chunk in enumerate(self.storage.iter_chunks(self.bronze_path, "ecx_bronze", chunk_rows)):
+            chunk = self.clean_rows(chunk)
+            n_rows += len(chunk)
+            n_chunks += 1
+            for c in CATEGORICAL_COLS:
+                categories[c].update(chunk[c].cat.categories)
+            # every duplicate of a (symbol, trade_date) key lands in the same symbol/year bucket
+            for (symbol, year), part in chunk.groupby(partition_values(chunk), sort=False, observed=True):
+                bucket_path = pathlib.Path.joinpath(self.silver_path, spill_name, f"symbol={symbol}", f"year={year}")
+                bucket_path.mkdir(parents=True, exist_ok=True)
+                self.storage.write(part, bucket_path, f"chunk-{i:06d}")
+        logging.info(f"Spilled {n_rows} cleaned bronze rows in {n_chunks} chunks")
+        return {c: pd.CategoricalDtype(sorted(v)) for c, v in categories.items()}
+
+    def run_chunked(self, chunk_rows, name="ecx_silver"):
+        spill_name = f"{name}.spill"
+        spill_path = pathlib.Path.joinpath(self.silver_path, spill_name)
+        if spill_path.exists():
+            shutil.rmtree(spill_path)
+        dtypes = self.spill_chunks(spill_name, chunk_rows)
+        staging_path = self.storage.begin_partitioned(self.silver_path, name)
+        # only one symbol/year bucket is held in memory at a time
+        for bucket in self.storage.partitions(self.silver_path, spill_name):
+            chunk_names = sorted(f.stem for f in bucket['path'].iterdir())
+            df = pd.concat([self.storage.read_file(bucket['path'], c) for c in chunk_names])
+            # chunks saw different category sets, align them to the categories of a full load
+            df = self.deduplicate(df.astype(dtypes))
+            self.storage.write_partition(df, staging_path, bucket['symbol'], bucket['year'])
+        self.storage.commit_partitioned(self.silver_path, name)
+        shutil.rmtree(spill_path)
+        return True
 
     def run(self):
+        if self.chunk_rows:
+            return self.run_chunked(self.chunk_rows)
         df = self.load_bronze_df()
-        df = self.conduct_cleaning(df)
-        self.store_as_pickle(df)
-        return True     
+        df = self.conduct_cleaning(df, log_memory=True)
+        self.store_silver_df(df)
+        return True
\ No newline at end of file
@@ -2,53 +2,69 @@ import os
 import sys
 import pathlib
 import logging
-logging.basicConfig(level = logging.INFO)
 
 
 FILEPATH = pathlib.Path(__file__).parent.resolve()
 PROJECTPATH = FILEPATH.parent.parent.resolve()
 DATAPATH = pathlib.Path.joinpath(FILEPATH.parent.parent, 'data')
 
-sys.path.append(str(PROJECTPATH))
+if __name__ == '__main__':
+    sys.path.append(str(PROJECTPATH))
 
-from ecx_analytics.data_processor.raw_to_bronze import RawToBronze
-from ecx_analytics.data_processor.bronze_to_silver import BronzeToSilver
-from ecx_analytics.data_processor.silver_to_gold import SilverToGold
-from ecx_analytics.data_processor.silver_to_feature_store import SilverToFeatureStore
+# each stage imports its own (pandas heavy) module only when it is run
 
 class DataProcessor:
 
-    def __init__(self, data_path=DATAPATH):
+    def __init__(self, data_path=DATAPATH, n_workers=1, storage='parquet', chunk_rows=None, symbols=None, grouped_features=False, features=None, gold_quantiles='sketch'):
         logging.info("Initialising Data Processor")
         self.data_path = data_path
+        self.n_workers = n_workers
+        self.storage = storage
+        self.chunk_rows = chunk_rows
+        # feature stores are built for these symbols, or every symbol in silver when None
+        self.symbols = symbols
+        self.grouped_features = grouped_features
+        # feature registry names to build, every feature when None
+        self.features = features
+        # 'sketch' or 'exact' gold percentiles
+        self.gold_quantiles = gold_quantiles
 
     def raw_to_bronze(self):
+        from ecx_analytics.data_processor.raw_to_bronze import RawToBronze
         logging.info("Converting Raw Data To Bronze")
-        raw_to_bronze = RawToBronze(self.data_path)
+        raw_to_bronze = RawToBronze(self.data_path, n_workers=self.n_workers, storage=self.storage)
         raw_to_bronze.run()
+        if raw_to_bronze.failures:
+            logging.warning(f"Raw files not converted to Bronze: {raw_to_bronze.failures}")
         logging.info("Raw Data converted to Bronze")
 
     def bronze_to_silver(self):
+        from ecx_analytics.data_processor.bronze_to_silver import BronzeToSilver
         logging.info("Converting Bronze Data To Silver")
-        bronze_to_silver = BronzeToSilver(self.data_path)
+        bronze_to_silver = BronzeToSilver(self.data_path, storage=self.storage, chunk_rows=self.chunk_rows)
         bronze_to_silver.run()
         logging.info("Bronze Data converted to Silver")
 
     def silver_to_gold(self):
+        from ecx_analytics.data_processor.silver_to_gold import SilverToGold
         logging.info("Converting Silver Data To Gold")
-        silver_to_gold = SilverToGold(self.data_path)
+        silver_to_gold = SilverToGold(self.data_path, storage=self.storage, quantiles=self.gold_quantiles)
         silver_to_gold.run()
         logging.info("Silver Data converted to Gold")
 
     def silver_to_feature_store(self):
+        from ecx_analytics.data_processor.silver_to_feature_store import SilverToFeatureStore
         logging.info("Converting Silver Data To Feature Store")
-        feature_processor = SilverToFeatureStore(self.data_path)
-        feature_processor.run()
+        feature_processor = SilverToFeatureStore(self.data_path, symbols=self.symbols, storage=self.storage, n_workers=self.n_workers, features=self.features)
+        feature_processor.run(grouped=self.grouped_features)
+        if feature_processor.failures:
+            logging.warning(f"Feature stores not built: {feature_processor.failures}")
         logging.info("Silver Data converted to Feature Store")
 
 if __name__ == '__main__':
-    data_processor = DataProcessor()
+    logging.basicConfig(level = logging.INFO)
+    data_processor = DataProcessor(n_workers=os.cpu_count())
     # data_processor.raw_to_bronze()
     # data_processor.bronze_to_silver()
     # data_processor.silver_to_gold()
-    data_processor.silver_to_feature_store()
\ No newline at end of file
+    data_processor.silver_to_feature_store()
@@ -0,0 +1,119 @@
+import numpy as np
+import pandas as pd
+
+from ecx_analytics.data_processor.feature_state import WINDOW, WINDOW_COLUMNS, ewm_key
+
+
+class Feature:
+    """Declares a feature column: the `kind` of computation that produces
+    it, the input `column`, the statistic taken and its parameters.
+
+    - 'lag': `stat` is one of the lag price columns
+    - 'window': `stat` of `column` over the trailing `window` grid days
+    - 'ewm': shifted EWM `stat` (mean or std) of `column` with `alpha`
+    - 'calendar': `stat` (sin or cos) of the `column` date field over `period`
+    """
+
+    def __init__(self, name, kind, column=None, stat=None, window=None, alpha=None, period=None, fill=None):
+        self.name = name
+        self.kind = kind
+        self.column = column
+        self.stat = stat
+        self.window = window
+        self.alpha = alpha
+        self.period = period
+        # value replacing missing results
+        self.fill = fill
+
+    def __repr__(self):
+        return f"Feature({self.name!r}, {self.kind!r})"
+
+
+# in feature store column order
+FEATURES = [
+    Feature('lag_price', 'lag', stat='lag_price'),
+    Feature('lag_distance', 'lag', stat='lag_distance'),
+    Feature('lag_price_twice', 'lag', stat='lag_price_twice'),
+    Feature('second_last_price_distance', 'lag', stat='second_last_price_distance'),
+    Feature('mid_price_ma_30', 'window', 'mid_price', 'mean', window=30),
+    Feature('mid_price_std_30', 'window', 'mid_price', 'std', window=30, fill=0.0),
+    Feature('mid_price_count_30', 'window', 'mid_price', 'count', window=30),
+    Feature('mid_price_ema_01', 'ewm', 'mid_price', 'mean', alpha=0.1),
+    Feature('mid_price_ema_03', 'ewm', 'mid_price', 'mean', alpha=0.3),
+    Feature('mid_price_estd_01', 'ewm', 'mid_price', 'std', alpha=0.1),
+    Feature('mid_price_estd_03', 'ewm', 'mid_price', 'std', alpha=0.3),
+    Feature('spread_mean', 'window', 'spread', 'mean', window=30),
+    Feature('volume_ton_mean', 'window', 'volume_ton', 'mean', window=30),
+    Feature('volume_ton_sum', 'window', 'volume_ton', 'sum', window=30),
+    Feature('weekday_sin', 'calendar', 'dayofweek', 'sin', period=6.0),
+    Feature('weekday_cos', 'calendar', 'dayofweek', 'cos', period=6.0),
+    Feature('month_sin', 'calendar', 'month', 'sin', period=11.0),
+    Feature('month_cos', 'calendar', 'month', 'cos', period=11.0),
+    Feature('day_of_month_sin', 'calendar', 'day', 'sin', period=31.0),
+    Feature('day_of_month_cos', 'calendar', 'day', 'cos', period=31.0),
+]
+
+FEATURE_NAMES = [f.name for f in FEATURES]
+
+
+def get_features(names=None):
+    """Registry entries for `names` in feature store order, all of them when None."""
+    if names is None:
+        return list(FEATURES)
+    missing = [n for n in names if n not in FEATURE_NAMES]
+    if missing:
+        raise KeyError(f'Unknown features {missing}, available features are {FEATURE_NAMES}')
+    return [f for f in FEATURES if f.name in set(names)]
+
+
+class FeaturePlan:
+    """The intermediates a set of features needs, each computed once.
+
+    Lag features share one lookup of the last trades, window features over
+    the same window share one sweep in which the sums and counts feed the
+    mean, sum, count and std, and the mean and std of an EWM come from the
+    same recurrence. Intermediates no selected feature uses are skipped.
+    """
+
+    def __init__(self, features):
+        self.features = features
+        self.names = [f.name for f in features]
+        self.lags = any(f.kind == 'lag' for f in features)
+        # window -> column -> whether the std is needed
+        self.windows = {}
+        for f in features:
+            if f.kind != 'window':
+                continue
+            if f.column not in WINDOW_COLUMNS or f.window > WINDOW:
+                raise ValueError(f'{f.name}: window features are limited to {WINDOW_COLUMNS} over at most {WINDOW} days')
+            columns = self.windows.setdefault(f.window, {})
+            columns[f.column] = columns.get(f.column, False) or f.stat == 'std'
+        self.ewm_alphas = []
+        for f in features:
+            if f.kind != 'ewm':
+                continue
+            if f.column != 'mid_price':
+                raise ValueError(f'{f.name}: EWM features are only kept for mid_price')
+            if f.alpha not in self.ewm_alphas:
+                self.ewm_alphas.append(f.alpha)
+        self.ewm_keys = [ewm_key(a) for a in self.ewm_alphas]
+
+    def column(self, f, trade_dates, lags, stats, ewm):
+        if f.kind == 'lag':
+            values = lags[f.stat]
+        elif f.kind == 'window':
+            values = stats[f.window][f.column][f.stat]
+        elif f.kind == 'ewm':
+            means, stds = ewm[ewm_key(f.alpha)]
+            values = means if f.stat == 'mean' else stds
+        else:
+            field = getattr(trade_dates.dt, f.column)
+            values = getattr(np, f.stat)(2 * np.pi * field / f.period).to_numpy()
+        if f.fill is not None:
+            values = np.nan_to_num(values, nan=f.fill)
+        return values
+
+    def frame(self, trade_dates, lags, stats, ewm):
+        """The selected features from the shared intermediates, in feature store order."""
+        trade_dates = trade_dates.reset_index(drop=True)
+        return pd.DataFrame({f.name: self.column(f, trade_dates, lags, stats, ewm) for f in self.features})
@@ -0,0 +1,253 @@
+import math
+import numpy as np
+import pandas as pd
+
+from ecx_analytics.data_processor.storage import JsonState
+
+WINDOW = 30
+EWM_ALPHAS = {'01': 0.1, '03': 0.3}
+WINDOW_COLUMNS = ['mid_price', 'spread', 'volume_ton']
+
+
+def trailing_window_stats(values, history, window=WINDOW, std=True):
+    """Stats over the `window` grid days before each day, like
+    `rolling(window=window, min_periods=0, closed='left')`.
+
+    `history` holds at least the `window` values preceding `values` (NaN
+    for days without a trade or before the series started). pandas keeps
+    running sums, so its results depend on where the series started. Here
+    each window is summed in the same fixed order wherever the series was
+    split, so extending a series gives bit-identical results to computing
+    it in one go. `values` may also be 2-d with one row per column. The
+    std, which needs a second sweep, is skipped unless `std`.
+    """
+    history = np.asarray(history, dtype=np.float64)
+    padded = np.concatenate([history[..., history.shape[-1] - window:], np.asarray(values, dtype=np.float64)], axis=-1)
+    n = padded.shape[-1] - window
+    observed = ~np.isnan(padded)
+    zeroed = np.where(observed, padded, 0.0)
+    # counts are integers, so differences of a running count are exact
+    observed_count = np.concatenate([np.zeros(padded.shape[:-1] + (1,), dtype=np.int64), np.cumsum(observed, axis=-1)], axis=-1)
+    count = (observed_count[..., window:window + n] - observed_count[..., :n]).astype(np.float64)
+    total = np.zeros(count.shape)
+    for k in range(window):
+        total += zeroed[..., k:k + n]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+    stats = {'mean': mean, 'count': count, 'sum': total}
+    if std:
+        squares = np.zeros(count.shape)
+        deviation = np.empty(count.shape)
+        for k in range(window):
+            # missing days contribute 0 - mean * 0
+            np.multiply(mean, observed[..., k:k + n], out=deviation)
+            np.subtract(zeroed[..., k:k + n], deviation, out=deviation)
+            np.multiply(deviation, deviation, out=deviation)
+            squares += deviation
+        with np.errstate(invalid='ignore', divide='ignore'):
+            stats['std'] = np.where(count > 1, np.sqrt(squares / (count - 1)), np.nan)
+    return stats
+
+
+def window_features(values, state, windows=None, ewm_keys=None):
+    """The windowed features of a single series.
+
+    `values` has one row per `WINDOW_COLUMNS` entry and one column per grid
+    day. `windows` maps each window length to the columns whose trailing
+    stats are needed, and whether their std is, by default every column
+    over `WINDOW` days. The EWMs of the mid price in `ewm_keys` (all of the
+    state's by default) are taken too, then `state` is advanced past
+    `values`. Returns the trailing stats by window and column, and the
+    shifted EWM means and stds by key.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    windows = {WINDOW: {c: True for c in WINDOW_COLUMNS}} if windows is None else windows
+    ewm_keys = list(state.ewm) if ewm_keys is None else ewm_keys
+    stats = {}
+    for window, columns in windows.items():
+        stats[window] = {}
+        # the std sweep only runs over the columns that need it
+        for std in [True, False]:
+            columns_ = [c for c, std_ in columns.items() if std_ == std]
+            if not columns_:
+                continue
+            rows = [WINDOW_COLUMNS.index(c) for c in columns_]
+            history = np.array([state.windows[c] for c in columns_], dtype=np.float64)
+            window_stats = trailing_window_stats(values[rows], history, window=window, std=std)
+            stats[window].update({c: {k: v[i] for k, v in window_stats.items()} for i, c in enumerate(columns_)})
+    for i, c in enumerate(WINDOW_COLUMNS):
+        state.push_window(c, values[i])
+    prices = values[WINDOW_COLUMNS.index('mid_price')]
+    ewm = {k: state.ewm[k].shifted(prices) for k in ewm_keys}
+    return stats, ewm
+
+
+def ewm_key(alpha):
+    # the state key of an EWM, the names in EWM_ALPHAS for the standard alphas
+    keys = {a: k for k, a in EWM_ALPHAS.items()}
+    return keys.get(alpha, repr(alpha))
+
+
+class EwmState:
+    """Running state of `ewm(alpha, adjust=False)` mean and bias-corrected
+    variance, following the same recurrence as pandas so a series can be
+    extended one value at a time.
+    """
+
+    FIELDS = ['mean', 'cov', 'sum_wt', 'sum_wt2', 'old_wt', 'nobs']
+
+    def __init__(self, alpha, mean=math.nan, cov=0.0, sum_wt=1.0, sum_wt2=1.0, old_wt=1.0, nobs=0):
+        self.alpha = alpha
+        # pandas goes through the centre of mass, which can move alpha by an ulp
+        alpha_ = 1.0 / (1.0 + (1.0 / alpha - 1.0))
+        self.new_wt = alpha_
+        self.old_wt_factor = 1.0 - alpha_
+        self.mean = mean
+        self.cov = cov
+        self.sum_wt = sum_wt
+        self.sum_wt2 = sum_wt2
+        self.old_wt = old_wt
+        self.nobs = nobs
+
+    @property
+    def is_empty(self):
+        # no value observed yet, every field still holds its initial value
+        return self.nobs == 0
+
+    def update(self, x):
+        is_observation = x == x
+        if self.mean == self.mean:
+            new_wt = self.new_wt
+            self.sum_wt *= self.old_wt_factor
+            self.sum_wt2 *= self.old_wt_factor * self.old_wt_factor
+            self.old_wt *= self.old_wt_factor
+            if is_observation:
+                old_wt = self.old_wt
+                # avoid numerical errors on constant series
+                mean = ((old_wt * self.mean) + (new_wt * x)) / (old_wt + new_wt) if self.mean != x else self.mean
+                self.cov = ((old_wt * (self.cov + ((self.mean - mean) * (self.mean - mean)))) +
+                            (new_wt * ((x - mean) * (x - mean)))) / (old_wt + new_wt)
+                observed_wt = old_wt + new_wt
+                self.sum_wt = (self.sum_wt + new_wt) / observed_wt
+                self.sum_wt2 = (self.sum_wt2 + new_wt * new_wt) / (observed_wt * observed_wt)
+                self.old_wt = 1.0
+                self.mean = mean
+        elif is_observation:
+            self.mean = x
+        self.nobs += int(is_observation)
+
+    def outputs(self):
+        if self.nobs < 1:
+            return math.nan, math.nan
+        numerator = self.sum_wt * self.sum_wt
+        denominator = numerator - self.sum_wt2
+        var = (numerator / denominator) * self.cov if denominator > 0 else math.nan
+        # like pandas, a variance that rounds below zero becomes a zero std
+        return self.mean, math.sqrt(max(var, 0.0)) if var == var else math.nan
+
+    def shifted_pandas(self, values):
+        """`shifted` for an empty state, with the outputs from pandas'
+        compiled `ewm`, whose recurrence this state follows.
+
+        The mean and the biased variance pandas reports after the last day
+        are the state's mean and cov. The weights only depend on which days
+        were observed, and are replayed from those.
+        """
+        ewm = pd.Series(values).ewm(alpha=self.alpha, adjust=False, min_periods=0)
+        means, stds, covs = ewm.mean().to_numpy(), ewm.std().to_numpy(), ewm.var(bias=True).to_numpy()
+        observed = ~np.isnan(values)
+        # pandas only moves the weights once the mean has started
+        started = np.concatenate([[False], ~np.isnan(means[:-1])])
+        factor, factor2, new_wt = self.old_wt_factor, self.old_wt_factor * self.old_wt_factor, self.new_wt
+        for is_started, is_observation in zip(started.tolist(), observed.tolist()):
+            if is_started:
+                self.sum_wt *= factor
+                self.sum_wt2 *= factor2
+                self.old_wt *= factor
+                if is_observation:
+                    observed_wt = self.old_wt + new_wt
+                    self.sum_wt = (self.sum_wt + new_wt) / observed_wt
+                    self.sum_wt2 = (self.sum_wt2 + new_wt * new_wt) / (observed_wt * observed_wt)
+                    self.old_wt = 1.0
+        self.nobs = int(observed.sum())
+        if self.nobs:
+            self.mean, self.cov = float(means[-1]), float(covs[-1])
+        return np.concatenate([[math.nan], means[:-1]]), np.concatenate([[math.nan], stds[:-1]])
+
+    def shifted(self, values):
+        """ewm(...).mean()/std() followed by .shift(), the feature for a day
+        only sees earlier days, and the state advanced past `values`.
+
+        A full build starts from an empty state and takes pandas' `ewm`, an
+        extension steps the recurrence over the new days only.
+        """
+        values = np.asarray(values, dtype=np.float64)
+        if self.is_empty:
+            return self.shifted_pandas(values)
+        means, stds = np.empty(len(values)), np.empty(len(values))
+        for i, x in enumerate(values.tolist()):
+            means[i], stds[i] = self.outputs()
+            self.update(x)
+        return means, stds
+
+    def to_dict(self):
+        d = {'alpha': self.alpha}
+        d.update({k: getattr(self, k) for k in self.FIELDS})
+        return d
+
+
+class FeatureState(JsonState):
+    """Everything needed to extend a symbol's features past `end`: the last
+    `WINDOW` grid days of each windowed column, the EWM states and the last
+    two trades, with the count and `fingerprint` of the silver rows
+    consumed. `features` names the features the state was built for, as
+    only their EWMs are kept, None for a state from before features could
+    be selected, which covers all of them.
+    """
+
+    def __init__(self, end=None, windows=None, ewm=None, last_trades=None, n_rows=0, fingerprint=0, pending_backfill=False, features=None):
+        self.end = None if end is None else pd.Timestamp(end)
+        self.windows = windows or {c: [math.nan] * WINDOW for c in WINDOW_COLUMNS}
+        self.ewm = ewm if ewm is not None else {k: EwmState(alpha) for k, alpha in EWM_ALPHAS.items()}
+        self.last_trades = last_trades or []
+        # silver rows consumed so far, used to spot history rewritten underneath the state
+        self.n_rows = n_rows
+        # None for a state from before fingerprints, whose history can't be checked
+        self.fingerprint = fingerprint
+        # set when the last lag price is missing, a full rebuild would backfill it from later days
+        self.pending_backfill = pending_backfill
+        self.features = features
+
+    @property
+    def is_empty(self):
+        return self.end is None
+
+    def push_window(self, column, values):
+        history = np.concatenate([np.asarray(self.windows[column], dtype=np.float64), np.asarray(values, dtype=np.float64)])
+        self.windows[column] = history[-WINDOW:].tolist()
+
+    def to_dict(self):
+        return {
+            'end': None if self.end is None else self.end.isoformat(),
+            'windows': self.windows,
+            'ewm': {k: s.to_dict() for k, s in self.ewm.items()},
+            'last_trades': [[pd.Timestamp(d).isoformat(), p] for d, p in self.last_trades],
+            'n_rows': self.n_rows,
+            'fingerprint': self.fingerprint,
+            'pending_backfill': self.pending_backfill,
+            'features': self.features
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(
+            end=d['end'],
+            windows=d['windows'],
+            ewm={k: EwmState(**s) for k, s in d['ewm'].items()},
+            last_trades=[(pd.Timestamp(t), p) for t, p in d['last_trades']],
+            n_rows=d['n_rows'],
+            fingerprint=d.get('fingerprint'),
+            pending_backfill=d['pending_backfill'],
+            features=d.get('features')
+        )
+
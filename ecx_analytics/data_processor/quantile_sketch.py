@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+
+RELATIVE_ACCURACY = 0.001
+# magnitudes below this count as zero
+MIN_MAGNITUDE = 1e-9
+# keeps the bucket keys of magnitudes below one positive, so the sign of a key is the sign of its values
+KEY_OFFSET = 2 ** 20
+
+
+class QuantileSketch:
+    """Mergeable relative-error quantile sketch (DDSketch) for many cells
+    at once.
+
+    A value x is counted in the bucket of magnitudes (g^(i-1), g^i] with
+    g = (1 + a) / (1 - a) for the relative accuracy a, and is estimated as
+    2 g^i / (g + 1), which is within a * |x| of x. A cell's sketch is the
+    count of its values in each bucket, so sketches merge exactly by adding
+    counts, in any order and any grouping, and hold at most one bucket per
+    value or per factor g between the cell's smallest and largest
+    magnitude, whichever is fewer.
+
+    Quantiles interpolate between the order statistics around the rank
+    like `np.percentile`. With t the interpolation fraction between x_lo
+    and x_hi, the estimate of a percentile p is off by at most
+    a * ((1 - t) |x_lo| + t |x_hi|), which is a * |p| when both have the
+    same sign.
+
+    Sketches of many cells are held as one long frame with the cell keys,
+    the `measure`, the `bucket` key and the `count`.
+    """
+
+    def __init__(self, relative_accuracy=RELATIVE_ACCURACY):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError('relative_accuracy must be between 0 and 1')
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = np.log(self.gamma)
+
+    def bucket(self, values):
+        # signed bucket keys that sort like the values, 0 for zero
+        values = np.asarray(values, dtype=np.float64)
+        magnitude = np.abs(values)
+        with np.errstate(divide='ignore'):
+            index = np.ceil(np.log(np.maximum(magnitude, MIN_MAGNITUDE)) / self.log_gamma)
+        return np.where(magnitude < MIN_MAGNITUDE, 0, np.sign(values) * (index + KEY_OFFSET)).astype(np.int64)
+
+    def value(self, buckets):
+        buckets = np.asarray(buckets, dtype=np.int64)
+        index = np.abs(buckets) - KEY_OFFSET
+        return np.where(buckets == 0, 0.0, np.sign(buckets) * 2 * np.power(self.gamma, index) / (self.gamma + 1))
+
+    def create(self, df, key_names, measures):
+        """Sketches of `measures` for each cell of the `key_names` columns,
+        missing values are skipped and missing keys kept."""
+        sketches = []
+        for m in measures:
+            observed = df[m].notnull().to_numpy()
+            cells = df.loc[observed, key_names].assign(bucket=self.bucket(df.loc[observed, m]))
+            counts = cells.groupby(key_names + ['bucket'], dropna=False, observed=True, sort=True).size().rename('count')
+            sketches.append(counts.reset_index().assign(measure=m))
+        sketches = pd.concat(sketches, ignore_index=True)
+        sketches['measure'] = pd.Categorical(sketches['measure'], categories=measures)
+        return self.tidy(sketches, key_names)
+
+    @staticmethod
+    def tidy(sketches, key_names):
+        return sketches[key_names + ['measure', 'bucket', 'count']]
+
+    def merge(self, sketches, keys):
+        """Sketches of the cells of `keys`, one per sketch row, merged by adding bucket counts."""
+        merged = sketches['count'].groupby(list(keys) + [sketches['measure'], sketches['bucket']], observed=True, sort=True).sum()
+        return self.tidy(merged.reset_index(), [k.name for k in keys])
+
+    def quantiles(self, sketches, key_names, measures, quantiles):
+        """Estimated percentiles (0 to 100) of each cell, with columns
+        <measure>_percentile_<q> and indexed by the cell keys."""
+        sketches = sketches.sort_values(key_names + ['measure', 'bucket'], kind='stable')
+        counts = sketches['count'].to_numpy(dtype=np.int64)
+        cumulative = np.cumsum(counts)
+        cells = sketches.groupby(key_names + ['measure'], observed=True, sort=False)
+        first = cells.cumcount().to_numpy() == 0
+        # the rank of the first value of each cell in the whole frame, and each cell's size
+        cell_start = (cumulative - counts)[first]
+        cell_size = cells['count'].sum().to_numpy()
+        index = sketches.loc[first, key_names + ['measure']]
+        values = self.value(sketches['bucket'].to_numpy())
+
+        def order_statistic(rank):
+            return values[np.searchsorted(cumulative, cell_start + rank, side='right')]
+
+        columns = {}
+        for q in quantiles:
+            rank = q / 100 * (cell_size - 1)
+            lower, upper = np.floor(rank), np.ceil(rank)
+            low, high = order_statistic(lower), order_statistic(upper)
+            columns[q] = low + (high - low) * (rank - lower)
+        estimates = index.assign(**{f'percentile_{q}': v for q, v in columns.items()})
+        estimates = estimates.set_index(key_names + ['measure']).unstack('measure')
+        names = [f'{m}_percentile_{q}' for m in measures for q in quantiles]
+        estimates.columns = [f'{m}_{p}' for p, m in estimates.columns]
+        return estimates.reindex(columns=names)
@@ -1,9 +1,29 @@
 import pandas as pd
+import datetime as dt
 import pathlib
 import os
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from ecx_analytics.data_processor.storage import get_storage, DEFAULT_STORAGE, read_json, write_json
+
+# how the reports write dates stored as text
+REPORT_DATE_FORMAT = '%m/%d/%Y'
+
+
+def read_raw_workbook(file_path):
+    return pd.read_excel(file_path, sheet_name='rptCoffee', header=2)
+
+
+def cell_text(value):
+    if isinstance(value, dt.date):
+        return value.strftime(REPORT_DATE_FORMAT)
+    return str(value)
+
 
 class RawToBronze:
-    def __init__(self, data_path):
+    def __init__(self, data_path, n_workers=1, storage=DEFAULT_STORAGE):
         self.data_path = data_path
         try:
             self.raw_path = pathlib.Path.joinpath(self.data_path, "raw")
@@ -13,39 +33,157 @@ class RawToBronze:
             self.bronze_path = pathlib.Path.joinpath(self.data_path, "bronze")
         except:
             print(f"Bronze path does not exist! Please create directory")
+        self.n_workers = n_workers
+        self.storage = get_storage(storage)
+        self.failures = {}
+        self.manifest_path = pathlib.Path.joinpath(self.bronze_path, "raw_manifest.json")
+
+    def record_failure(self, filename, error):
+        self.failures[filename] = f"{type(error).__name__}: {error}"
+        logging.warning(f"Couldn't load file {filename} in path {self.raw_path}, {self.failures[filename]}")
 
     def load_single_file_to_df(self, filename):
+        file_path = pathlib.Path.joinpath(self.raw_path, filename)
         try:
-            file_path = pathlib.Path.joinpath(self.raw_path, filename)
-        except:
-            print(f"Couldn't find file {filename} in path {self.raw_path}")
-            return None
-        try:
-            df = pd.read_excel(file_path, sheet_name='rptCoffee', header=2)
-        except:
-            print(f"Couldn't load file {file_path}")
+            df = read_raw_workbook(file_path)
+        except Exception as e:
+            self.record_failure(filename, e)
             return None
         return df
-    
-    def load_multiple_files_to_df(self, filename_list):
-        dfs = []
-        for f in filename_list:
-            dfs.append(self.load_single_file_to_df(f))
+
+    def load_files_in_parallel(self, filename_list):
+        dfs = [None] * len(filename_list)
+        with ProcessPoolExecutor(max_workers=self.n_workers) as executor:
+            futures = {
+                executor.submit(read_raw_workbook, pathlib.Path.joinpath(self.raw_path, f)): i
+                for i, f in enumerate(filename_list)
+            }
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    dfs[i] = future.result()
+                except Exception as e:
+                    self.record_failure(filename_list[i], e)
+        # results are slotted by position so the output order matches filename_list
+        return dfs
+
+    def load_multiple_files_to_df(self, filename_list, require_any=True):
+        if self.n_workers > 1 and len(filename_list) > 1:
+            dfs = self.load_files_in_parallel(filename_list)
+        else:
+            dfs = [self.load_single_file_to_df(f) for f in filename_list]
+        # tag rows with their file so they can be retracted when it changes
+        for f, df in zip(filename_list, dfs):
+            if isinstance(df, pd.DataFrame):
+                df['source_file'] = f
         # remove any Nones resulting from errors
         res = [i for i in dfs if isinstance(i, pd.DataFrame)]
-        return pd.concat(dfs)
+        if self.failures:
+            logging.warning(f"{len(self.failures)} of {len(filename_list)} raw files failed to load: {sorted(self.failures)}")
+        if not res:
+            if not require_any:
+                return None
+            raise ValueError(f"None of the {len(filename_list)} raw files in {self.raw_path} could be loaded")
+        return pd.concat(res)
     
-    def store_as_pickle(self, df, filename='ecx_bronze.pkl'):
-        file_path = pathlib.Path.joinpath(self.bronze_path, filename)
-        df.to_pickle(file_path)
+    def load_bronze_df(self, name='ecx_bronze'):
+        if not self.storage.exists(self.bronze_path, name):
+            return None
+        return self.storage.read(self.bronze_path, name)
+
+    @staticmethod
+    def text_mixed_columns(df):
+        # workbook cells are typed one by one, so a column can mix text with numbers or dates,
+        # which parquet can't store; those columns are kept as text and parsed in silver
+        df = df.copy()
+        for c in df.columns[df.dtypes == object]:
+            if pd.api.types.infer_dtype(df[c], skipna=True) not in ('string', 'empty'):
+                df[c] = df[c].map(cell_text, na_action='ignore')
+        return df
+
+    def store_bronze_df(self, df, name='ecx_bronze'):
+        self.storage.write(self.text_mixed_columns(df), self.bronze_path, name)
 
     def get_filenames(self):
-        file_list = os.listdir(self.raw_path)
+        file_list = sorted(os.listdir(self.raw_path))
         return file_list
 
-    def run(self):
-        self.get_filenames()
+    @staticmethod
+    def hash_file(file_path, chunk_size=1 << 20):
+        digest = hashlib.sha256()
+        with open(file_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                digest.update(chunk)
+        return digest.hexdigest()
+
+    def load_manifest(self):
+        return read_json(self.manifest_path) or {}
+
+    def store_manifest(self, manifest):
+        write_json(manifest, self.manifest_path, sort_keys=True)
+
+    def scan_raw_files(self, manifest):
+        entries, changed = {}, []
+        for f in self.get_filenames():
+            stat = pathlib.Path.joinpath(self.raw_path, f).stat()
+            entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+            previous = manifest.get(f)
+            if previous is not None and previous['size'] == entry['size'] and previous['mtime_ns'] == entry['mtime_ns']:
+                entries[f] = previous
+                continue
+            # only hash files whose size or mtime moved, a touched but identical file is not re-parsed
+            entry['sha256'] = self.hash_file(pathlib.Path.joinpath(self.raw_path, f))
+            if previous is None or previous.get('sha256') != entry['sha256']:
+                changed.append(f)
+            entries[f] = entry
+        removed = sorted(set(manifest) - set(entries))
+        return entries, changed, removed
+
+    def run_full(self):
         fnames = self.get_filenames()
+        manifest, _, _ = self.scan_raw_files({})
         df = self.load_multiple_files_to_df(fnames)
-        self.store_as_pickle(df)
+        self.store_bronze_df(df)
+        self.store_manifest({f: e for f, e in manifest.items() if f not in self.failures})
         return True
+
+    def run_incremental(self):
+        manifest = self.load_manifest()
+        bronze_df = self.load_bronze_df()
+        if not manifest or bronze_df is None or 'source_file' not in bronze_df.columns:
+            logging.info("No bronze manifest found, rebuilding bronze from all raw files")
+            return self.run_full()
+
+        entries, changed, removed = self.scan_raw_files(manifest)
+        if not changed and not removed:
+            logging.info("Raw files unchanged since last run, bronze is up to date")
+            self.store_manifest(entries)
+            return True
+        logging.info(f"Ingesting {len(changed)} new or changed raw files and retracting {len(removed)} removed files")
+
+        # a bad download must not block ingesting the other files, so all of them failing is not an error here
+        new_df = self.load_multiple_files_to_df(changed, require_any=False) if changed else None
+        loaded = [f for f in changed if f not in self.failures]
+        # rows of files that failed to re-parse are kept until they parse cleanly
+        retracted = set(loaded) | set(removed)
+        dfs = [bronze_df[~bronze_df['source_file'].isin(retracted)]]
+        if new_df is not None:
+            dfs.append(new_df)
+        df = pd.concat(dfs)
+        # keep rows in filename order so the result matches a full rebuild
+        file_order = {f: i for i, f in enumerate(sorted(df['source_file'].unique()))}
+        df = df.iloc[df['source_file'].map(file_order).to_numpy().argsort(kind='stable')]
+        self.store_bronze_df(df)
+
+        for f in self.failures:
+            if f in manifest:
+                entries[f] = manifest[f]
+            else:
+                entries.pop(f, None)
+        self.store_manifest(entries)
+        return True
+
+    def run(self, incremental=True):
+        if incremental:
+            return self.run_incremental()
+        return self.run_full()
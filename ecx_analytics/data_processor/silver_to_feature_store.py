@@ -1,10 +1,29 @@
 import numpy as np
-from numpy.core.fromnumeric import mean
 import pandas as pd
 import pathlib
+import logging
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from ecx_analytics.data_processor.storage import get_storage, DEFAULT_STORAGE, frame_fingerprint, add_fingerprints
+from ecx_analytics.data_processor.feature_state import FeatureState, EwmState, window_features, ewm_key, WINDOW_COLUMNS
+from ecx_analytics.data_processor.feature_registry import FeaturePlan, get_features, FEATURE_NAMES
+
+# the silver columns features are computed from, a correction to any of them invalidates a feature state
+FINGERPRINT_COLUMNS = ['trade_date'] + WINDOW_COLUMNS
+
+
+def process_symbol(feature_store, symbol, incremental=True, state=None):
+    # runs in a worker process, which reads only this symbol's silver partitions itself
+    if incremental:
+        feature_store.update_symbol(symbol, state)
+    else:
+        feature_store.build_symbol(symbol)
+    return symbol
+
 
 class SilverToFeatureStore:
-    def __init__(self, data_path, symbols=['LUBP4','LUBP3','ULK5','UFRAUG']):
+    def __init__(self, data_path, symbols=['LUBP4','LUBP3','ULK5','UFRAUG'], storage=DEFAULT_STORAGE,
+                 start='2012-01-06', end='2018-05-11', features_start='2012-03-01', n_workers=1, features=None):
         self.data_path = data_path
         try:
             self.silver_path = pathlib.Path.joinpath(self.data_path, "silver")
@@ -14,13 +33,28 @@ class SilverToFeatureStore:
             self.feature_store_path = pathlib.Path.joinpath(self.data_path, "feature_store")
         except:
             print(f"Feature store path does not exist! Please create directory")
+        # None builds every symbol found in silver
         self.symbols = symbols
-
-    def load_silver_df(self, filename="ecx_silver.pkl"):
-        file_path = pathlib.Path.joinpath(self.silver_path, filename)
-        df = pd.read_pickle(file_path)
+        self.storage = get_storage(storage)
+        self.start = start
+        self.end = end
+        self.features_start = features_start
+        self.n_workers = n_workers
+        # only these registry features are computed and stored, all of them when None
+        self.plan = FeaturePlan(get_features(features))
+        self.failures = {}
+
+    def load_silver_df(self, name="ecx_silver", columns=['symbol','trade_date','mid_price','spread','volume_ton'], filters=None):
+        df = self.storage.read(self.silver_path, name, columns=columns, filters=filters)
         return df
 
+    def discover_symbols(self, name="ecx_silver"):
+        if self.storage.is_partitioned(self.silver_path, name):
+            symbols = {p['symbol'] for p in self.storage.partitions(self.silver_path, name)}
+        else:
+            symbols = set(self.load_silver_df(name, columns=['symbol'])['symbol'].dropna().unique())
+        return sorted(symbols)
+
     @staticmethod
     def filter_by_date_range(df, start='2012-01-06', end='2018-05-11'):
         return df[(df['trade_date'] >= start) & (df['trade_date'] < end)].copy()
@@ -40,163 +74,253 @@ class SilverToFeatureStore:
 
 
     @staticmethod
-    def calculate_last_price_columns(prices_df, ts_df):
-        prices_df = prices_df.copy()
-        ts_df = ts_df.copy()
-        prices_df['joined_date'] = prices_df['trade_date']
-        df_ = pd.merge_asof(ts_df, prices_df, on='trade_date', suffixes=('','_lagged'), allow_exact_matches=False)
-        df_['last_price_distance'] = (df_['trade_date'] - df_['joined_date']).dt.days
-
-        df_.fillna(method='bfill', inplace=True)
-        df__ = pd.merge_asof(df_, prices_df, left_on='joined_date', right_on='trade_date', suffixes=('','_twice'), allow_exact_matches=False)
-        df__['second_last_price_distance'] = (df__['trade_date'] - df__['joined_date_twice']).dt.days
-
-        return pd.DataFrame({
-            'lag_price':df_['mid_price'].copy(),
-            'lag_distance':df_['last_price_distance'].copy(),
-            'lag_price_twice':df__['mid_price_twice'].copy(),
-            'second_last_price_distance':df__['second_last_price_distance'].copy()
-        }).reset_index(drop=True)
+    def backfill_index(valid):
+        # position of the next valid entry at or after each position, -1 when there is none
+        n = len(valid)
+        index = np.minimum.accumulate(np.where(valid, np.arange(n), n)[::-1])[::-1]
+        return np.where(index < n, index, -1)
 
     @staticmethod
-    def calculate_moving_averages(prices_df, ts_df):
-        prices_df = prices_df.copy()
-        ts_df = ts_df.copy()
-        full_df = pd.merge(ts_df, prices_df, how='left', on='trade_date')
-        full_df.set_index(['trade_date'], inplace=True)
-        # full_df.drop(columns=['trade_date'], inplace=True)
-        ma_30 = full_df.rolling(window=30, min_periods=0, closed='left').mean()
-        std_30 = full_df.rolling(window=30, min_periods=0, closed='left').std().fillna(value=0)
-        count_30 = full_df.rolling(window=30, min_periods=0, closed='left').count()
-        ema_01 = full_df.ewm(alpha=0.1, adjust=False, min_periods=0).mean().shift()
-        ema_03 = full_df.ewm(alpha=0.3, adjust=False, min_periods=0).mean().shift()
-        estd_01 = full_df.ewm(alpha=0.1, adjust=False, min_periods=0).std().shift()
-        estd_03 = full_df.ewm(alpha=0.3, adjust=False, min_periods=0).std().shift()
-
-        # ma_30 = pd.merge(prices_df, ma_30, left_on='trade_date', right_index=True, suffixes=('','_ma_30'))[['mid_price_ma_30']]
-        # std_30 = pd.merge(prices_df, std_30, left_on='trade_date', right_index=True, suffixes=('','_std_30'))[['mid_price_std_30']]
-        # count_30 = pd.merge(prices_df, count_30, left_on='trade_date', right_index=True, suffixes=('','_count_30'))[['mid_price_count_30']]
-        # ema_01 = pd.merge(prices_df, ema_01, left_on='trade_date', right_index=True, suffixes=('','_ema_01'))[['mid_price_ema_01']]
-        # ema_03 = pd.merge(prices_df, ema_03, left_on='trade_date', right_index=True, suffixes=('','_ema_03'))[['mid_price_ema_03']]
-        # estd_01 = pd.merge(prices_df, estd_01, left_on='trade_date', right_index=True, suffixes=('','_estd_01'))[['mid_price_estd_01']]
-        # estd_03 = pd.merge(prices_df, estd_03, left_on='trade_date', right_index=True, suffixes=('','_estd_03'))[['mid_price_estd_03']]
-
-        return pd.concat([
-            ma_30.rename(columns={'mid_price':'mid_price_ma_30'})[['mid_price_ma_30']],
-            std_30.rename(columns={'mid_price':'mid_price_std_30'})[['mid_price_std_30']],
-            count_30.rename(columns={'mid_price':'mid_price_count_30'})[['mid_price_count_30']],
-            ema_01.rename(columns={'mid_price':'mid_price_ema_01'})[['mid_price_ema_01']],
-            ema_03.rename(columns={'mid_price':'mid_price_ema_03'})[['mid_price_ema_03']],
-            estd_01.rename(columns={'mid_price':'mid_price_estd_01'})[['mid_price_estd_01']],
-            estd_03.rename(columns={'mid_price':'mid_price_estd_03'})[['mid_price_estd_03']],
-        ], axis=1).reset_index(drop=True)
-
-        # df_ = pd.DataFrame({
-        #     'ma_30': list(ma_30),
-        #     'std_30': std_30,
-        #     'count_30': count_30,
-        #     'ema_01': ema_01,
-        #     'ema_03': ema_03,
-        #     'estd_01': estd_01,
-        #     'estd_03': estd_03,
-        # }, index=ma_30.index)
-
-        # return df_
+    def lag_price_columns(dates, prices, days):
+        """Last and second last trade before each grid day in `days`, like an
+        as-of join on the trades at `dates` followed by a backfill.
+
+        `dates` and `days` are sorted. Days before the first trade take the
+        first lag that follows them. Returns a dict of column arrays.
+        """
+        def last_before(keys):
+            return np.searchsorted(dates, keys, side='left') - 1
+
+        def distance(i):
+            found = i >= 0
+            return np.where(found, (days - dates[np.maximum(i, 0)]) // np.timedelta64(1, 'D'), np.nan)
+
+        def price(i):
+            return np.where(i >= 0, prices[np.maximum(i, 0)], np.nan)
+
+        last = last_before(days)
+        lag_price = price(last)
+        lag_distance = distance(last)
+        # price, date and distance are each filled from the next day that has them
+        filled = SilverToFeatureStore.backfill_index(~np.isnan(lag_price))
+        lag_price = np.where(filled >= 0, lag_price[np.maximum(filled, 0)], np.nan)
+        filled = SilverToFeatureStore.backfill_index(last >= 0)
+        lag_distance = np.where(filled >= 0, lag_distance[np.maximum(filled, 0)], np.nan)
+        joined = np.where(filled >= 0, last[np.maximum(filled, 0)], -1)
+        second_last = np.where(joined >= 0, last_before(dates[np.maximum(joined, 0)]), -1)
+
+        return {
+            'lag_price': lag_price,
+            'lag_distance': lag_distance,
+            'lag_price_twice': price(second_last),
+            'second_last_price_distance': distance(second_last)
+        }
 
     @staticmethod
-    def calculate_spread_metrics(df, ts_df):
-        df_ = df[['trade_date','spread']].copy()
-        ts_df = ts_df.copy()
-        full_df = pd.merge(ts_df, df_, how='left', on='trade_date')
-        full_df.set_index(['trade_date'], inplace=True)
-
-        mean_df = full_df.rolling(window=30, min_periods=0, closed='left').mean().rename(columns={'spread':'spread_mean'})[['spread_mean']]
-        # spread_df = pd.merge(df_, mean_df, left_on='trade_date', right_index=True, suffixes=('','_mean'))[['spread_mean']]
-
-        return mean_df.reset_index(drop=True)
-
-    @staticmethod
-    def calculate_volume_metrics(df, ts_df):
-        df_ = df[['trade_date','volume_ton']].copy()
-        ts_df = ts_df.copy()
-        full_df = pd.merge(ts_df, df_, how='left', on='trade_date')
-        full_df.set_index(['trade_date'], inplace=True)
-
-        mean_df = full_df.rolling(window=30, min_periods=0, closed='left').mean()
-        total_df = full_df.rolling(window=30, min_periods=0, closed='left').sum()
-
-        mean_df.rename(columns={'volume_ton':'volume_ton_mean'}, inplace=True)
-        total_df.rename(columns={'volume_ton':'volume_ton_sum'}, inplace=True)
-        
-        # mean_df = pd.merge(df_, mean_df, left_on='trade_date', right_index=True, suffixes=('','_mean'))[['volume_ton_mean']]
-        # total_df = pd.merge(df_, total_df, left_on='trade_date', right_index=True, suffixes=('','_sum'))[['volume_ton_sum']]
-
-        return pd.concat([mean_df[['volume_ton_mean']], total_df[['volume_ton_sum']]], axis=1).reset_index(drop=True)
-
-    @staticmethod
-    def get_timestamp_features(ts_df):
-        weekday_number = ts_df['trade_date'].dt.dayofweek
-        month = ts_df['trade_date'].dt.month
-        day_of_month = ts_df['trade_date'].dt.day
-
-        weekday_sin = np.sin(2 * np.pi * weekday_number/6.0)
-        weekday_cos = np.cos(2 * np.pi * weekday_number/6.0)
-
-        month_sin = np.sin(2 * np.pi * month/11.0)
-        month_cos = np.cos(2 * np.pi * month/11.0)
-
-        day_of_month_sin = np.sin(2 * np.pi * day_of_month/31.0)
-        day_of_month_cos = np.cos(2 * np.pi * day_of_month/31.0)
-
-
-        return pd.DataFrame({
-            'weekday_sin': weekday_sin,
-            'weekday_cos': weekday_cos,
-            'month_sin': month_sin,
-            'month_cos': month_cos,
-            'day_of_month_sin': day_of_month_sin,
-            'day_of_month_cos': day_of_month_cos
-        }).reset_index(drop=True)
-
-
-    def append_features(self, df):
+    def calculate_last_price_columns(prices_df, ts_df):
+        prices_df = prices_df.sort_values('trade_date', kind='stable')
+        return SilverToFeatureStore.lag_price_columns(
+            prices_df['trade_date'].to_numpy(dtype='datetime64[ns]'),
+            prices_df['mid_price'].to_numpy(),
+            ts_df['trade_date'].to_numpy(dtype='datetime64[ns]')
+        )
+
+    def new_state(self):
+        return FeatureState(ewm={ewm_key(a): EwmState(a) for a in self.plan.ewm_alphas}, features=self.plan.names)
+
+    def calculate_features(self, ts_df, base_df, prices_df, state):
+        """The planned features of the grid days in `ts_df`, from `base_df`
+        holding the windowed columns of those days and the trades in
+        `prices_df`. `state` carries the windows and EWMs from earlier days
+        and is advanced past ts_df.
+        """
+        lags = self.calculate_last_price_columns(prices_df, ts_df) if self.plan.lags else {}
+        stats, ewm = window_features(base_df[WINDOW_COLUMNS].to_numpy(dtype=np.float64).T, state, self.plan.windows, self.plan.ewm_keys)
+        if self.plan.lags:
+            state.pending_backfill = bool(np.isnan(lags['lag_price'][-1]))
+        return self.plan.frame(ts_df['trade_date'], lags, stats, ewm)
+
+    def extend_features(self, df, state=None):
+        """Features for the days after `state.end` up to the last day in `df`,
+        or for all of `df`'s days when no state is given, and the advanced
+        state. Extending a state gives the same rows as a full rebuild.
+        """
         df = df.copy()
-        start = df['trade_date'].min()
+        state = state or self.new_state()
+        start = df['trade_date'].min() if state.is_empty else state.end + pd.Timedelta(days=1)
         end = df['trade_date'].max()
         ts_df = self.create_ts_df(start, end)
         prices_df = self.get_prices_single(df)
-        lag_df = self.calculate_last_price_columns(prices_df, ts_df)
-        ma_df = self.calculate_moving_averages(prices_df, ts_df)
-        spread_df = self.calculate_spread_metrics(df, ts_df)
-        vol_df = self.calculate_volume_metrics(df, ts_df)
-        t_df = self.get_timestamp_features(ts_df)
-
-        # concatenate calculated features
-        df_ = pd.concat([ts_df, lag_df, ma_df, spread_df, vol_df, t_df], axis=1)
-
-        # add back in target
-        out_df = pd.merge(df[['trade_date','mid_price']], df_, on='trade_date', how='right')
-        # out_df[['symbol', 'warehouse', 'production_year', 'warehouse_name']] = out_df[['symbol', 'warehouse', 'production_year', 'warehouse_name']].bfill()
-        # remove
-        return out_df
+        # the last two trades before the new days are all the lag features look back to
+        context_df = pd.DataFrame({
+            'trade_date': pd.to_datetime([d for d, _ in state.last_trades]),
+            'mid_price': np.array([p for _, p in state.last_trades], dtype=np.float64)
+        })
+        prices_df = pd.concat([context_df, prices_df], ignore_index=True)
+        # the daily grid joined with the inputs once, with the target alongside
+        base_df = pd.merge(ts_df, df[['trade_date'] + WINDOW_COLUMNS], how='left', on='trade_date')
+        features_df = self.calculate_features(ts_df, base_df, prices_df, state)
+        out_df = pd.concat([base_df[['trade_date', 'mid_price']], features_df], axis=1)
+
+        state.end = end
+        state.n_rows += len(df)
+        state.fingerprint = add_fingerprints(state.fingerprint, frame_fingerprint(df[FINGERPRINT_COLUMNS]))
+        state.last_trades = [(d, float(p)) for d, p in zip(prices_df['trade_date'].iloc[-2:], prices_df['mid_price'].iloc[-2:])]
+        return out_df, state
 
+    def append_features(self, df):
+        out_df, _ = self.extend_features(df)
+        return out_df
 
-    def store_targets_as_pickle(self, df, symbol):
-        file_path = pathlib.Path.joinpath(self.feature_store_path, f"{symbol}_with_target_features.pkl")
-        df.to_pickle(file_path)
-
-    def store_complete_as_pickle(self, df, symbol):
-        file_path = pathlib.Path.joinpath(self.feature_store_path, f"{symbol}_complete_features.pkl")
-        df.to_pickle(file_path)
-
-    def run(self):
-        df = self.load_silver_df()
-        df = self.filter_by_date_range(df)
-        for s in self.symbols:
-            df_ = self.filter_by_symbol(df, s)
-            df_ = self.append_features(df_)
-            df_ = self.filter_by_date_range(df_, start='2012-03-01')
-            self.store_complete_as_pickle(df_, s)
-            df_with_targets = df_[df_[['mid_price']].notnull().any(axis=1)]
-            self.store_targets_as_pickle(df_with_targets, s)
-        return True
\ No newline at end of file
+    def append_features_grouped(self, df):
+        """Features and feature state of every symbol in `df`, from one
+        groupby calling `extend_features` on each symbol's rows.
+        """
+        return {s: self.extend_features(g.drop(columns='symbol')) for s, g in df.groupby(df['symbol'].astype(str), sort=True)}
+
+    def store_targets(self, df, symbol):
+        self.storage.write(df.reset_index(drop=True), self.feature_store_path, f"{symbol}_with_target_features")
+
+    def store_complete(self, df, symbol):
+        self.storage.write(df.reset_index(drop=True), self.feature_store_path, f"{symbol}_complete_features")
+
+    def load_complete(self, symbol):
+        return self.storage.read(self.feature_store_path, f"{symbol}_complete_features")
+
+    def load_targets(self, symbol):
+        return self.storage.read(self.feature_store_path, f"{symbol}_with_target_features")
+
+    def feature_state_path(self, symbol):
+        return pathlib.Path.joinpath(self.feature_store_path, f"{symbol}_feature_state.json")
+
+    def silver_filters(self, symbol, after=None, until=None):
+        # only the partitions of this symbol within the date range are read
+        filters = [
+            ('symbol', '==', symbol),
+            ('trade_date', '>=', pd.Timestamp(self.start)),
+            ('trade_date', '<', pd.Timestamp(self.end))
+        ]
+        if after is not None:
+            filters.append(('trade_date', '>', after))
+        if until is not None:
+            filters.append(('trade_date', '<=', until))
+        return filters
+
+    def store_features(self, df, symbol, append=False):
+        df_ = self.filter_by_date_range(df, start=self.features_start, end=self.end)
+        df_with_targets = df_[df_[['mid_price']].notnull().any(axis=1)]
+        if append:
+            df_ = pd.concat([self.load_complete(symbol), df_])
+            df_with_targets = pd.concat([self.load_targets(symbol), df_with_targets])
+        self.store_complete(df_, symbol)
+        self.store_targets(df_with_targets, symbol)
+
+    def build_symbol(self, symbol):
+        df = self.load_silver_df(filters=self.silver_filters(symbol))
+        df = self.filter_by_date_range(df, start=self.start, end=self.end)
+        if df.empty:
+            logging.info(f"No silver rows for {symbol} between {self.start} and {self.end}, skipping")
+            return
+        df, state = self.extend_features(df)
+        self.store_features(df, symbol)
+        state.store(self.feature_state_path(symbol))
+
+    def build_symbols_grouped(self, symbols):
+        df = self.load_silver_df(filters=[
+            ('symbol', 'in', list(symbols)),
+            ('trade_date', '>=', pd.Timestamp(self.start)),
+            ('trade_date', '<', pd.Timestamp(self.end))
+        ])
+        df = self.filter_by_date_range(df, start=self.start, end=self.end)
+        results = self.append_features_grouped(df)
+        for i, s in enumerate(symbols):
+            try:
+                if s not in results:
+                    logging.info(f"No silver rows for {s} between {self.start} and {self.end}, skipping")
+                    continue
+                features_df, state = results[s]
+                self.store_features(features_df, s)
+                state.store(self.feature_state_path(s))
+            except Exception as e:
+                self.record_failure(s, e)
+            logging.info(f"Stored features for {i + 1}/{len(symbols)} symbols ({s})")
+
+    def load_usable_state(self, symbol):
+        state = FeatureState.load(self.feature_state_path(symbol))
+        if state is None or state.pending_backfill or state.fingerprint is None:
+            logging.info(f"No usable feature state for {symbol}, rebuilding its features")
+            return None
+        if (state.features or FEATURE_NAMES) != self.plan.names:
+            logging.info(f"Feature selection of {symbol} changed, rebuilding its features")
+            return None
+        # a corrected report can change silver values without changing the row count
+        consumed = self.load_silver_df(columns=FINGERPRINT_COLUMNS, filters=self.silver_filters(symbol, until=state.end))
+        if len(consumed) != state.n_rows or frame_fingerprint(consumed) != state.fingerprint:
+            logging.warning(f"Silver history of {symbol} changed before {state.end.date()}, rebuilding its features")
+            return None
+        return state
+
+    def update_symbol(self, symbol, state=None):
+        # `state` is a usable state the caller already loaded
+        if state is None:
+            state = self.load_usable_state(symbol)
+        if state is None:
+            return self.build_symbol(symbol)
+        df = self.load_silver_df(filters=self.silver_filters(symbol, after=state.end))
+        if df.empty:
+            logging.info(f"No new silver rows for {symbol} after {state.end.date()}")
+            return
+        df, state = self.extend_features(df, state)
+        self.store_features(df, symbol, append=True)
+        state.store(self.feature_state_path(symbol))
+        logging.info(f"Appended features for {symbol} up to {state.end.date()}")
+
+    def record_failure(self, symbol, error):
+        self.failures[symbol] = f"{type(error).__name__}: {error}"
+        logging.warning(f"Couldn't build features for {symbol}, {self.failures[symbol]}")
+
+    def process_symbols(self, symbols, incremental=True, states={}):
+        for i, s in enumerate(symbols):
+            try:
+                process_symbol(self, s, incremental, states.get(s))
+            except Exception as e:
+                self.record_failure(s, e)
+            logging.info(f"Processed features for {i + 1}/{len(symbols)} symbols ({s})")
+
+    def process_symbols_in_parallel(self, symbols, incremental=True, states={}):
+        with ProcessPoolExecutor(max_workers=self.n_workers) as executor:
+            futures = {executor.submit(process_symbol, self, s, incremental, states.get(s)): s for s in symbols}
+            for i, future in enumerate(as_completed(futures)):
+                s = futures[future]
+                try:
+                    future.result()
+                except Exception as e:
+                    self.record_failure(s, e)
+                logging.info(f"Processed features for {i + 1}/{len(symbols)} symbols ({s})")
+
+    def run(self, incremental=True, grouped=False):
+        symbols = self.symbols if self.symbols is not None else self.discover_symbols()
+        self.failures = {}
+        states = {}
+        if grouped:
+            # symbols needing a full build share one silver read, the rest are extended from the states loaded here
+            states = {s: self.load_usable_state(s) for s in symbols} if incremental else {}
+            stale = [s for s in symbols if states.get(s) is None]
+            try:
+                if stale:
+                    self.build_symbols_grouped(stale)
+                symbols_ = [s for s in symbols if s not in set(stale)]
+            except Exception as e:
+                logging.warning(f"Grouped feature build failed ({e}), building symbols one by one")
+                symbols_ = symbols
+        else:
+            symbols_ = symbols
+        if self.n_workers > 1 and len(symbols_) > 1:
+            self.process_symbols_in_parallel(symbols_, incremental, states)
+        else:
+            self.process_symbols(symbols_, incremental, states)
+        if self.failures:
+            logging.warning(f"Features failed for {len(self.failures)} of {len(symbols)} symbols: {self.failures}")
+        if symbols and len(self.failures) == len(symbols):
+            raise ValueError(f"Features could not be built for any of the {len(symbols)} symbols")
+        return True
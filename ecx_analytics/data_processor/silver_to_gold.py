@@ -1,6 +1,10 @@
 import numpy as np
 import pandas as pd
 import pathlib
+import logging
+
+from ecx_analytics.data_processor.storage import get_storage, DEFAULT_STORAGE, JsonState, frame_fingerprint, add_fingerprints
+from ecx_analytics.data_processor.quantile_sketch import QuantileSketch, RELATIVE_ACCURACY
 
 # aggregates:
 # opening: 'min', 'max', 'std'
@@ -23,8 +27,103 @@ import pathlib
 # symbol, year
 # volume buckets
 
+# gold columns in order, each measure's statistics are stored as <measure>_<statistic>
+AGGREGATES = {
+    'opening_price': ['count', 'min', 'max', 'std'],
+    'closing_price': ['min', 'max', 'std', 'percentile_25', 'percentile_50', 'percentile_100'],
+    'high': ['min', 'max', 'std'],
+    'low': ['min', 'max', 'std'],
+    'change': ['min', 'max', 'std', 'mean'],
+    'spread': ['min', 'max', 'std'],
+    'volume_ton': ['min', 'max', 'mean', 'std', 'percentile_25', 'percentile_50', 'percentile_100', 'sum'],
+    'opening_price_x_volume': ['sum'],
+    'closing_price_x_volume': ['sum'],
+    'high_x_volume': ['sum'],
+    'low_x_volume': ['sum'],
+    'change_x_volume': ['sum'],
+    'spread_x_volume': ['sum'],
+}
+MEASURES = ['opening_price', 'closing_price', 'high', 'low', 'change', 'spread', 'volume_ton']
+WEIGHTED_MEASURES = ['opening_price', 'closing_price', 'high', 'low', 'change', 'spread']
+QUANTILE_MEASURES = ['closing_price', 'volume_ton']
+QUANTILES = [25, 50]
+
+# the finest grain silver is aggregated at, every gold dimension is a roll up of it
+BASE_DIMENSIONS = ['day', 'symbol', 'warehouse_name', 'production_year']
+# the silver columns gold is aggregated from
+SILVER_COLUMNS = ['trade_date'] + BASE_DIMENSIONS[1:] + MEASURES
+# dimension keys computed from the day
+DERIVED_DIMENSIONS = {
+    'month': lambda day: day.dt.month,
+    'year': lambda day: day.dt.year,
+    'day_of_week': lambda day: day.dt.day_name(),
+}
+# gold dimensions in build order and the cube each is rolled up from, None for the base
+ROLLUPS = [
+    ('day', None),
+    ('month', 'day'),
+    ('year', 'day'),
+    ('day_of_week', 'day'),
+    (['symbol', 'year'], None),
+    ('symbol', ['symbol', 'year']),
+    (['warehouse_name', 'year'], None),
+    ('warehouse_name', ['warehouse_name', 'year']),
+    ('production_year', None),
+]
+# how the 25th and 50th percentiles are computed
+QUANTILE_MODES = ['sketch', 'exact']
+
+
+def dimension_keys(dimensions):
+    return [dimensions] if isinstance(dimensions, str) else list(dimensions)
+
+
+def dimension_name(dimensions):
+    return '_'.join(dimension_keys(dimensions))
+
+
+def concat_cubes(cubes):
+    """Rows of several cubes of the same dimensions in one frame, keeping
+    categorical keys categorical with the categories of every cube."""
+    cube = pd.concat(cubes, ignore_index=True)
+    for k in cubes[0].columns:
+        if any(isinstance(c[k].dtype, pd.CategoricalDtype) for c in cubes):
+            cube[k] = pd.api.types.union_categoricals([c[k].astype('category') for c in cubes], ignore_order=True)
+    return cube
+
+
+class GoldState(JsonState):
+    """What the stored gold cubes were built from: the `n_rows` silver rows
+    up to and including `end` and their `fingerprint`, with the `quantiles`
+    mode and the sketch `relative_accuracy`.
+    """
+
+    def __init__(self, end=None, n_rows=0, quantiles='sketch', relative_accuracy=RELATIVE_ACCURACY, fingerprint=None):
+        self.end = None if end is None else pd.Timestamp(end)
+        # silver rows consumed so far, used to spot history rewritten underneath the cubes
+        self.n_rows = n_rows
+        self.fingerprint = fingerprint
+        self.quantiles = quantiles
+        self.relative_accuracy = relative_accuracy
+
+    def to_dict(self):
+        return {
+            'end': None if self.end is None else self.end.isoformat(),
+            'n_rows': self.n_rows,
+            'quantiles': self.quantiles,
+            'relative_accuracy': self.relative_accuracy,
+            'fingerprint': self.fingerprint
+        }
+
+    @classmethod
+    def from_dict(cls, d):
+        return cls(**d)
+
+
 class SilverToGold:
-    def __init__(self, data_path):
+    def __init__(self, data_path, storage=DEFAULT_STORAGE, quantiles='sketch', relative_accuracy=RELATIVE_ACCURACY):
+        if quantiles not in QUANTILE_MODES:
+            raise ValueError(f'quantiles must be one of {QUANTILE_MODES}')
         self.data_path = data_path
         try:
             self.silver_path = pathlib.Path.joinpath(self.data_path, "silver")
@@ -34,80 +133,249 @@ class SilverToGold:
             self.gold_path = pathlib.Path.joinpath(self.data_path, "gold")
         except:
             print(f"Gold path does not exist! Please create directory")
+        self.storage = get_storage(storage)
+        self.quantiles = quantiles
+        self.sketch = QuantileSketch(relative_accuracy)
 
-    def load_silver_df(self, filename="ecx_silver.pkl"):
-        file_path = pathlib.Path.joinpath(self.silver_path, filename)
-        df = pd.read_pickle(file_path)
+    def load_silver_df(self, name="ecx_silver", columns=None, filters=None):
+        df = self.storage.read(self.silver_path, name, columns=columns, filters=filters)
         return df
-    
+
     @staticmethod
-    def percentile(n):
-        def percentile_(x):
-            return np.percentile(x, n)
-        percentile_.__name__ = 'percentile_%s' % n
-        return percentile_
+    def add_dimension_columns(df):
+        df = df.copy()
+        df['day'] = df['trade_date'].dt.normalize()
+        for k, derive in DERIVED_DIMENSIONS.items():
+            df[k] = derive(df['day'])
+        return df
 
-    def create_aggregate(self, df, dimensions):
-        df['opening_price_x_volume'] = df['opening_price'] * df['volume_ton']
-        df['closing_price_x_volume'] = df['closing_price'] * df['volume_ton']
-        df['high_x_volume'] = df['high'] * df['volume_ton']
-        df['low_x_volume'] = df['low'] * df['volume_ton']
-        df['change_x_volume'] = df['change'] * df['volume_ton']
-        df['spread_x_volume'] = df['spread'] * df['volume_ton']
-
-        agg_dict = {
-            'opening_price': ['count','min', 'max', 'std'],
-            'closing_price': ['min', 'max', 'std', self.percentile(25), self.percentile(50), self.percentile(100)],
-            'high': ['min', 'max', 'std'],
-            'low': ['min', 'max', 'std'],
-            'change': ['min', 'max', 'std', 'mean'],
-            'spread': ['min', 'max', 'std'],
-            'volume_ton': ['min', 'max', 'mean', 'std', self.percentile(25), self.percentile(50), self.percentile(100), 'sum'],
-            'opening_price_x_volume': ['sum'],
-            'closing_price_x_volume': ['sum'],
-            'high_x_volume': ['sum'],
-            'low_x_volume': ['sum'],
-            'change_x_volume': ['sum'],
-            'spread_x_volume': ['sum'],
-        }
+    @staticmethod
+    def create_partials(df):
+        """Mergeable partial aggregates of silver at the base grain: per
+        measure the count, sum, sum of squared deviations from the mean
+        (m2), min and max, and the sums of each price times volume.
+        """
+        values = df[MEASURES].astype(np.float64)
+        for c in WEIGHTED_MEASURES:
+            values[f'{c}_x_volume'] = values[c] * values['volume_ton']
+        keys = [df['trade_date'].dt.normalize().rename('day')] + [df[k] for k in BASE_DIMENSIONS[1:]]
+        # missing keys are kept here, each roll up drops only its own
+        g = values.groupby(keys, dropna=False, observed=True, sort=True)
+        count, total = g[MEASURES].count(), g.sum()
+        var = g[MEASURES].var()
+        partials = pd.concat([
+            count.add_suffix('__count'),
+            total.add_suffix('__sum'),
+            (var * (count - 1)).where(count > 1, 0.0).add_suffix('__m2'),
+            g[MEASURES].min().add_suffix('__min'),
+            g[MEASURES].max().add_suffix('__max'),
+        ], axis=1)
+        return partials.reset_index()
 
-        agg_df = df.groupby(dimensions).agg(agg_dict)
+    def create_sketches(self, df):
+        """Quantile sketches of silver at the base grain."""
+        return self.sketch.create(df, BASE_DIMENSIONS, QUANTILE_MEASURES)
 
-        agg_df['weighted_mean_opening_price'] = agg_df['opening_price_x_volume_sum'] / agg_df['sum_volume_ton']
-        agg_df['weighted_mean_closing_price'] = agg_df['closing_price_x_volume_sum'] / agg_df['sum_volume_ton']
-        agg_df['weighted_mean_high'] = agg_df['high_x_volume_sum'] / agg_df['sum_volume_ton']
-        agg_df['weighted_mean_low'] = agg_df['low_x_volume_sum'] / agg_df['sum_volume_ton']
-        agg_df['weighted_mean_change'] = agg_df['change_x_volume_sum'] / agg_df['sum_volume_ton']
-        agg_df['weighted_mean_spread'] = agg_df['spread_x_volume_sum'] / agg_df['sum_volume_ton']
+    @staticmethod
+    def cube_keys(cube, dimensions):
+        """Which rows of a finer cube have every key of `dimensions`, and those keys."""
+        keys = pd.concat([cube[k] if k in cube else DERIVED_DIMENSIONS[k](cube['day']).rename(k) for k in dimension_keys(dimensions)], axis=1)
+        # rows missing a key of these dimensions belong to no cell
+        present = keys.notnull().all(axis=1).to_numpy()
+        return present, [keys.loc[present, k] for k in keys.columns]
 
+    @staticmethod
+    def roll_up(partials, dimensions):
+        """Partials of the coarser `dimensions`, merged from finer partials
+        without going back to silver. Counts, sums, mins and maxes merge
+        directly and m2 with the parallel variance update.
+        """
+        present, keys = SilverToGold.cube_keys(partials, dimensions)
+        partials = partials[present]
+        counts = [f'{c}__count' for c in MEASURES]
+        sums = [f'{c}__sum' for c in MEASURES]
+        g = partials.groupby(keys, observed=True, sort=True)
+        count = partials[counts].to_numpy()
+        mean = partials[sums].to_numpy() / np.where(count > 0, count, 1)
+        group_mean = g[sums].transform('sum').to_numpy() / np.maximum(g[counts].transform('sum').to_numpy(), 1)
+        # each part's m2 plus its count times the squared distance of its mean from the merged mean
+        m2 = partials[[f'{c}__m2' for c in MEASURES]] + np.where(count > 0, count * (mean - group_mean) ** 2, 0.0)
+        rolled = pd.concat([
+            g[counts].sum(),
+            g[[c for c in partials.columns if c.endswith('__sum')]].sum(),
+            m2.groupby(keys, observed=True, sort=True).sum(),
+            g[[f'{c}__min' for c in MEASURES]].min(),
+            g[[f'{c}__max' for c in MEASURES]].max(),
+        ], axis=1)
+        return rolled.reset_index()
+
+    def roll_up_sketches(self, sketches, dimensions):
+        present, keys = self.cube_keys(sketches, dimensions)
+        return self.sketch.merge(sketches[present], keys)
+
+    @staticmethod
+    def create_quantiles(df, dimensions):
+        # vectorised grouped quantiles, linear interpolation like np.percentile
+        keys = dimension_keys(dimensions)
+        quantiles = df.groupby(keys, observed=True, sort=True)[QUANTILE_MEASURES].quantile([q / 100 for q in QUANTILES]).unstack()
+        quantiles.columns = [f'{c}_percentile_{round(q * 100)}' for c, q in quantiles.columns]
+        return quantiles
 
+    @staticmethod
+    def finalize(partials, quantiles, dimensions):
+        """Gold statistics from rolled up partials, indexed by the dimensions."""
+        partials = partials.set_index(dimension_keys(dimensions))
+        stats = {}
+        for c in MEASURES:
+            count = partials[f'{c}__count']
+            stats[f'{c}_count'] = count
+            stats[f'{c}_sum'] = partials[f'{c}__sum']
+            stats[f'{c}_mean'] = partials[f'{c}__sum'] / count.where(count > 0)
+            stats[f'{c}_std'] = np.sqrt(partials[f'{c}__m2'] / (count - 1).where(count > 1))
+            stats[f'{c}_min'] = partials[f'{c}__min']
+            stats[f'{c}_max'] = partials[f'{c}__max']
+            stats[f'{c}_percentile_100'] = partials[f'{c}__max']
+        for c in WEIGHTED_MEASURES:
+            stats[f'{c}_x_volume_sum'] = partials[f'{c}_x_volume__sum']
+        for c in quantiles.columns:
+            stats[c] = quantiles[c].reindex(partials.index)
+        agg_df = pd.DataFrame({f'{c}_{s}': stats[f'{c}_{s}'] for c, aggregates in AGGREGATES.items() for s in aggregates})
+        for c in WEIGHTED_MEASURES:
+            agg_df[f'weighted_mean_{c}'] = agg_df[f'{c}_x_volume_sum'] / agg_df['volume_ton_sum']
         return agg_df
 
-    def store_as_pickle(self, agg_df, dimensions):
+    def create_aggregate(self, df, dimensions):
+        df = self.add_dimension_columns(df)
+        partials = self.roll_up(self.create_partials(df), dimensions)
+        if self.quantiles == 'exact':
+            quantiles = self.create_quantiles(df, dimensions)
+        else:
+            sketches = self.roll_up_sketches(self.create_sketches(df), dimensions)
+            quantiles = self.sketch.quantiles(sketches, dimension_keys(dimensions), QUANTILE_MEASURES, QUANTILES)
+        return self.finalize(partials, quantiles, dimensions)
+
+    def roll_up_cube(self, partials, sketches=None):
+        """Partials and sketches of every gold dimension, each rolled up
+        from the smallest finer cube: the day level cubes from the day cube
+        and symbol and warehouse from their per year cubes.
+        """
+        cubes = {None: (partials, sketches)}
+        for dimensions, parent in ROLLUPS:
+            partials, sketches = cubes[parent if parent is None else dimension_name(parent)]
+            cubes[dimension_name(dimensions)] = (self.roll_up(partials, dimensions),
+                                                 None if sketches is None else self.roll_up_sketches(sketches, dimensions))
+        del cubes[None]
+        return cubes
+
+    def finalize_cube(self, cubes, df=None):
+        """Gold aggregates of the rolled up cubes. Exact quantiles go back to
+        the silver `df`, sketched quantiles come from the cubes."""
+        aggregates = {}
+        for dimensions, _ in ROLLUPS:
+            partials, sketches = cubes[dimension_name(dimensions)]
+            if self.quantiles == 'exact':
+                quantiles = self.create_quantiles(df, dimensions)
+            else:
+                quantiles = self.sketch.quantiles(sketches, dimension_keys(dimensions), QUANTILE_MEASURES, QUANTILES)
+            aggregates[dimension_name(dimensions)] = self.finalize(partials, quantiles, dimensions)
+        return aggregates
+
+    def create_base(self, df):
+        """Partials and, unless quantiles are exact, sketches of silver at the base grain."""
+        return self.create_partials(df), None if self.quantiles == 'exact' else self.create_sketches(df)
+
+    def create_cube(self, df):
+        """Every gold aggregate from one pass over silver at the base grain."""
+        df = self.add_dimension_columns(df)
+        return self.finalize_cube(self.roll_up_cube(*self.create_base(df)), df)
+
+    def store_aggregate(self, agg_df, dimensions):
         if isinstance(dimensions, str):
-            filename = dimensions
+            name = dimensions
         elif isinstance(dimensions, list):
-            filename = dimensions.join('_')
+            name = '_'.join(dimensions)
         else:
             raise Exception('String or List not passed')
-        filename += ".pkl"
-        file_path = pathlib.Path.joinpath(self.gold_path, filename)
-        agg_df.to_pickle(file_path)
-
-    def run(self, df):
-        df['day_of_week'] = df['trade_date'].dt.day_name()
-        df['month'] = df['trade_date'].dt.month
-        df['year'] = df['trade_date'].dt.year
-        for d in [
-            'day',
-            'month',
-            'year',
-            'day_of_week',
-            'symbol',
-            'warehouse_name',
-            'production year',
-            ['warehouse_name', 'year'],
-            ['symbol', 'year']
-        ]:
-            agg_df = self.create_aggregate(df, d)
-            self.store_as_pickle(agg_df, d)
\ No newline at end of file
+        if isinstance(agg_df.columns, pd.MultiIndex):
+            agg_df = agg_df.copy()
+            agg_df.columns = ['_'.join(c) for c in agg_df.columns]
+        self.storage.write(agg_df, self.gold_path, name.replace(' ', '_'))
+
+    def gold_state_path(self):
+        return pathlib.Path.joinpath(self.gold_path, "gold_state.json")
+
+    def load_cube(self, name):
+        sketches = self.storage.read(self.gold_path, f"{name}_sketch") if self.quantiles == 'sketch' else None
+        return self.storage.read(self.gold_path, f"{name}_partials"), sketches
+
+    def store_cube(self, cube, name):
+        partials, sketches = cube
+        self.storage.write(partials, self.gold_path, f"{name}_partials")
+        if sketches is not None:
+            self.storage.write(sketches, self.gold_path, f"{name}_sketch")
+
+    def merge_cube(self, stored, new, dimensions):
+        """A stored cube with the cells of a cube of newer silver merged into it."""
+        partials = self.roll_up(concat_cubes([stored[0], new[0]]), dimensions)
+        if stored[1] is None:
+            return partials, None
+        return partials, self.roll_up_sketches(concat_cubes([stored[1], new[1]]), dimensions)
+
+    def load_usable_state(self):
+        state = GoldState.load(self.gold_state_path())
+        if self.quantiles == 'exact':
+            logging.info("Exact gold quantiles need the whole silver history, rebuilding gold")
+            return None
+        if state is None or pd.isnull(state.end) or state.fingerprint is None or state.quantiles != self.quantiles or state.relative_accuracy != self.sketch.relative_accuracy:
+            logging.info("No usable gold state, rebuilding gold")
+            return None
+        names = [dimension_name(d) for d, _ in ROLLUPS]
+        if not all(self.storage.exists(self.gold_path, f"{n}_{s}") for n in names for s in ['partials', 'sketch']):
+            logging.info("Stored gold cubes are incomplete, rebuilding gold")
+            return None
+        # a corrected report can change silver values without changing the row count
+        consumed = self.load_silver_df(columns=SILVER_COLUMNS, filters=[('trade_date', '<=', state.end)])
+        if len(consumed) != state.n_rows or frame_fingerprint(consumed) != state.fingerprint:
+            logging.warning(f"Silver history changed before {state.end.date()}, rebuilding gold")
+            return None
+        return state
+
+    def store_gold(self, cubes, df, state):
+        for name, agg_df in self.finalize_cube(cubes, df).items():
+            self.store_aggregate(agg_df, name)
+            self.store_cube(cubes[name], name)
+            logging.info(f"Stored gold aggregate by {name} ({len(agg_df)} rows)")
+        state.store(self.gold_state_path())
+
+    def build(self, df):
+        fingerprint = frame_fingerprint(df[SILVER_COLUMNS])
+        df = self.add_dimension_columns(df)
+        cubes = self.roll_up_cube(*self.create_base(df))
+        state = GoldState(df['trade_date'].max(), len(df), self.quantiles, self.sketch.relative_accuracy, fingerprint)
+        self.store_gold(cubes, df, state)
+
+    def update(self, state):
+        """Aggregates only the silver rows after the state's end and merges
+        them into the stored cubes, every other cell is left as stored."""
+        df = self.load_silver_df(columns=SILVER_COLUMNS, filters=[('trade_date', '>', state.end)])
+        if df.empty:
+            logging.info(f"No new silver rows after {state.end.date()}")
+            return
+        fingerprint = add_fingerprints(state.fingerprint, frame_fingerprint(df))
+        df = self.add_dimension_columns(df)
+        new = self.roll_up_cube(*self.create_base(df))
+        cubes = {}
+        for dimensions, _ in ROLLUPS:
+            name = dimension_name(dimensions)
+            cubes[name] = self.merge_cube(self.load_cube(name), new[name], dimensions)
+        state = GoldState(max(state.end, df['trade_date'].max()), state.n_rows + len(df), self.quantiles, self.sketch.relative_accuracy, fingerprint)
+        self.store_gold(cubes, None, state)
+        logging.info(f"Merged {len(df)} silver rows into gold up to {state.end.date()}")
+
+    def run(self, df=None, incremental=True):
+        if df is None:
+            state = self.load_usable_state() if incremental else None
+            if state is not None:
+                return self.update(state)
+            df = self.load_silver_df(columns=SILVER_COLUMNS)
+        self.build(df)
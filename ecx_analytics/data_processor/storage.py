@@ -0,0 +1,320 @@
+import json
+import os
+import pandas as pd
+import pathlib
+import logging
+import shutil
+
+# filters use the pyarrow DNF convention: a list of (column, op, value) tuples
+# that must all hold, e.g. [('symbol', 'in', ['LUBP4']), ('trade_date', '>=', ts)]
+FILTER_OPS = {
+    '==': lambda s, v: s == v,
+    '=': lambda s, v: s == v,
+    '!=': lambda s, v: s != v,
+    '<': lambda s, v: s < v,
+    '<=': lambda s, v: s <= v,
+    '>': lambda s, v: s > v,
+    '>=': lambda s, v: s >= v,
+    'in': lambda s, v: s.isin(v),
+    'not in': lambda s, v: ~s.isin(v),
+}
+
+
+def read_json(path):
+    """The JSON document at `path`, None when there is none."""
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_json(obj, path, **kwargs):
+    # written aside and swapped in, so a failed write leaves the previous document;
+    # floats are written with repr so stored states round-trip exactly
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w') as f:
+        json.dump(obj, f, indent=2, **kwargs)
+    os.replace(tmp_path, path)
+
+
+def frame_fingerprint(df):
+    """A fingerprint of the rows of `df` regardless of their order, the sum of
+    the row hashes modulo 2**64, so the fingerprint of rows added later can be
+    added to it with `add_fingerprints`."""
+    return int(pd.util.hash_pandas_object(df, index=False).to_numpy().sum(dtype='uint64'))
+
+
+def add_fingerprints(a, b):
+    return (a + b) % 2 ** 64
+
+
+class JsonState:
+    """Load and store for pipeline states kept as JSON next to their outputs,
+    subclasses provide `to_dict` and `from_dict`."""
+
+    @classmethod
+    def load(cls, path):
+        d = read_json(path)
+        return None if d is None else cls.from_dict(d)
+
+    def store(self, path):
+        write_json(self.to_dict(), path)
+
+
+# partitioned datasets are laid out as <name>/symbol=<symbol>/year=<year>/part<ext>
+PARTITION_COLS = ['symbol', 'year']
+PARTITION_DATE_COL = 'trade_date'
+
+
+def apply_filters(df, filters):
+    if not filters:
+        return df
+    mask = pd.Series(True, index=df.index)
+    for column, op, value in filters:
+        mask &= FILTER_OPS[op](df[column], value)
+    return df[mask]
+
+
+def partition_values(df, date_col=PARTITION_DATE_COL):
+    return [df['symbol'], df[date_col].dt.year.rename('year')]
+
+
+def year_may_match(year, op, value):
+    # conservative: keeps every year that could hold a matching date
+    if op == 'in':
+        return year in {pd.Timestamp(v).year for v in value}
+    if op == 'not in':
+        return True
+    value = pd.Timestamp(value)
+    if op in ('==', '='):
+        return year == value.year
+    if op in ('>', '>='):
+        return year >= value.year
+    if op == '<':
+        return year < value.year or (year == value.year and value > pd.Timestamp(year=year, month=1, day=1))
+    if op == '<=':
+        return year <= value.year
+    return True
+
+
+def value_matches(x, op, value):
+    if op == 'in':
+        return x in value
+    if op == 'not in':
+        return x not in value
+    return FILTER_OPS[op](x, value)
+
+
+def filtered_symbols(filters):
+    # symbols pinned down by the filters, None when any symbol may match
+    symbols = None
+    for column, op, value in filters or []:
+        if column == 'symbol' and op in ('==', '=', 'in'):
+            values = set(value) if op == 'in' else {value}
+            symbols = values if symbols is None else symbols & values
+    return symbols
+
+
+def partition_matches(partition, filters, date_col=PARTITION_DATE_COL):
+    for column, op, value in filters or []:
+        if column == 'symbol':
+            if not value_matches(partition['symbol'], op, value):
+                return False
+        elif column == date_col:
+            if not year_may_match(partition['year'], op, value):
+                return False
+    return True
+
+
+class PartitionedStorage:
+    """Storage of a frame as a directory of symbol/year partitions.
+
+    Reads only open the partition files whose symbol and year can satisfy
+    the filters, so a per-symbol query costs the size of that symbol's
+    history rather than the whole exchange's. Each partition file is a
+    regular frame of the backend's format, so projection and pushdown
+    within a partition still apply.
+    """
+
+    def path(self, directory, name):
+        return pathlib.Path.joinpath(directory, f"{name}{self.extension}")
+
+    def dataset_path(self, directory, name):
+        return pathlib.Path.joinpath(directory, name)
+
+    def is_partitioned(self, directory, name):
+        return self.dataset_path(directory, name).is_dir()
+
+    def partitions(self, directory, name, symbols=None):
+        dataset_path = self.dataset_path(directory, name)
+        if symbols is None:
+            symbol_dirs = dataset_path.glob('symbol=*')
+        else:
+            # look up the wanted symbols directly rather than listing every symbol
+            symbol_dirs = [p for p in (pathlib.Path.joinpath(dataset_path, f"symbol={s}") for s in symbols) if p.is_dir()]
+        partitions = []
+        for symbol_dir in sorted(symbol_dirs):
+            for year_dir in sorted(symbol_dir.glob('year=*')):
+                partitions.append({
+                    'symbol': symbol_dir.name.split('=', 1)[1],
+                    'year': int(year_dir.name.split('=', 1)[1]),
+                    'path': year_dir
+                })
+        return partitions
+
+    def read_partitioned(self, directory, name, columns=None, filters=None):
+        partitions = self.partitions(directory, name, symbols=filtered_symbols(filters))
+        selected = [p for p in partitions if partition_matches(p, filters)]
+        logging.info(f"Reading {len(selected)} partitions of {name}")
+        if not selected:
+            # an empty frame with the dataset's columns and dtypes
+            any_partitions = partitions or self.partitions(directory, name)
+            if not any_partitions:
+                raise FileNotFoundError(f"No partitions found in {self.dataset_path(directory, name)}")
+            return self.read_file(any_partitions[0]['path'], 'part', columns=columns).iloc[0:0]
+        return pd.concat([
+            self.read_file(p['path'], 'part', columns=columns, filters=filters)
+            for p in selected
+        ])
+
+    def staging_path(self, directory, name):
+        return pathlib.Path.joinpath(directory, f"{name}.staging")
+
+    def begin_partitioned(self, directory, name):
+        staging_path = self.staging_path(directory, name)
+        if staging_path.exists():
+            shutil.rmtree(staging_path)
+        staging_path.mkdir(parents=True)
+        return staging_path
+
+    def write_partition(self, df, staging_path, symbol, year):
+        part_path = pathlib.Path.joinpath(staging_path, f"symbol={symbol}", f"year={year}")
+        part_path.mkdir(parents=True)
+        self.write(df, part_path, 'part')
+
+    def commit_partitioned(self, directory, name):
+        # swap the whole dataset in at once so readers never see a partial write
+        dataset_path = self.dataset_path(directory, name)
+        if dataset_path.exists():
+            shutil.rmtree(dataset_path)
+        self.staging_path(directory, name).rename(dataset_path)
+
+    def write_partitioned(self, df, directory, name, date_col=PARTITION_DATE_COL):
+        staging_path = self.begin_partitioned(directory, name)
+        for (symbol, year), part in df.groupby(partition_values(df, date_col), sort=True, observed=True):
+            self.write_partition(part, staging_path, symbol, year)
+        self.commit_partitioned(directory, name)
+
+    def iter_chunks(self, directory, name, chunk_rows, columns=None):
+        if self.is_partitioned(directory, name):
+            for p in self.partitions(directory, name):
+                yield from self.iter_file_chunks(p['path'], 'part', chunk_rows, columns=columns)
+        else:
+            yield from self.iter_file_chunks(directory, name, chunk_rows, columns=columns)
+
+    def exists(self, directory, name):
+        return self.is_partitioned(directory, name) or self.path(directory, name).exists()
+
+    def read(self, directory, name, columns=None, filters=None):
+        if self.is_partitioned(directory, name):
+            return self.read_partitioned(directory, name, columns=columns, filters=filters)
+        return self.read_file(directory, name, columns=columns, filters=filters)
+
+
+class PickleStorage(PartitionedStorage):
+    """Legacy storage, whole frames pickled and filtered after loading."""
+
+    name = 'pickle'
+    extension = '.pkl'
+
+    def read_file(self, directory, name, columns=None, filters=None):
+        df = pd.read_pickle(self.path(directory, name))
+        df = apply_filters(df, filters)
+        if columns is not None:
+            df = df[columns]
+        return df
+
+    def iter_file_chunks(self, directory, name, chunk_rows, columns=None):
+        # pickles cannot be read partially, chunking only bounds what is processed at once
+        df = self.read_file(directory, name, columns=columns)
+        for start in range(0, len(df), chunk_rows):
+            yield df.iloc[start:start + chunk_rows].copy()
+
+    def write(self, df, directory, name):
+        df.to_pickle(self.path(directory, name))
+
+
+class ParquetStorage(PartitionedStorage):
+    """Compressed columnar storage.
+
+    Only the requested columns are decoded and filters are pushed down to
+    skip whole row groups using their min/max statistics, which works best
+    when frames are written sorted on the filtered columns.
+    """
+
+    name = 'parquet'
+    extension = '.parquet'
+
+    def __init__(self, compression='zstd', row_group_size=100000):
+        self.compression = compression
+        self.row_group_size = row_group_size
+
+    def exists(self, directory, name):
+        return super().exists(directory, name) or PickleStorage().exists(directory, name)
+
+    def read_file(self, directory, name, columns=None, filters=None):
+        file_path = self.path(directory, name)
+        if not file_path.exists() and PickleStorage().exists(directory, name):
+            logging.warning(f"{file_path} not found, reading legacy pickle instead")
+            return PickleStorage().read(directory, name, columns=columns, filters=filters)
+        return pd.read_parquet(file_path, engine='pyarrow', columns=columns, filters=filters or None)
+
+    def iter_file_chunks(self, directory, name, chunk_rows, columns=None):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        file_path = self.path(directory, name)
+        if not file_path.exists() and PickleStorage().exists(directory, name):
+            logging.warning(f"{file_path} not found, reading legacy pickle instead")
+            yield from PickleStorage().iter_file_chunks(directory, name, chunk_rows, columns=columns)
+            return
+        parquet_file = pq.ParquetFile(file_path)
+        index_columns = (parquet_file.schema_arrow.pandas_metadata or {}).get('index_columns', [])
+        if columns is not None:
+            # keep the stored index columns so chunks carry the same index as a full read
+            columns = list(columns) + [c for c in index_columns if isinstance(c, str)]
+        # a RangeIndex is stored as metadata only, each batch would restart it at 0
+        range_index = next((c for c in index_columns if isinstance(c, dict) and c.get('kind') == 'range'), None)
+        offset = 0
+        for batch in parquet_file.iter_batches(batch_size=chunk_rows, columns=columns):
+            df = pa.Table.from_batches([batch]).to_pandas()
+            if range_index is not None:
+                step = range_index['step']
+                start = range_index['start'] + offset * step
+                df.index = pd.RangeIndex(start, start + len(df) * step, step, name=range_index['name'])
+            offset += len(df)
+            yield df
+
+    def write(self, df, directory, name):
+        df.to_parquet(
+            self.path(directory, name),
+            engine='pyarrow',
+            compression=self.compression,
+            row_group_size=self.row_group_size
+        )
+
+
+STORAGE_BACKENDS = {
+    PickleStorage.name: PickleStorage,
+    ParquetStorage.name: ParquetStorage,
+}
+
+DEFAULT_STORAGE = ParquetStorage.name
+
+
+def get_storage(storage=DEFAULT_STORAGE):
+    if not isinstance(storage, str):
+        return storage
+    try:
+        return STORAGE_BACKENDS[storage]()
+    except KeyError:
+        raise ValueError(f"Unknown storage backend {storage}, choose one of {list(STORAGE_BACKENDS)}")
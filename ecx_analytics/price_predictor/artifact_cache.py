@@ -0,0 +1,100 @@
+import threading
+import logging
+from collections import OrderedDict
+
+
+class ArtifactCache:
+    """Process-wide LRU cache of per-symbol prediction artifacts.
+
+    Entries are produced by the loader passed to `get` and held until the
+    cache grows past `max_size`, at which point the least recently used
+    symbol is evicted. Concurrent misses on the same symbol only load once.
+    When a `fingerprint` is passed to `get`, an entry loaded under a
+    different fingerprint is treated as stale and reloaded.
+    """
+
+    def __init__(self, max_size=32):
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1')
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.reloads = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def _lookup(self, key, fingerprint):
+        with self._lock:
+            if key in self._entries:
+                entry_fingerprint, value = self._entries[key]
+                if fingerprint is None or entry_fingerprint == fingerprint:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return True, value
+        return False, None
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def get(self, key, loader, fingerprint=None):
+        found, value = self._lookup(key, fingerprint)
+        if found:
+            return value
+        with self._key_lock(key):
+            # another thread may have loaded the key while we waited
+            found, value = self._lookup(key, fingerprint)
+            if found:
+                return value
+            value = loader(key)
+            with self._lock:
+                self.misses += 1
+                if key in self._entries:
+                    self.reloads += 1
+                    logging.info(f'Reloaded changed artifacts for {key}')
+                self._entries[key] = (fingerprint, value)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_size:
+                    evicted, _ = self._entries.popitem(last=False)
+                    self._key_locks.pop(evicted, None)
+                    self.evictions += 1
+                    logging.info(f'Evicted artifacts for {evicted} from cache')
+        return value
+
+    def preload(self, keys, loader, fingerprint=None):
+        keys = list(keys)
+        if len(keys) > self.max_size:
+            logging.warning(f'Preloading {len(keys)} keys into a cache of size {self.max_size}, earliest keys will be evicted')
+        for k in keys:
+            self.get(k, loader, None if fingerprint is None else fingerprint(k))
+        logging.info(f'Preloaded artifacts for {keys}, cache stats {self.stats()}')
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._key_locks.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'reloads': self.reloads,
+                'hit_ratio': self.hits / lookups if lookups else 0.0
+            }
@@ -0,0 +1,64 @@
+import numpy as np
+
+
+class FeatureMatrix:
+    """Dense, read-only feature store for a single symbol.
+
+    Row `i` holds the features for `start + i` days and `columns` is the
+    column-order manifest shared with the model, so looking up a date is a
+    subtraction and a slice rather than a scan of the feature frame.
+    """
+
+    def __init__(self, values, columns, start):
+        values = np.ascontiguousarray(values, dtype=np.float64)
+        values.setflags(write=False)
+        self.values = values
+        self.columns = tuple(columns)
+        self.start = np.datetime64(start, 'D')
+
+    @classmethod
+    def from_df(cls, df, target_col='mid_price', drop_cols=['trade_date'], date_col='trade_date'):
+        dates = df[date_col].to_numpy(dtype='datetime64[ns]').astype('datetime64[D]')
+        start = dates.min()
+        offsets = (dates - start).astype(np.int64)
+        columns = [c for c in df.columns if c not in [target_col] + drop_cols]
+        values = np.full((offsets.max() + 1, len(columns)), np.nan)
+        values[offsets] = df[columns].to_numpy(dtype=np.float64)
+        return cls(values, columns, start)
+
+    def __len__(self):
+        return self.values.shape[0]
+
+    @property
+    def end(self):
+        return self.start + np.timedelta64(len(self) - 1, 'D')
+
+    def offset(self, target_date):
+        offset = int((np.datetime64(target_date, 'D') - self.start).astype(np.int64))
+        if offset < 0 or offset >= len(self):
+            raise KeyError(f'No features for {target_date}, feature store covers {self.start} to {self.end}')
+        return offset
+
+    def row(self, target_date):
+        offset = self.offset(target_date)
+        return self.values[offset:offset + 1]
+
+    def rows(self, start, end):
+        start_offset, end_offset = self.offset(start), self.offset(end)
+        if end_offset < start_offset:
+            raise ValueError(f'Range start {start} is after range end {end}')
+        return self.values[start_offset:end_offset + 1]
+
+    def dates(self, start, end):
+        return np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D') + np.timedelta64(1, 'D'))
+
+    def column_indices(self, columns):
+        return column_indices(self.columns, columns)
+
+
+def column_indices(manifest, columns):
+    lookup = {c: i for i, c in enumerate(manifest)}
+    missing = [c for c in columns if c not in lookup]
+    if missing:
+        raise KeyError(f'Unknown features {missing}, available features are {list(manifest)}')
+    return [lookup[c] for c in columns]
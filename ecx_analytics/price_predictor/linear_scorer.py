@@ -0,0 +1,73 @@
+import numpy as np
+
+
+class LinearScorer:
+    """Scores a trained linear model as `X @ coef + intercept`.
+
+    Holds only the coefficients, intercept and the feature order they were
+    fitted on, so scoring needs neither scikit-learn nor an unpickled
+    estimator.
+    """
+
+    def __init__(self, coef, intercept, feature_names):
+        coef = np.ascontiguousarray(coef, dtype=np.float64).ravel()
+        if len(coef) != len(feature_names):
+            raise ValueError(f'{len(coef)} coefficients supplied for {len(feature_names)} features')
+        coef.setflags(write=False)
+        self.coef = coef
+        self.intercept = float(intercept)
+        self.feature_names = tuple(feature_names)
+
+    @classmethod
+    def from_estimator(cls, model, feature_names):
+        return cls(model.coef_, model.intercept_, feature_names)
+
+    @classmethod
+    def load(cls, file_path):
+        with np.load(file_path, allow_pickle=False) as artifact:
+            return cls(artifact['coef'], artifact['intercept'], [str(f) for f in artifact['feature_names']])
+
+    def save(self, file_path):
+        with open(file_path, 'wb') as f:
+            np.savez(
+                f,
+                coef=self.coef,
+                intercept=np.float64(self.intercept),
+                feature_names=np.array(self.feature_names)
+            )
+
+    def used_features(self):
+        # features with a non-zero weight, the only ones a feature store has to provide
+        return [f for f, w in zip(self.feature_names, self.coef) if w != 0]
+
+    def aligned_to(self, columns):
+        columns = tuple(columns)
+        if columns == self.feature_names:
+            return self
+        lookup = dict(zip(self.feature_names, self.coef))
+        missing = [c for c in self.used_features() if c not in columns]
+        if missing:
+            raise ValueError(f'Feature store is missing model features {missing}')
+        # features the model was not trained on get a zero weight
+        return LinearScorer([lookup.get(c, 0.) for c in columns], self.intercept, columns)
+
+    def predict(self, X):
+        return X @ self.coef + self.intercept
+
+
+class LinearScorerBank:
+    """Scores rows belonging to many symbols in one vectorised pass.
+
+    All scorers must share the same feature order. `owners[i]` gives the
+    position of the scorer that row `X[i]` belongs to.
+    """
+
+    def __init__(self, scorers):
+        feature_names = {s.feature_names for s in scorers}
+        if len(feature_names) > 1:
+            raise ValueError('Scorers in a bank must share the same feature order')
+        self.coef = np.vstack([s.coef for s in scorers])
+        self.intercept = np.array([s.intercept for s in scorers])
+
+    def predict(self, owners, X):
+        return np.einsum('ij,ij->i', X, self.coef[owners]) + self.intercept[owners]
@@ -3,60 +3,201 @@ FILEPATH = pathlib.Path(__file__).parent.resolve()
 PROJECTPATH = FILEPATH.parent.parent.resolve()
 
 import sys
-sys.path.append(str(PROJECTPATH))
+if __name__ == '__main__':
+    sys.path.append(str(PROJECTPATH))
 
-import pandas as pd
 import numpy as np
 import datetime as dt
-import joblib
+import time
+import hashlib
 import logging
+from contextlib import contextmanager
 
-logging.basicConfig(level = logging.INFO)
+from ecx_analytics.price_predictor.feature_matrix import FeatureMatrix
+from ecx_analytics.price_predictor.linear_scorer import LinearScorer, LinearScorerBank
 
 class ECXPredictor:
-    def __init__(self, project_path=PROJECTPATH):
+    def __init__(self, project_path=PROJECTPATH, cache=None, prediction_cache=None, stage_observer=None):
         self.project_path = project_path
         self.data_path = pathlib.Path.joinpath(self.project_path, "data")
         self.model_path = pathlib.Path.joinpath(self.project_path, "models")
+        self.cache = cache
+        self.prediction_cache = prediction_cache
+        # called as stage_observer(stage, seconds) after each timed stage
+        self.stage_observer = stage_observer
+
+    @contextmanager
+    def timed(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            if self.stage_observer is not None:
+                self.stage_observer(stage, time.perf_counter() - start)
+
+    def features_file(self, symbol):
+        candidates = [
+            pathlib.Path.joinpath(self.data_path, "feature_store", f"{symbol}_complete_features{extension}")
+            for extension in ['.parquet', '.pkl']
+        ]
+        # fall back to legacy pickled feature stores
+        return next((c for c in candidates if c.exists()), candidates[0])
+
+    def model_file(self, symbol):
+        # prefer the exported linear scorer, which needs no estimator unpickling
+        linear_path = pathlib.Path.joinpath(self.model_path, f"{symbol}_linear.npz")
+        if linear_path.exists():
+            return linear_path
+        return pathlib.Path.joinpath(self.model_path, f"{symbol}_model.modelpickle")
 
     def load_features_df(self, symbol):
-        file_path = pathlib.Path.joinpath(self.data_path, "feature_store", f"{symbol}_complete_features.pkl")
-        df = pd.read_pickle(file_path)
+        from ecx_analytics.data_processor.storage import get_storage
+        file_path = self.features_file(symbol)
+        storage = get_storage('pickle' if file_path.suffix == '.pkl' else 'parquet')
+        df = storage.read(file_path.parent, file_path.stem)
         return df
 
     def load_model(self, symbol):
-        file_path = pathlib.Path.joinpath(self.model_path, f"{symbol}_model.modelpickle")
+        file_path = self.model_file(symbol)
+        if file_path.suffix == '.npz':
+            return LinearScorer.load(file_path)
+        import joblib
         return joblib.load(file_path) 
 
+    def artifact_fingerprint(self, symbol):
+        stats = [p.stat() for p in [self.features_file(symbol), self.model_file(symbol)]]
+        return '-'.join(f'{s.st_size:x}.{s.st_mtime_ns:x}' for s in stats)
+
+    def prediction_etag(self, symbol, target_date, fingerprint=None, variant=None):
+        fingerprint = fingerprint or self.artifact_fingerprint(symbol)
+        key = f'{symbol}|{np.datetime64(target_date, "D")}|{fingerprint}|{variant}'
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def load_feature_matrix(self, symbol):
+        return FeatureMatrix.from_df(self.load_features_df(symbol))
+
+    def load_artifacts(self, symbol):
+        logging.info(f'Loading features and model for symbol {symbol}')
+        with self.timed('feature_load'):
+            feature_matrix = self.load_feature_matrix(symbol)
+        with self.timed('model_load'):
+            model = self.load_model(symbol)
+        if isinstance(model, LinearScorer):
+            model = model.aligned_to(feature_matrix.columns)
+        return feature_matrix, model
+
+    def get_artifacts(self, symbol, fingerprint=None):
+        if self.cache is None:
+            return self.load_artifacts(symbol)
+        fingerprint = fingerprint or self.artifact_fingerprint(symbol)
+        return self.cache.get(symbol, self.load_artifacts, fingerprint)
+
+    def preload(self, symbols):
+        if self.cache is not None:
+            self.cache.preload(symbols, self.load_artifacts, self.artifact_fingerprint)
+
     @staticmethod
-    def get_x(df, target_date, target_col='mid_price', drop_cols=['trade_date'], date_col='trade_date'):
-        df = df.copy()
-        df = df[df[date_col] == target_date]
-        cols_to_drop = [target_col] + drop_cols
-        df.drop(columns=cols_to_drop, inplace=True)
-        x = df.values.reshape(1, -1)
-        features = df.to_dict('records')
-        return x, features
+    def get_x(feature_matrix, target_date):
+        return feature_matrix.row(target_date)
+
+    @staticmethod
+    def get_X(feature_matrix, target_dates):
+        offsets = [feature_matrix.offset(d) for d in target_dates]
+        return feature_matrix.values[offsets]
+
+    @staticmethod
+    def get_X_range(feature_matrix, start, end):
+        X = feature_matrix.rows(start, end)
+        dates = feature_matrix.dates(start, end)
+        return X, dates
 
     @staticmethod
     def make_prediction(model, x):
         return round(model.predict(x)[0], 2)
 
-    def predict(self, symbol, target_date):
-        logging.info(f'Loading features and model for symbol {symbol} and target date {target_date}')
-        df = self.load_features_df(symbol)
-        model = self.load_model(symbol)
-        x, features = self.get_x(df, target_date)
-        logging.info('Making prediction for symbol {symbol} and target date {target_date}')
-        prediction = self.make_prediction(model, x)
+    @staticmethod
+    def make_predictions(model, X):
+        return np.round(model.predict(X), 2).tolist()
+
+    def score(self, symbol, target_date, fingerprint=None):
+        if self.prediction_cache is None:
+            return self.compute_score(symbol, target_date)
+        fingerprint = fingerprint or self.artifact_fingerprint(symbol)
+        key = (symbol, np.datetime64(target_date, 'D'), fingerprint)
+        scored = self.prediction_cache.get(key)
+        if scored is None:
+            prediction, x, columns = self.compute_score(symbol, target_date, fingerprint)
+            # x is a view of the symbol's feature matrix, caching it would keep the whole matrix alive
+            scored = (prediction, x.copy(), columns)
+            self.prediction_cache.set(key, scored)
+        return scored
+
+    def compute_score(self, symbol, target_date, fingerprint=None):
+        feature_matrix, model = self.get_artifacts(symbol, fingerprint)
+        with self.timed('get_x'):
+            x = self.get_x(feature_matrix, target_date)
+        logging.info(f'Making prediction for symbol {symbol} and target date {target_date}')
+        with self.timed('make_prediction'):
+            prediction = self.make_prediction(model, x)
+        return prediction, x, feature_matrix.columns
+
+    def predict(self, symbol, target_date, fingerprint=None):
+        prediction, x, columns = self.score(symbol, target_date, fingerprint)
         out_object = {
             'value': prediction, 
-            'features': features
+            'features': [dict(zip(columns, r)) for r in x.tolist()]
         }
-        logging.info('Prediction made for symbol {symbol} and target date {target_date}')        
+        logging.info(f'Prediction made for symbol {symbol} and target date {target_date}')        
         return out_object
 
+    def score_batch(self, symbol, target_dates):
+        feature_matrix, model = self.get_artifacts(symbol)
+        with self.timed('get_x'):
+            X = self.get_X(feature_matrix, target_dates)
+        logging.info(f'Making {len(target_dates)} predictions for symbol {symbol}')
+        with self.timed('make_prediction'):
+            predictions = self.make_predictions(model, X)
+        return predictions, X, feature_matrix.columns
+
+    def score_symbols(self, dates_by_symbol):
+        artifacts = {s: self.get_artifacts(s) for s in dates_by_symbol}
+        scored = {}
+        # linear models sharing a feature order are scored together in one pass
+        manifests = {}
+        for s, (feature_matrix, model) in artifacts.items():
+            if isinstance(model, LinearScorer):
+                manifests.setdefault(feature_matrix.columns, []).append(s)
+            else:
+                scored[s] = self.score_batch(s, dates_by_symbol[s])
+        for columns, symbols in manifests.items():
+            with self.timed('get_x'):
+                X_parts = [self.get_X(artifacts[s][0], dates_by_symbol[s]) for s in symbols]
+                X = np.vstack(X_parts)
+                owners = np.repeat(np.arange(len(symbols)), [len(x) for x in X_parts])
+            logging.info(f'Making {len(X)} predictions for symbols {symbols}')
+            with self.timed('make_prediction'):
+                bank = LinearScorerBank([artifacts[s][1] for s in symbols])
+                predictions = np.round(bank.predict(owners, X), 2)
+            start = 0
+            for s, x in zip(symbols, X_parts):
+                scored[s] = (predictions[start:start + len(x)].tolist(), x, columns)
+                start += len(x)
+        return scored
+
+    def predict_range(self, symbol, start, end):
+        feature_matrix, model = self.get_artifacts(symbol)
+        with self.timed('get_x'):
+            X, dates = self.get_X_range(feature_matrix, start, end)
+        logging.info(f'Making predictions for symbol {symbol} from {start} to {end}')
+        with self.timed('make_prediction'):
+            predictions = self.make_predictions(model, X)
+        return [
+            {'target_date': str(d), 'value': p}
+            for d, p in zip(dates, predictions)
+        ]
+
 if __name__ == '__main__':
+    logging.basicConfig(level = logging.INFO)
     for w in ['LUBP4','LUBP3','ULK5','UFRAUG']:
         predictor = ECXPredictor()
         print(predictor.predict(w, dt.datetime(2018,4,3)))
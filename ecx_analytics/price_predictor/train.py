@@ -3,32 +3,35 @@ FILEPATH = pathlib.Path(__file__).parent.resolve()
 PROJECTPATH = FILEPATH.parent.parent.resolve()
 
 import sys
-sys.path.append(str(PROJECTPATH))
+if __name__ == '__main__':
+    sys.path.append(str(PROJECTPATH))
 
 import pandas as pd
-from sklearn.linear_model import ElasticNet
 import numpy as np
 import datetime as dt
 import joblib
 import logging
 
-logging.basicConfig(level = logging.INFO)
-
-
-from ecx_analytics.price_predictor.utils.hyperparameter_tuner import HyperparameterTuner
+from ecx_analytics.price_predictor.linear_scorer import LinearScorer
+from ecx_analytics.data_processor.storage import get_storage, DEFAULT_STORAGE
 
 
 class ECXTrainer:
-    def __init__(self, project_path=PROJECTPATH):
+    def __init__(self, project_path=PROJECTPATH, storage=DEFAULT_STORAGE):
         self.project_path = project_path
         self.data_path = pathlib.Path.joinpath(self.project_path, "data")
         self.model_path = pathlib.Path.joinpath(self.project_path, "models")
+        self.storage = get_storage(storage)
 
     def load_features_df(self, symbol):
-        file_path = pathlib.Path.joinpath(self.data_path, "feature_store", f"{symbol}_with_target_features.pkl")
-        df = pd.read_pickle(file_path)
+        feature_store_path = pathlib.Path.joinpath(self.data_path, "feature_store")
+        df = self.storage.read(feature_store_path, f"{symbol}_with_target_features")
         return df
 
+    @staticmethod
+    def get_feature_names(df, target_col='mid_price', drop_cols=['trade_date']):
+        return [c for c in df.columns if c not in [target_col] + drop_cols]
+
     @staticmethod
     def get_X_y(df, start=dt.datetime(2012,4,1), end=dt.datetime(2018,3,31), target_col='mid_price', drop_cols=['trade_date'], date_col='trade_date'):
         df = df.copy()
@@ -39,6 +42,7 @@ class ECXTrainer:
         return X, y
 
     def initialise_elastic_net_model(self):
+        from sklearn.linear_model import ElasticNet
         self.model = ElasticNet(random_state=0, max_iter=100000)
         hyperparameter_set = [
             {'name':'alpha', 'type':'Real', 'lower': 1e-6, 'upper': 500., 'method':'uniform'},
@@ -48,6 +52,7 @@ class ECXTrainer:
 
     @staticmethod
     def find_hyperparameters(model, hyperparameter_set, X, y):
+        from ecx_analytics.price_predictor.utils.hyperparameter_tuner import HyperparameterTuner
         hyp_tuner = HyperparameterTuner(model, hyperparameter_set, X,y, n_calls=50)
         params = hyp_tuner.find_params()
         logging.info('Hyperparameters found')
@@ -63,6 +68,16 @@ class ECXTrainer:
         file_path = pathlib.Path.joinpath(self.model_path, f"{symbol}_model.modelpickle")
         joblib.dump(model, file_path) 
 
+    def export_linear_model(self, model, symbol, feature_names):
+        file_path = pathlib.Path.joinpath(self.model_path, f"{symbol}_linear.npz")
+        LinearScorer.from_estimator(model, feature_names).save(file_path)
+        logging.info(f'Linear scorer exported for {symbol}')
+
+    def export_saved_model(self, symbol):
+        df = self.load_features_df(symbol)
+        model = joblib.load(pathlib.Path.joinpath(self.model_path, f"{symbol}_model.modelpickle"))
+        self.export_linear_model(model, symbol, self.get_feature_names(df))
+
     def train(self, symbol):
         logging.info(f'Training model for {symbol}')
         df = self.load_features_df(symbol)
@@ -75,9 +90,18 @@ class ECXTrainer:
         logging.info(f'Fitting model for {symbol}')
         self.fit(X, y)
         self.save_model(self.model, symbol)
+        self.export_linear_model(self.model, symbol, self.get_feature_names(df))
         logging.info(f'Model trained and saved for {symbol}')
 
 if __name__ == '__main__':
+    import argparse
+    logging.basicConfig(level = logging.INFO)
+    parser = argparse.ArgumentParser(description='Train ECX mid price models')
+    parser.add_argument('--export-only', action='store_true', help='export linear scorers from the saved models without retraining')
+    args = parser.parse_args()
     for w in ['LUBP4','LUBP3','ULK5','UFRAUG']:
         trainer = ECXTrainer()
-        trainer.train(w)
\ No newline at end of file
+        if args.export_only:
+            trainer.export_saved_model(w)
+        else:
+            trainer.train(w)
\ No newline at end of file
@@ -1,15 +1,66 @@
 #!/usr/bin/env python3
 
+import os
+import logging
+import argparse
+import multiprocessing
+
 import connexion
 
 from swagger_server import encoder
+from swagger_server import metrics
+from swagger_server.controllers import mid_price_predictor_controller
 
 
-def main():
+def create_app():
     app = connexion.App(__name__, specification_dir='./swagger/')
     app.app.json_encoder = encoder.JSONEncoder
     app.add_api('swagger.yaml', arguments={'title': 'ECX Analytics'}, pythonic_params=True)
-    app.run(port=8080)
+    metrics.init_app(
+        app.app,
+        caches={
+            'artifact': mid_price_predictor_controller.ARTIFACT_CACHE,
+            'prediction': mid_price_predictor_controller.PREDICTION_CACHE
+        }
+    )
+    return app
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='ECX Analytics prediction server')
+    parser.add_argument('--production', action='store_true',
+                        help='serve with a pre-forked pool of gunicorn workers instead of the Flask development server')
+    parser.add_argument('--port', type=int, default=int(os.environ.get('PORT', 8080)))
+    parser.add_argument('--workers', type=int, default=int(os.environ.get('ECX_WORKERS', multiprocessing.cpu_count())))
+    parser.add_argument('--threads', type=int, default=int(os.environ.get('ECX_THREADS', 1)))
+    parser.add_argument('--max-requests', type=int, default=int(os.environ.get('ECX_MAX_REQUESTS', 10000)),
+                        help='recycle a worker after it has served this many requests, 0 disables recycling')
+    parser.add_argument('--graceful-timeout', type=int, default=int(os.environ.get('ECX_GRACEFUL_TIMEOUT', 30)))
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(level = logging.INFO)
+    args = parse_args()
+    app = create_app()
+    if os.environ.get('ECX_PRELOAD_ARTIFACTS', '1') == '1':
+        mid_price_predictor_controller.preload_artifacts()
+    else:
+        mid_price_predictor_controller.ARTIFACTS_READY.set()
+
+    if args.production:
+        from swagger_server import server
+        server.run(
+            app.app,
+            bind=f'0.0.0.0:{args.port}',
+            workers=args.workers,
+            threads=args.threads,
+            max_requests=args.max_requests,
+            max_requests_jitter=args.max_requests // 10,
+            graceful_timeout=args.graceful_timeout
+        )
+    else:
+        app.run(port=args.port)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,25 @@
+from swagger_server.controllers.mid_price_predictor_controller import ARTIFACTS_READY
+
+
+def liveness():  # noqa: E501
+    """Reports that the server process is running
+
+     # noqa: E501
+
+
+    :rtype: str
+    """
+    return 'alive'
+
+
+def readiness():  # noqa: E501
+    """Reports whether the server is ready to take traffic
+
+    The server is ready once the prediction artifacts have finished preloading # noqa: E501
+
+
+    :rtype: str
+    """
+    if not ARTIFACTS_READY.is_set():
+        return 'preloading artifacts', 503
+    return 'ready'
@@ -1,26 +1,56 @@
 import connexion
 import six
 import datetime as dt
+from flask import Response
 
 from swagger_server.models.mid_price_response import MidPriceResponse  # noqa: E501
 from swagger_server.models.symbol import Symbol  # noqa: E501
 from swagger_server.models.target_date import TargetDate  # noqa: E501
 from swagger_server import util
+from swagger_server import metrics
+from swagger_server.serializers import PredictionSerializer, parse_feature_selection
 
-import sys
+import os
 import pathlib
-import logging
-logging.basicConfig(level = logging.INFO)
+import threading
+from collections import Counter
 
 FILEPATH = pathlib.Path(__file__).parent.resolve()
 PROJECTPATH = FILEPATH.parent.parent.resolve()
 
-sys.path.append(str(PROJECTPATH))
-
 from ecx_analytics.price_predictor.predict import ECXPredictor
+from ecx_analytics.price_predictor.artifact_cache import ArtifactCache
+from ecx_analytics.price_predictor.prediction_cache import PredictionCache
+from ecx_analytics.price_predictor.feature_matrix import column_indices
+
+SUPPORTED_SYMBOLS = ['LUBP4','LUBP3','ULK5','UFRAUG']
+MAX_BATCH_SIZE = int(os.environ.get('ECX_MAX_BATCH_SIZE', 10000))
+
+ARTIFACT_CACHE = ArtifactCache(max_size=int(os.environ.get('ECX_ARTIFACT_CACHE_SIZE', 32)))
+PREDICTION_CACHE = PredictionCache(
+    max_size=int(os.environ.get('ECX_PREDICTION_CACHE_SIZE', 10000)),
+    ttl=float(os.environ.get('ECX_PREDICTION_CACHE_TTL', 3600))
+)
+PREDICTOR = ECXPredictor(
+    PROJECTPATH,
+    cache=ARTIFACT_CACHE,
+    prediction_cache=PREDICTION_CACHE,
+    stage_observer=metrics.observe_stage
+)
+ARTIFACTS_READY = threading.Event()
+SERIALIZER = PredictionSerializer()
+
+
+def preload_artifacts(symbols=SUPPORTED_SYMBOLS):
+    PREDICTOR.preload(symbols)
+    ARTIFACTS_READY.set()
+
 
+def json_response(body, status=200, headers=None):
+    return Response(body, status=status, headers=headers, mimetype='application/json')
 
-def mid_price_prediction(symbol, target_date):  # noqa: E501
+
+def mid_price_prediction(symbol, target_date, features=None):  # noqa: E501
     """Predicts mid price for supplied symbol and target date
 
     Provides prediction for the mid price of a coffee (represented by a symbol) on a target date # noqa: E501
@@ -29,12 +59,14 @@ def mid_price_prediction(symbol, target_date):  # noqa: E501
     :type symbol: dict | bytes
     :param target_date: Target date to predict for
     :type target_date: dict | bytes
+    :param features: Features to return, all, none or a comma separated list of feature names
+    :type features: str
 
     :rtype: List[MidPriceResponse]
     """
 
-    if symbol not in ['LUBP4','LUBP3','ULK5','UFRAUG']:
-        return "Symbol not supported, please supply one of ['LUBP4','LUBP3','ULK5','UFRAUG']", 404
+    if symbol not in SUPPORTED_SYMBOLS:
+        return f"Symbol not supported, please supply one of {SUPPORTED_SYMBOLS}", 404
 
     try:
         target_date = dt.datetime.strptime(target_date, '%Y-%m-%d')
@@ -44,7 +76,120 @@ def mid_price_prediction(symbol, target_date):  # noqa: E501
     if target_date.year != 2018 or target_date.month != 4:
         return "Prediction only supported for April 2018, please provide date in this month"
 
-    predictor = ECXPredictor(PROJECTPATH)
-    prediction = predictor.predict(symbol, target_date)
+    include_features, feature_names = parse_feature_selection(features)
+
+    fingerprint = PREDICTOR.artifact_fingerprint(symbol)
+    try:
+        prediction, x, columns = PREDICTOR.score(symbol, target_date, fingerprint)
+    except KeyError as e:
+        return e.args[0], 404
+
+    try:
+        indices = None if feature_names is None else column_indices(columns, feature_names)
+    except KeyError as e:
+        return e.args[0], 400
+
+    # only a valid request is answered from the client's copy, If-None-Match compares weakly
+    etag = PREDICTOR.prediction_etag(symbol, target_date, fingerprint, variant=features)
+    if connexion.request.if_none_match.contains_weak(etag):
+        return None, 304, {'ETag': f'"{etag}"'}
+
+    with PREDICTOR.timed('json_encode'):
+        body = SERIALIZER.array([
+            SERIALIZER.prediction(prediction, columns, x[0], indices, include_features, as_records=True)
+        ])
+    metrics.count_predictions(symbol)
+    return json_response(body, headers={'ETag': f'"{etag}"'})
+
+
+def mid_price_prediction_batch(body):  # noqa: E501
+    """Predicts mid prices for many symbols and target dates
+
+    Provides mid price predictions for every combination of the supplied symbols and target dates, plus any explicit symbol and target date pairs, in a single call # noqa: E501
+
+    :param body: Symbols and target dates to predict for
+    :type body: dict | bytes
+
+    :rtype: List[MidPriceBatchResponse]
+    """
+    include_features, feature_names = parse_feature_selection(body.get('features'))
+
+    pairs = [(s, d) for s in body.get('symbols', []) for d in body.get('target_dates', [])]
+    pairs += [(p['symbol'], p['target_date']) for p in body.get('pairs', [])]
+
+    if len(pairs) > MAX_BATCH_SIZE:
+        return f"Batch of {len(pairs)} predictions exceeds the limit of {MAX_BATCH_SIZE}", 400
+
+    # group the requested dates per symbol so each symbol is scored with one predict call
+    dates_by_symbol = {}
+    for symbol, target_date in pairs:
+        if symbol not in SUPPORTED_SYMBOLS:
+            return f"Symbol {symbol} not supported, please supply one of {SUPPORTED_SYMBOLS}", 404
+        try:
+            parsed_date = dt.datetime.strptime(str(target_date), '%Y-%m-%d')
+        except ValueError:
+            return f"Can't parse date {target_date}, please provide in iso date format", 400
+        if parsed_date.year != 2018 or parsed_date.month != 4:
+            return f"Prediction only supported for April 2018, {target_date} is outside this month", 400
+        dates_by_symbol.setdefault(symbol, {})[str(target_date)] = parsed_date
+
+    try:
+        scored = PREDICTOR.score_symbols({s: list(dates.values()) for s, dates in dates_by_symbol.items()})
+    except KeyError as e:
+        return e.args[0], 404
+
+    results = {}
+    for symbol, dates in dates_by_symbol.items():
+        predictions, X, columns = scored[symbol]
+        try:
+            indices = None if feature_names is None else column_indices(columns, feature_names)
+        except KeyError as e:
+            return e.args[0], 400
+        with PREDICTOR.timed('json_encode'):
+            for target_date, prediction, row in zip(dates, predictions, X):
+                extra = {'symbol': symbol, 'target_date': target_date}
+                results[(symbol, target_date)] = SERIALIZER.prediction(
+                    prediction, columns, row, indices, include_features, extra=extra
+                )
+
+    for symbol, n in Counter(s for s, _ in pairs).items():
+        metrics.count_predictions(symbol, n)
+    return json_response(SERIALIZER.array(results[(s, str(d))] for s, d in pairs))
+
+
+def mid_price_series(symbol, start, end):  # noqa: E501
+    """Predicts the mid price series for a symbol over a date range
+
+    Provides mid price predictions for a coffee (represented by a symbol) for every day from start to end inclusive # noqa: E501
+
+    :param symbol: Coffee identifying symbol
+    :type symbol: dict | bytes
+    :param start: First date of the series
+    :type start: dict | bytes
+    :param end: Last date of the series
+    :type end: dict | bytes
+
+    :rtype: MidPriceSeriesResponse
+    """
+    if symbol not in SUPPORTED_SYMBOLS:
+        return f"Symbol not supported, please supply one of {SUPPORTED_SYMBOLS}", 404
+
+    try:
+        start = dt.datetime.strptime(start, '%Y-%m-%d')
+        end = dt.datetime.strptime(end, '%Y-%m-%d')
+    except ValueError:
+        return "Can't parse date, please provide in iso date format", 400
+
+    if start > end:
+        return "Series start must not be after series end", 400
+
+    if any(d.year != 2018 or d.month != 4 for d in [start, end]):
+        return "Prediction only supported for April 2018, please provide dates in this month", 400
+
+    try:
+        series = PREDICTOR.predict_range(symbol, start, end)
+    except KeyError as e:
+        return e.args[0], 404
 
-    return [prediction]
+    metrics.count_predictions(symbol, len(series))
+    return {'symbol': symbol, 'series': series}
@@ -1,4 +1,5 @@
 from connexion.apps.flask_app import FlaskJSONEncoder
+import numpy as np
 import six
 
 from swagger_server.models.base_model_ import Model
@@ -17,4 +18,8 @@ class JSONEncoder(FlaskJSONEncoder):
                 attr = o.attribute_map[attr]
                 dikt[attr] = value
             return dikt
+        if isinstance(o, np.generic):
+            return o.item()
+        if isinstance(o, np.ndarray):
+            return o.tolist()
         return FlaskJSONEncoder.default(self, o)
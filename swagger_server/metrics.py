@@ -0,0 +1,110 @@
+import os
+import time
+
+from flask import request, Response
+from prometheus_client import (
+    CollectorRegistry, Counter, Histogram, ProcessCollector, REGISTRY,
+    CONTENT_TYPE_LATEST, generate_latest, multiprocess
+)
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+
+from swagger_server.encoder import JSONEncoder
+
+STAGE_BUCKETS = (.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1., 2.5, 5., 10.)
+
+STAGE_LATENCY = Histogram(
+    'ecx_prediction_stage_seconds',
+    'Latency of each stage of the prediction path',
+    ['stage'],
+    buckets=STAGE_BUCKETS
+)
+
+REQUESTS = Counter(
+    'ecx_http_requests_total',
+    'HTTP requests by endpoint and status code',
+    ['endpoint', 'status']
+)
+
+# a batch spans several symbols, so symbols are counted per prediction rather than per request
+PREDICTIONS = Counter(
+    'ecx_predictions_total',
+    'Predictions served by endpoint and symbol',
+    ['endpoint', 'symbol']
+)
+
+
+def observe_stage(stage, seconds):
+    STAGE_LATENCY.labels(stage=stage).observe(seconds)
+
+
+def count_predictions(symbol, n=1):
+    PREDICTIONS.labels(endpoint=request.url_rule.rule, symbol=symbol).inc(n)
+
+
+class TimedJSONEncoder(JSONEncoder):
+    def encode(self, o):
+        start = time.perf_counter()
+        try:
+            return super().encode(o)
+        finally:
+            observe_stage('json_encode', time.perf_counter() - start)
+
+
+class CacheCollector:
+    """Exposes the counters kept by the in-process prediction caches."""
+
+    def __init__(self, caches):
+        self.caches = caches
+
+    def collect(self):
+        hits = CounterMetricFamily('ecx_cache_hits', 'Cache hits', labels=['cache'])
+        misses = CounterMetricFamily('ecx_cache_misses', 'Cache misses', labels=['cache'])
+        hit_ratio = GaugeMetricFamily('ecx_cache_hit_ratio', 'Cache hits over lookups', labels=['cache'])
+        size = GaugeMetricFamily('ecx_cache_size', 'Entries held in the cache', labels=['cache'])
+        for name, cache in self.caches.items():
+            stats = cache.stats()
+            hits.add_metric([name], stats['hits'])
+            misses.add_metric([name], stats['misses'])
+            hit_ratio.add_metric([name], stats['hit_ratio'])
+            size.add_metric([name], stats['size'])
+        return [hits, misses, hit_ratio, size]
+
+
+_registry = None
+
+
+def build_registry(caches):
+    global _registry
+    if _registry is not None:
+        return _registry
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        # gunicorn workers write their samples to a shared directory that is
+        # aggregated on scrape, cache and memory figures are for the scraped worker
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        ProcessCollector(registry=registry)
+    else:
+        registry = REGISTRY
+    registry.register(CacheCollector(caches))
+    _registry = registry
+    return registry
+
+
+def init_app(flask_app, caches):
+    registry = build_registry(caches)
+    flask_app.json_encoder = TimedJSONEncoder
+
+    @flask_app.after_request
+    def count_request(response):
+        if request.path != '/metrics':
+            REQUESTS.labels(
+                endpoint=request.url_rule.rule if request.url_rule else 'unmatched',
+                status=str(response.status_code)
+            ).inc()
+        return response
+
+    def metrics():
+        return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+    flask_app.add_url_rule('/metrics', 'metrics', metrics)
+    return registry
@@ -0,0 +1,71 @@
+import json
+
+FEATURES_ALL = 'all'
+FEATURES_NONE = 'none'
+
+
+def _number(value):
+    # numpy scalars repr as np.float64(...) under NumPy 2
+    value = float(value)
+    if value != value:
+        return 'NaN'
+    if value in (float('inf'), float('-inf')):
+        return 'Infinity' if value > 0 else '-Infinity'
+    return repr(value)
+
+
+class PredictionSerializer:
+    """Writes prediction responses straight to JSON text.
+
+    The encoded keys of each feature manifest are built once and reused, and
+    feature rows are written from their numpy arrays, so no dict is built per
+    row and no numpy scalar goes through the generic encoder fallback.
+    """
+
+    def __init__(self):
+        self._keys = {}
+
+    def keys(self, columns):
+        keys = self._keys.get(columns)
+        if keys is None:
+            keys = [json.dumps(c) + ':' for c in columns]
+            self._keys[columns] = keys
+        return keys
+
+    def features(self, columns, row, indices=None):
+        keys = self.keys(columns)
+        values = row.tolist()
+        if indices is None:
+            pairs = zip(keys, values)
+        else:
+            pairs = ((keys[i], values[i]) for i in indices)
+        return '{' + ','.join(k + _number(v) for k, v in pairs) + '}'
+
+    def prediction(self, value, columns, row, indices=None, include_features=True, extra=None, as_records=False):
+        fields = [f'{json.dumps(k)}:{json.dumps(v)}' for k, v in (extra or {}).items()]
+        fields.append(f'"value":{_number(value)}')
+        if include_features:
+            features = self.features(columns, row, indices)
+            if as_records:
+                features = '[' + features + ']'
+            fields.append(f'"features":{features}')
+        return '{' + ','.join(fields) + '}'
+
+    @staticmethod
+    def array(items):
+        return '[' + ','.join(items) + ']'
+
+
+def parse_feature_selection(features):
+    """Returns (include_features, columns) for a `features` query option.
+
+    `all` or nothing selects every feature, `none` omits them and anything
+    else is read as a comma separated list of feature names.
+    """
+    if features is None or features == FEATURES_ALL:
+        return True, None
+    if features == FEATURES_NONE:
+        return False, None
+    if isinstance(features, str):
+        features = features.split(',')
+    return True, [f.strip() for f in features if f.strip()]
@@ -0,0 +1,53 @@
+import gc
+import os
+
+from gunicorn.app.base import BaseApplication
+
+
+def child_exit(server, worker):
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+class PreforkServer(BaseApplication):
+    """Gunicorn application serving an already built WSGI app.
+
+    The app and its preloaded artifacts are created in the master process
+    before workers are forked, so workers share those memory pages
+    copy-on-write instead of each loading a private copy.
+    """
+
+    def __init__(self, application, options=None):
+        self.application = application
+        self.options = options or {}
+        super().__init__()
+
+    def load_config(self):
+        for key, value in self.options.items():
+            if key in self.cfg.settings and value is not None:
+                self.cfg.set(key, value)
+
+    def load(self):
+        return self.application
+
+
+def run(application, bind, workers, threads=1, max_requests=10000, max_requests_jitter=1000,
+        graceful_timeout=30, timeout=30):
+    # move everything allocated so far into the permanent generation so the
+    # garbage collector never writes to, and so never un-shares, those pages
+    gc.freeze()
+    options = {
+        'bind': bind,
+        'workers': workers,
+        'threads': threads,
+        'preload_app': True,
+        # workers are recycled after roughly max_requests requests and given
+        # graceful_timeout seconds to finish in-flight requests
+        'max_requests': max_requests,
+        'max_requests_jitter': max_requests_jitter,
+        'graceful_timeout': graceful_timeout,
+        'timeout': timeout,
+        'child_exit': child_exit,
+    }
+    PreforkServer(application, options).run()
@@ -0,0 +1,68 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import threading
+import time
+import unittest
+
+from ecx_analytics.price_predictor.artifact_cache import ArtifactCache
+
+
+class CountingLoader:
+    """A loader recording how often each key was loaded."""
+
+    def __init__(self, delay=0):
+        self.delay = delay
+        self.loads = {}
+
+    def __call__(self, key):
+        time.sleep(self.delay)
+        self.loads[key] = self.loads.get(key, 0) + 1
+        return f'{key} artifacts {self.loads[key]}'
+
+
+class TestArtifactCache(unittest.TestCase):
+    """LRU caching of per-symbol prediction artifacts"""
+
+    def test_hits_and_misses(self):
+        cache, loader = ArtifactCache(max_size=2), CountingLoader()
+        self.assertEqual(cache.get('LUBP4', loader), 'LUBP4 artifacts 1')
+        self.assertEqual(cache.get('LUBP4', loader), 'LUBP4 artifacts 1')
+        self.assertEqual(cache.get('LUBP3', loader), 'LUBP3 artifacts 1')
+        self.assertEqual(loader.loads, {'LUBP4': 1, 'LUBP3': 1})
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions'], stats['size']), (1, 2, 0, 2))
+        self.assertAlmostEqual(stats['hit_ratio'], 1 / 3)
+
+    def test_least_recently_used_is_evicted(self):
+        cache, loader = ArtifactCache(max_size=2), CountingLoader()
+        cache.get('LUBP4', loader)
+        cache.get('LUBP3', loader)
+        # a hit makes LUBP4 the most recently used, so LUBP3 goes first
+        cache.get('LUBP4', loader)
+        cache.get('ULK5', loader)
+        self.assertNotIn('LUBP3', cache)
+        self.assertIn('LUBP4', cache)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.stats()['evictions'], 1)
+        self.assertEqual(cache.get('LUBP3', loader), 'LUBP3 artifacts 2')
+        self.assertNotIn('LUBP4', cache)
+
+    def test_concurrent_misses_load_once(self):
+        cache, loader = ArtifactCache(), CountingLoader(delay=0.05)
+        threads = [threading.Thread(target=cache.get, args=('LUBP4', loader)) for _ in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.assertEqual(loader.loads, {'LUBP4': 1})
+        self.assertEqual(cache.stats()['misses'], 1)
+
+    def test_invalid_size(self):
+        with self.assertRaises(ValueError):
+            ArtifactCache(max_size=0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from ecx_analytics.data_processor.bronze_to_silver import BronzeToSilver, NUMBER_COLS
+
+
+def random_bronze(n_days=400, symbols=('LUBP4', 'LUBP3', 'ULK5'), seed=0):
+    """Bronze rows as parsed from the raw reports, with (symbol, trade date)
+    duplicates in other warehouses and shuffled like several files."""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2016-11-01', periods=n_days, freq='1D')
+    df = pd.concat([pd.DataFrame({'Symbol': s, 'date': dates[rng.random(n_days) < 0.6]}) for s in symbols], ignore_index=True)
+    n = len(df)
+    mid = 3000 + rng.normal(0, 50, n)
+    fmt = lambda values: [f'{v:,.2f}' for v in values]
+    bronze = pd.DataFrame({
+        'Symbol': df['Symbol'],
+        'Warehouse': rng.choice(['BG', 'HW', 'DD'], n),
+        'Production Year': rng.choice([2015, 2016], n),
+        'Opening Price': fmt(mid + rng.normal(0, 3, n)),
+        'Closing Price': fmt(mid + rng.normal(0, 3, n)),
+        'High': fmt(mid + 10),
+        'Low': fmt(mid - 10),
+        'Change': rng.normal(0, 5, n).round(2),
+        'Persetntage Change': [f'{v:.2f}%' for v in rng.normal(0, 1, n)],
+        'Volume (Ton)': rng.uniform(1, 100, n).round(3),
+        'Trade Date': df['date'].dt.strftime('%m/%d/%Y'),
+        'source_file': 'report.xlsx',
+    })
+    duplicates = bronze.sample(frac=0.1, random_state=seed).assign(Warehouse='ZZ')
+    return pd.concat([bronze, duplicates]).sample(frac=1, random_state=seed).reset_index(drop=True)
+
+
+def rowwise_cleaning(df):
+    """The row-wise cleaning silver was first built with."""
+    warehouse_names = {'BG': 'Bonga Gimbo', 'HW': 'Hawasa', 'DD': 'Dire Dawa'}
+    return {
+        'numbers': pd.DataFrame({c: df[c].str.replace(',', '').astype(float) for c in NUMBER_COLS}),
+        'percentages': df['Persetntage Change'].apply(lambda x: float(x.strip('%'))/100),
+        'warehouse_names': df['Warehouse'].replace(warehouse_names),
+    }
+
+
+class TestBronzeToSilver(unittest.TestCase):
+    """Streaming bronze to silver in chunks against the in-memory path"""
+
+    def test_chunked_matches_in_memory(self):
+        bronze = random_bronze()
+        for storage in ['parquet', 'pickle']:
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                data_path = pathlib.Path(tmp_dir)
+                for layer in ['bronze', 'silver']:
+                    data_path.joinpath(layer).mkdir()
+                in_memory = BronzeToSilver(data_path, storage=storage)
+                in_memory.storage.write(bronze, in_memory.bronze_path, 'ecx_bronze')
+                in_memory.run()
+                expected = in_memory.storage.read(in_memory.silver_path, 'ecx_silver')
+                for chunk_rows in [97, 1000]:
+                    BronzeToSilver(data_path, storage=storage, chunk_rows=chunk_rows).run()
+                    actual = in_memory.storage.read(in_memory.silver_path, 'ecx_silver')
+                    pd.testing.assert_frame_equal(actual, expected, obj=f'{storage} silver in chunks of {chunk_rows}')
+
+    def test_vectorized_cleaning_matches_rowwise(self):
+        bronze = random_bronze()
+        # whole thousands, negatives and a code without a warehouse name
+        bronze.loc[:2, 'High'] = ['3,000', '12,345.5', '-1,000.25']
+        bronze.loc[:2, 'Persetntage Change'] = ['-0.50%', '0%', '12.25%']
+        expected = rowwise_cleaning(bronze)
+        pd.testing.assert_frame_equal(BronzeToSilver.clean_number_cols(bronze), expected['numbers'])
+        pd.testing.assert_series_equal(BronzeToSilver.handle_percentages(bronze), expected['percentages'])
+        warehouse_names = BronzeToSilver.handle_warehouse_names(bronze)
+        self.assertEqual(warehouse_names.dtype, 'category')
+        pd.testing.assert_series_equal(warehouse_names.astype(object), expected['warehouse_names'])
+        self.assertIn('ZZ', set(warehouse_names))
+
+    def test_memory_report_measures_before_compacting(self):
+        bronze_to_silver = BronzeToSilver(pathlib.Path('.'), downcast_floats=True)
+        with mock.patch.object(BronzeToSilver, 'compact_dtypes', staticmethod(lambda df, **kwargs: df)):
+            uncompacted = bronze_to_silver.clean_rows(random_bronze())
+        with self.assertLogs(level='INFO') as logs:
+            df = bronze_to_silver.clean_rows(random_bronze(), log_memory=True)
+        report = BronzeToSilver.memory_report(uncompacted.memory_usage(deep=True, index=False), df)
+        self.assertIn(str(report), logs.output[0])
+        self.assertEqual(report.loc['symbol', 'before_bytes'], uncompacted['symbol'].memory_usage(deep=True, index=False))
+        self.assertLess(report.loc['total', 'ratio'], 0.5)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,195 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import os
+import time
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from ecx_analytics.data_processor.feature_state import EwmState, FeatureState, WINDOW, WINDOW_COLUMNS, window_features
+from ecx_analytics.data_processor.silver_to_feature_store import SilverToFeatureStore
+from ecx_analytics.data_processor.feature_registry import FEATURE_NAMES
+
+
+def random_series(n_days, seed=0):
+    """Grid values for `WINDOW_COLUMNS` with missing days, a constant
+    stretch and a long gap, one row per column."""
+    rng = np.random.default_rng(seed)
+    values = np.vstack([
+        3000 + np.cumsum(rng.normal(0, 25, n_days)),
+        rng.uniform(0, 50, n_days),
+        rng.uniform(0, 400, n_days)
+    ])
+    values[:, rng.random(n_days) < 0.4] = np.nan
+    values[0, 100:140] = 3100.0
+    values[:, 200:250] = np.nan
+    return values
+
+
+def pandas_features(values):
+    """The features as the pandas rolling and ewm implementation computes them."""
+    full_df = pd.DataFrame(values.T, columns=WINDOW_COLUMNS)
+    rolling = full_df.rolling(window=30, min_periods=0, closed='left')
+    prices = full_df['mid_price']
+    features = {
+        'mid_price_ma_30': rolling.mean()['mid_price'],
+        'mid_price_std_30': rolling.std()['mid_price'].fillna(value=0),
+        'mid_price_count_30': rolling.count()['mid_price'],
+        'spread_mean': rolling.mean()['spread'],
+        'volume_ton_mean': rolling.mean()['volume_ton'],
+        'volume_ton_sum': rolling.sum()['volume_ton'],
+    }
+    for k, alpha in [('01', 0.1), ('03', 0.3)]:
+        ewm = prices.ewm(alpha=alpha, adjust=False, min_periods=0)
+        features[f'mid_price_ema_{k}'] = ewm.mean().shift()
+        features[f'mid_price_estd_{k}'] = ewm.std().shift()
+    return {k: v.to_numpy() for k, v in features.items()}
+
+
+def pandas_lag_features(prices_df, ts_df):
+    """The lag features as the double merge_asof and backfill computes them."""
+    prices_df = prices_df.copy()
+    prices_df['joined_date'] = prices_df['trade_date']
+    df_ = pd.merge_asof(ts_df, prices_df, on='trade_date', suffixes=('', '_lagged'), allow_exact_matches=False)
+    df_['last_price_distance'] = (df_['trade_date'] - df_['joined_date']).dt.days
+    df_ = df_.fillna(method='bfill')
+    df__ = pd.merge_asof(df_, prices_df, left_on='joined_date', right_on='trade_date', suffixes=('', '_twice'), allow_exact_matches=False)
+    df__['second_last_price_distance'] = (df__['trade_date'] - df__['joined_date_twice']).dt.days
+    return {
+        'lag_price': df_['mid_price'].to_numpy(dtype=np.float64),
+        'lag_distance': df_['last_price_distance'].to_numpy(dtype=np.float64),
+        'lag_price_twice': df__['mid_price_twice'].to_numpy(dtype=np.float64),
+        'second_last_price_distance': df__['second_last_price_distance'].to_numpy(dtype=np.float64)
+    }
+
+
+def random_trades(n_days, seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2015-01-01', periods=n_days, freq='1D')
+    prices_df = pd.DataFrame({'trade_date': dates, 'mid_price': 3000 + np.cumsum(rng.normal(0, 25, n_days))})
+    prices_df = prices_df[rng.random(n_days) < 0.3].reset_index(drop=True)
+    # missing prices at the start, in the middle and on the last trade
+    prices_df.loc[[0, 1, 5, len(prices_df) - 1], 'mid_price'] = np.nan
+    return prices_df
+
+
+def kernel_features(values, state=None):
+    stats, ewm = window_features(values, state or FeatureState())
+    stats = stats[WINDOW]
+    features = {
+        'mid_price_ma_30': stats['mid_price']['mean'],
+        'mid_price_std_30': np.nan_to_num(stats['mid_price']['std'], nan=0.0),
+        'mid_price_count_30': stats['mid_price']['count'],
+        'spread_mean': stats['spread']['mean'],
+        'volume_ton_mean': stats['volume_ton']['mean'],
+        'volume_ton_sum': stats['volume_ton']['sum'],
+    }
+    for k, (means, stds) in ewm.items():
+        features[f'mid_price_ema_{k}'] = means
+        features[f'mid_price_estd_{k}'] = stds
+    return features
+
+
+def recurrence_shifted(state, values):
+    """Shifted EWM means and stds stepping the state's recurrence over every value."""
+    outputs = []
+    for x in values:
+        outputs.append(state.outputs())
+        state.update(x)
+    return tuple(np.array(o) for o in zip(*outputs))
+
+
+def best_of(repeats, f, *args):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        f(*args)
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+class TestFeatureKernels(unittest.TestCase):
+    """Parity of the window, EWM and lag features with pandas"""
+
+    def test_parity_with_pandas(self):
+        values = random_series(1000)
+        expected = pandas_features(values)
+        actual = kernel_features(values)
+        self.assertEqual(sorted(actual), sorted(expected))
+        for k in expected:
+            np.testing.assert_allclose(actual[k], expected[k], rtol=1e-9, atol=1e-9, equal_nan=True, err_msg=k)
+
+    def test_extending_state_is_exact(self):
+        values = random_series(500, seed=1)
+        full = kernel_features(values)
+        state = FeatureState()
+        parts = [kernel_features(values[:, a:b], state) for a, b in [(0, 1), (1, 31), (31, 220), (220, 500)]]
+        for k in full:
+            np.testing.assert_array_equal(np.concatenate([p[k] for p in parts]), full[k], err_msg=k)
+
+    def test_pandas_ewm_matches_recurrence(self):
+        rng = np.random.default_rng(3)
+        n_days = 3000
+        # weekday trading, sparse trading and a series starting with missing days
+        masks = [np.arange(n_days) % 7 < 5, rng.random(n_days) < 0.05, np.arange(n_days) >= 10]
+        for mask in masks:
+            values = np.where(mask, 3000 + np.cumsum(rng.normal(0, 25, n_days)), np.nan)
+            for alpha in [0.1, 0.3, 0.02]:
+                recurrence, compiled = EwmState(alpha), EwmState(alpha)
+                expected, actual = recurrence_shifted(recurrence, values), compiled.shifted(values)
+                for e, a in zip(expected, actual):
+                    np.testing.assert_array_equal(a, e)
+                self.assertEqual(compiled.to_dict(), recurrence.to_dict())
+
+    def assert_lag_parity(self, prices_df, ts_df):
+        expected = pandas_lag_features(prices_df, ts_df)
+        actual = SilverToFeatureStore.calculate_last_price_columns(prices_df, ts_df)
+        for k in expected:
+            np.testing.assert_array_equal(actual[k], expected[k], err_msg=k)
+
+    def test_lag_parity_with_merge_asof(self):
+        prices_df = random_trades(400)
+        # the grid starts on the first trade, the first days are backfilled
+        self.assert_lag_parity(prices_df, SilverToFeatureStore.create_ts_df(prices_df['trade_date'].min(), prices_df['trade_date'].max()))
+        # the grid starts after the first trades, as when extending a feature state
+        self.assert_lag_parity(prices_df, SilverToFeatureStore.create_ts_df(prices_df['trade_date'].iloc[10], prices_df['trade_date'].max()))
+
+    def test_lag_single_trade(self):
+        prices_df = pd.DataFrame({'trade_date': pd.to_datetime(['2015-01-01']), 'mid_price': [3000.0]})
+        actual = SilverToFeatureStore.calculate_last_price_columns(prices_df, SilverToFeatureStore.create_ts_df('2015-01-01', '2015-01-01'))
+        for k, v in actual.items():
+            np.testing.assert_array_equal(v, [np.nan], err_msg=k)
+
+    def test_selected_features_match_full_build(self):
+        values = random_series(300, seed=2)
+        df = pd.DataFrame(values.T, columns=WINDOW_COLUMNS)
+        df['trade_date'] = pd.date_range('2015-01-01', periods=len(df), freq='1D')
+        df = df[df['mid_price'].notnull()].reset_index(drop=True)
+        full = SilverToFeatureStore('.').append_features(df)
+        self.assertEqual(list(full.columns), ['trade_date', 'mid_price'] + FEATURE_NAMES)
+        for features in [['month_cos', 'spread_mean', 'lag_price'], ['mid_price_estd_03'], ['mid_price_std_30', 'volume_ton_sum']]:
+            selected = SilverToFeatureStore('.', features=features).append_features(df)
+            columns = ['trade_date', 'mid_price'] + [c for c in FEATURE_NAMES if c in features]
+            pd.testing.assert_frame_equal(selected, full[columns], check_exact=True)
+
+    @unittest.skipUnless(os.environ.get('ECX_BENCHMARK'), 'set ECX_BENCHMARK=1 to run the benchmark')
+    def test_benchmark(self):
+        # a symbol's 2012 to 2018 history, and a long one
+        for n_days in [2300, 20000]:
+            values = random_series(n_days)
+            for name, features in [('pandas', pandas_features), ('window_features', kernel_features)]:
+                print(f'{name}: best of 5 {best_of(5, features, values) * 1000:.1f}ms for {n_days} days')
+            state = FeatureState()
+            kernel_features(values[:, :-1], state)
+            extend = lambda: kernel_features(values[:, -1:], FeatureState.from_dict(state.to_dict()))
+            print(f'window_features: best of 5 {best_of(5, extend) * 1000:.2f}ms extending {n_days - 1} days by one')
+        prices_df = random_trades(20000)
+        ts_df = SilverToFeatureStore.create_ts_df(prices_df['trade_date'].min(), prices_df['trade_date'].max())
+        for name, lags in [('merge_asof lags', pandas_lag_features), ('searchsorted lags', SilverToFeatureStore.calculate_last_price_columns)]:
+            print(f'{name}: best of 5 {best_of(5, lags, prices_df, ts_df) * 1000:.1f}ms for {len(ts_df)} days')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,58 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from ecx_analytics.price_predictor.feature_matrix import FeatureMatrix
+
+
+class TestFeatureMatrix(unittest.TestCase):
+    """Day offset lookups in the dense per-symbol feature matrix"""
+
+    def setUp(self):
+        # 2018-04-03 and 2018-04-04 have no feature row
+        self.df = pd.DataFrame({
+            'trade_date': pd.to_datetime(['2018-04-01', '2018-04-02', '2018-04-05']),
+            'mid_price': [3000.0, 3010.0, 3020.0],
+            'lag_price': [2990.0, 3000.0, 3010.0],
+            'volume_ton_sum': [10.0, 20.0, 30.0]
+        })
+        self.feature_matrix = FeatureMatrix.from_df(self.df)
+
+    def test_offsets(self):
+        feature_matrix = self.feature_matrix
+        self.assertEqual(feature_matrix.columns, ('lag_price', 'volume_ton_sum'))
+        self.assertEqual(len(feature_matrix), 5)
+        self.assertEqual(feature_matrix.start, np.datetime64('2018-04-01'))
+        self.assertEqual(feature_matrix.end, np.datetime64('2018-04-05'))
+        self.assertEqual(feature_matrix.offset('2018-04-05'), 4)
+        np.testing.assert_array_equal(feature_matrix.row('2018-04-02'), [[3000.0, 20.0]])
+        np.testing.assert_array_equal(feature_matrix.row('2018-04-03'), [[np.nan, np.nan]])
+        np.testing.assert_array_equal(feature_matrix.rows('2018-04-02', '2018-04-05')[[0, 3]], [[3000.0, 20.0], [3010.0, 30.0]])
+        self.assertEqual(len(feature_matrix.dates('2018-04-02', '2018-04-05')), 4)
+
+    def test_read_only(self):
+        with self.assertRaises(ValueError):
+            self.feature_matrix.row('2018-04-01')[0, 0] = 0.0
+
+    def test_out_of_range(self):
+        for target_date in ['2018-03-31', '2018-04-06']:
+            with self.assertRaises(KeyError):
+                self.feature_matrix.row(target_date)
+        with self.assertRaises(KeyError):
+            self.feature_matrix.rows('2018-04-01', '2018-04-06')
+        with self.assertRaises(ValueError):
+            self.feature_matrix.rows('2018-04-05', '2018-04-01')
+
+    def test_column_indices(self):
+        self.assertEqual(self.feature_matrix.column_indices(['volume_ton_sum', 'lag_price']), [1, 0])
+        with self.assertRaises(KeyError):
+            self.feature_matrix.column_indices(['lag_price', 'not_a_feature'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+from swagger_server.controllers.mid_price_predictor_controller import ARTIFACTS_READY
+from swagger_server.test import BaseTestCase
+
+
+class TestHealthController(BaseTestCase):
+    """HealthController integration test stubs"""
+
+    def test_liveness(self):
+        """Test case for liveness
+
+        Reports that the server process is running
+        """
+        response = self.client.open(
+            '/ecx_analytics/health/live',
+            method='GET')
+        self.assert200(response,
+                       'Response body is : ' + response.data.decode('utf-8'))
+
+    def test_readiness(self):
+        """Test case for readiness
+
+        Reports ready only once the artifacts have been preloaded
+        """
+        ARTIFACTS_READY.clear()
+        response = self.client.open(
+            '/ecx_analytics/health/ready',
+            method='GET')
+        self.assertStatus(response, 503)
+        ARTIFACTS_READY.set()
+        response = self.client.open(
+            '/ecx_analytics/health/ready',
+            method='GET')
+        self.assert200(response,
+                       'Response body is : ' + response.data.decode('utf-8'))
+
+
+if __name__ == '__main__':
+    import unittest
+    unittest.main()
@@ -0,0 +1,96 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import pathlib
+import subprocess
+import sys
+import unittest
+
+PROJECTPATH = pathlib.Path(__file__).parent.parent.parent.resolve()
+
+HEAVY_MODULES = ['pandas', 'sklearn', 'skopt', 'joblib', 'scipy']
+# an entry point's own import cost, beyond the frameworks it needs, as a share of importing pandas
+IMPORT_BUDGET = 0.25
+
+
+def import_times(module):
+    """Imports `module` in a fresh interpreter with `-X importtime`.
+
+    Returns a dict of top level package to cumulative import time in
+    microseconds.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=str(PROJECTPATH),
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True
+    )
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        _, cumulative, name = [part.strip() for part in line[len('import time:'):].split('|')]
+        if not cumulative.isdigit():
+            continue
+        package = name.split('.')[0]
+        times[package] = max(times.get(package, 0), int(cumulative))
+    return times
+
+
+def import_seconds(module, preloaded=(), runs=3):
+    """Best of `runs` wall times in seconds to import `module` in a fresh
+    interpreter where the `preloaded` modules were imported first."""
+    code = ''.join(f'import {m}\n' for m in preloaded) + \
+        f'import time\nstart = time.perf_counter()\nimport {module}\nprint(time.perf_counter() - start)'
+    return min(
+        float(subprocess.run(
+            [sys.executable, '-c', code],
+            cwd=str(PROJECTPATH),
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+            check=True
+        ).stdout)
+        for _ in range(runs)
+    )
+
+
+class TestImportTime(unittest.TestCase):
+    """Guards the entry points against eagerly importing heavy modules and slow imports"""
+
+    def assert_lazy(self, module):
+        times = import_times(module)
+        heavy = {m: times[m] for m in HEAVY_MODULES if m in times}
+        self.assertEqual(heavy, {},
+                         f'Importing {module} eagerly imported {heavy} (cumulative us), '
+                         f'total import time {times.get(module.split(".")[0])}us')
+
+    @classmethod
+    def setUpClass(cls):
+        cls.pandas_seconds = import_seconds('pandas')
+
+    def assert_within_budget(self, module, dependencies):
+        own = import_seconds(module, preloaded=dependencies)
+        self.assertLess(own, IMPORT_BUDGET * self.pandas_seconds,
+                        f'Importing {module} took {own * 1000:.0f}ms beyond {dependencies}, '
+                        f'importing pandas takes {self.pandas_seconds * 1000:.0f}ms')
+
+    def test_prediction_controller_import(self):
+        module = 'swagger_server.controllers.mid_price_predictor_controller'
+        self.assert_lazy(module)
+        self.assert_within_budget(module, ['connexion', 'flask', 'numpy', 'prometheus_client'])
+
+    def test_predictor_import(self):
+        module = 'ecx_analytics.price_predictor.predict'
+        self.assert_lazy(module)
+        self.assert_within_budget(module, ['numpy'])
+
+    def test_data_processor_main_import(self):
+        module = 'ecx_analytics.data_processor.data_processor_main'
+        self.assert_lazy(module)
+        self.assert_within_budget(module, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
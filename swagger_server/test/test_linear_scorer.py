@@ -0,0 +1,69 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import pathlib
+import tempfile
+import unittest
+import warnings
+
+import joblib
+import numpy as np
+
+from ecx_analytics.price_predictor.linear_scorer import LinearScorer, LinearScorerBank
+
+MODEL_PATH = pathlib.Path(__file__).resolve().parents[2].joinpath('models')
+SYMBOLS = ['LUBP4', 'LUBP3', 'ULK5', 'UFRAUG']
+
+
+def load_estimator(symbol):
+    with warnings.catch_warnings():
+        # the pickles were written by an older scikit-learn
+        warnings.simplefilter('ignore')
+        return joblib.load(MODEL_PATH.joinpath(f'{symbol}_model.modelpickle'))
+
+
+class TestLinearScorer(unittest.TestCase):
+    """The exported linear scorers against the pickled ElasticNet models"""
+
+    def test_parity_with_estimators(self):
+        X = np.random.default_rng(0).normal(3000, 500, (200, 20))
+        for symbol in SYMBOLS:
+            model = load_estimator(symbol)
+            scorer = LinearScorer.load(MODEL_PATH.joinpath(f'{symbol}_linear.npz'))
+            self.assertEqual(len(scorer.feature_names), model.coef_.shape[0])
+            np.testing.assert_array_equal(scorer.coef, model.coef_, err_msg=symbol)
+            self.assertEqual(scorer.intercept, float(model.intercept_))
+            np.testing.assert_allclose(scorer.predict(X), model.predict(X), rtol=1e-12, err_msg=symbol)
+
+    def test_save_load_round_trip(self):
+        scorer = LinearScorer([0.5, 0.0, -2.0], 10.0, ['a', 'b', 'c'])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = pathlib.Path(tmp_dir).joinpath('scorer.npz')
+            scorer.save(path)
+            loaded = LinearScorer.load(path)
+        np.testing.assert_array_equal(loaded.coef, scorer.coef)
+        self.assertEqual((loaded.intercept, loaded.feature_names), (10.0, ('a', 'b', 'c')))
+
+    def test_aligned_to_feature_store_columns(self):
+        scorer = LinearScorer([0.5, 0.0, -2.0], 10.0, ['a', 'b', 'c'])
+        x = np.array([[1.0, 2.0, 3.0]])
+        aligned = scorer.aligned_to(['c', 'a', 'd'])
+        np.testing.assert_array_equal(aligned.coef, [-2.0, 0.5, 0.0])
+        np.testing.assert_allclose(aligned.predict(x[:, [2, 0, 1]]), scorer.predict(x))
+        # b has a zero weight, only used features must be in the store
+        with self.assertRaises(ValueError):
+            scorer.aligned_to(['a', 'b'])
+
+    def test_bank_matches_scorers(self):
+        scorers = [LinearScorer([1.0, 2.0], 0.5, ['a', 'b']), LinearScorer([-1.0, 0.0], 3.0, ['a', 'b'])]
+        X = np.random.default_rng(1).normal(0, 1, (6, 2))
+        owners = np.array([0, 1, 1, 0, 1, 0])
+        expected = [scorers[o].predict(x[None, :])[0] for o, x in zip(owners, X)]
+        np.testing.assert_allclose(LinearScorerBank(scorers).predict(owners, X), expected)
+        with self.assertRaises(ValueError):
+            LinearScorerBank([scorers[0], LinearScorer([1.0, 2.0], 0.0, ['b', 'a'])])
+
+
+if __name__ == '__main__':
+    unittest.main()
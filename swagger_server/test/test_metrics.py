@@ -0,0 +1,145 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import logging
+import os
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+
+from flask import json
+from prometheus_client import REGISTRY, generate_latest
+from prometheus_client.parser import text_string_to_metric_families
+
+from swagger_server import metrics
+from swagger_server.__main__ import create_app
+from swagger_server.encoder import JSONEncoder
+from swagger_server.test import BaseTestCase
+from swagger_server.test.test_predictor import write_artifacts
+from swagger_server.controllers import mid_price_predictor_controller
+from ecx_analytics.price_predictor.artifact_cache import ArtifactCache
+from ecx_analytics.price_predictor.predict import ECXPredictor
+
+
+def sample_value(text, name, labels):
+    """The value of the sample `name` with `labels` in a scrape, 0 when absent."""
+    for family in text_string_to_metric_families(text):
+        for sample in family.samples:
+            if sample.name == name and all(sample.labels.get(k) == v for k, v in labels.items()):
+                return sample.value
+    return 0.0
+
+
+class TestMetricsEndpoint(BaseTestCase):
+    """Metrics scraped from /metrics of the app as the server builds it"""
+
+    def create_app(self):
+        logging.getLogger('connexion.operation').setLevel('ERROR')
+        return create_app().app
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        project_path = pathlib.Path(self.tmp_dir.name)
+        for symbol, seed in [('LUBP4', 0), ('LUBP3', 1)]:
+            write_artifacts(project_path, symbol, seed=seed)
+        # the caches the collector reports on, emptied of the temporary artifacts afterwards
+        predictor = ECXPredictor(
+            project_path,
+            cache=mid_price_predictor_controller.ARTIFACT_CACHE,
+            prediction_cache=mid_price_predictor_controller.PREDICTION_CACHE,
+            stage_observer=metrics.observe_stage
+        )
+        patcher = mock.patch.object(mid_price_predictor_controller, 'PREDICTOR', predictor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        for cache in [predictor.cache, predictor.prediction_cache]:
+            cache.clear()
+            self.addCleanup(cache.clear)
+
+    def scrape(self):
+        response = self.client.open('/metrics', method='GET')
+        self.assert200(response)
+        return response.data.decode('utf-8')
+
+    def test_scrape_after_prediction(self):
+        before = self.scrape()
+        response = self.client.open(
+            '/ecx_analytics/price/mid_price_prediction',
+            method='GET',
+            query_string=[('symbol', 'LUBP4'), ('target_date', '2018-04-02')])
+        self.assert200(response,
+                       'Response body is : ' + response.data.decode('utf-8'))
+        after = self.scrape()
+        expected = [
+            ('ecx_http_requests_total', {'endpoint': '/ecx_analytics/price/mid_price_prediction', 'status': '200'}),
+            ('ecx_predictions_total', {'endpoint': '/ecx_analytics/price/mid_price_prediction', 'symbol': 'LUBP4'}),
+            ('ecx_prediction_stage_seconds_count', {'stage': 'make_prediction'}),
+            ('ecx_prediction_stage_seconds_count', {'stage': 'json_encode'}),
+            ('ecx_cache_misses_total', {'cache': 'prediction'}),
+            ('ecx_cache_misses_total', {'cache': 'artifact'}),
+        ]
+        for name, labels in expected:
+            self.assertEqual(sample_value(after, name, labels) - sample_value(before, name, labels), 1, f'{name} {labels}')
+        self.assertEqual(sample_value(after, 'ecx_cache_size', {'cache': 'artifact'}), 1)
+        # the scrape itself is not counted
+        self.assertEqual(sample_value(after, 'ecx_http_requests_total', {'endpoint': '/metrics'}), 0)
+
+    def test_batch_counts_each_symbol(self):
+        endpoint = '/ecx_analytics/price/mid_price_prediction/batch'
+        before = self.scrape()
+        body = {'pairs': [{'symbol': 'LUBP4', 'target_date': '2018-04-02'}, {'symbol': 'LUBP3', 'target_date': '2018-04-02'},
+                          {'symbol': 'LUBP4', 'target_date': '2018-04-03'}]}
+        response = self.client.open(endpoint, method='POST', data=json.dumps(body), content_type='application/json')
+        self.assert200(response,
+                       'Response body is : ' + response.data.decode('utf-8'))
+        after = self.scrape()
+        for name, labels, n in [
+            ('ecx_http_requests_total', {'endpoint': endpoint, 'status': '200'}, 1),
+            ('ecx_predictions_total', {'endpoint': endpoint, 'symbol': 'LUBP4'}, 2),
+            ('ecx_predictions_total', {'endpoint': endpoint, 'symbol': 'LUBP3'}, 1),
+        ]:
+            self.assertEqual(sample_value(after, name, labels) - sample_value(before, name, labels), n, f'{name} {labels}')
+
+
+class TestMetrics(unittest.TestCase):
+    """The metric collectors and encoder outside of a request"""
+
+    def test_timed_json_encoder(self):
+        labels = {'stage': 'json_encode'}
+        before = REGISTRY.get_sample_value('ecx_prediction_stage_seconds_count', labels) or 0
+        o = {'value': 3000.5, 'features': [{'lag_price': 2990.0}]}
+        self.assertEqual(metrics.TimedJSONEncoder().encode(o), JSONEncoder().encode(o))
+        self.assertEqual(REGISTRY.get_sample_value('ecx_prediction_stage_seconds_count', labels), before + 1)
+
+    def test_cache_collector(self):
+        cache = ArtifactCache()
+        cache.get('LUBP4', str)
+        cache.get('LUBP4', str)
+        cache.get('LUBP3', str)
+        families = {f.name: f for f in metrics.CacheCollector({'artifact': cache}).collect()}
+        values = {name: families[name].samples[0].value for name in families}
+        self.assertEqual(values, {'ecx_cache_hits': 1, 'ecx_cache_misses': 2, 'ecx_cache_hit_ratio': 1 / 3, 'ecx_cache_size': 2})
+        self.assertEqual(families['ecx_cache_hits'].samples[0].labels, {'cache': 'artifact'})
+
+    def test_build_registry_once(self):
+        registry = object()
+        with mock.patch.object(metrics, '_registry', registry):
+            self.assertIs(metrics.build_registry({}), registry)
+
+    def test_build_registry_multiprocess(self):
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                mock.patch.dict(os.environ, {'PROMETHEUS_MULTIPROC_DIR': tmp_dir}), \
+                mock.patch.object(metrics, '_registry', None):
+            cache = ArtifactCache()
+            cache.get('LUBP4', str)
+            registry = metrics.build_registry({'artifact': cache})
+            self.assertIsNot(registry, REGISTRY)
+            text = generate_latest(registry).decode('utf-8')
+        self.assertEqual(sample_value(text, 'ecx_cache_misses_total', {'cache': 'artifact'}), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
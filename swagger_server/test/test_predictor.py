@@ -0,0 +1,126 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import os
+import pathlib
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from ecx_analytics.price_predictor.predict import ECXPredictor
+from ecx_analytics.price_predictor.artifact_cache import ArtifactCache
+from ecx_analytics.price_predictor.prediction_cache import PredictionCache
+from ecx_analytics.price_predictor.linear_scorer import LinearScorer
+
+FEATURES = ['lag_price', 'mid_price_ma_30', 'volume_ton_sum']
+
+
+def write_artifacts(project_path, symbol, n_days=60, seed=0):
+    """A pickled feature store and an exported linear scorer for `symbol`."""
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({'trade_date': pd.date_range('2018-03-01', periods=n_days, freq='1D'), 'mid_price': 3000 + rng.normal(0, 20, n_days)})
+    for c in FEATURES:
+        df[c] = rng.normal(0, 1, n_days)
+    feature_store_path = project_path.joinpath('data', 'feature_store')
+    feature_store_path.mkdir(parents=True, exist_ok=True)
+    df.to_pickle(feature_store_path.joinpath(f'{symbol}_complete_features.pkl'))
+    model_path = project_path.joinpath('models')
+    model_path.mkdir(exist_ok=True)
+    LinearScorer(rng.normal(0, 1, len(FEATURES)), 3000.0, FEATURES).save(model_path.joinpath(f'{symbol}_linear.npz'))
+    return df
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestPredictionCache(unittest.TestCase):
+    """Time-to-live and LRU bounds of the prediction cache"""
+
+    def test_entries_expire(self):
+        clock = Clock()
+        cache = PredictionCache(ttl=10, clock=clock)
+        cache.set('a', 1)
+        clock.now = 9.9
+        self.assertEqual(cache.get('a'), 1)
+        clock.now = 10.0
+        self.assertIsNone(cache.get('a'))
+        self.assertEqual(len(cache), 0)
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['expirations']), (1, 1, 1))
+
+    def test_without_ttl_entries_never_expire(self):
+        clock = Clock()
+        cache = PredictionCache(ttl=None, clock=clock)
+        cache.set('a', 1)
+        clock.now = 1e9
+        self.assertEqual(cache.get('a'), 1)
+
+    def test_least_recently_used_is_evicted(self):
+        cache = PredictionCache(max_size=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+
+
+class TestPredictor(unittest.TestCase):
+    """Scoring and prediction caching against artifacts on disk"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.project_path = pathlib.Path(self.tmp_dir.name)
+        self.df = write_artifacts(self.project_path, 'LUBP4')
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_cached_rows_do_not_hold_the_feature_matrix(self):
+        predictor = ECXPredictor(self.project_path, prediction_cache=PredictionCache())
+        prediction, x, columns = predictor.score('LUBP4', '2018-04-02')
+        feature_matrix, _ = predictor.load_artifacts('LUBP4')
+        np.testing.assert_array_equal(x, feature_matrix.row('2018-04-02'))
+        cached = predictor.prediction_cache.get(('LUBP4', np.datetime64('2018-04-02'), predictor.artifact_fingerprint('LUBP4')))
+        self.assertIsNone(cached[1].base)
+        self.assertEqual(cached[1].shape, (1, len(FEATURES)))
+
+    def replace_model(self, predictor):
+        fingerprint = predictor.artifact_fingerprint('LUBP4')
+        model_path = predictor.model_file('LUBP4')
+        LinearScorer(np.zeros(len(FEATURES)), 1000.0, FEATURES).save(model_path)
+        # same file size, so make sure the modification time moves
+        stat = model_path.stat()
+        os.utime(model_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+        self.assertNotEqual(predictor.artifact_fingerprint('LUBP4'), fingerprint)
+
+    def test_replaced_model_is_not_served_from_cache(self):
+        predictor = ECXPredictor(self.project_path, prediction_cache=PredictionCache())
+        prediction, _, _ = predictor.score('LUBP4', '2018-04-02')
+        self.assertEqual(predictor.score('LUBP4', '2018-04-02')[0], prediction)
+        self.replace_model(predictor)
+        self.assertEqual(predictor.score('LUBP4', '2018-04-02')[0], 1000.0)
+        self.assertEqual(predictor.prediction_cache.stats()['misses'], 2)
+
+    def test_replaced_artifacts_are_reloaded(self):
+        predictor = ECXPredictor(self.project_path, cache=ArtifactCache())
+        _, model = predictor.get_artifacts('LUBP4')
+        self.assertIs(predictor.get_artifacts('LUBP4')[1], model)
+        self.replace_model(predictor)
+        _, reloaded_model = predictor.get_artifacts('LUBP4')
+        self.assertEqual(reloaded_model.intercept, 1000.0)
+        self.assertEqual(len(predictor.cache), 1)
+        stats = predictor.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['reloads']), (1, 2, 1))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,12 +2,21 @@
 
 from __future__ import absolute_import
 
+import datetime as dt
+import pathlib
+import tempfile
+from unittest import mock
+
 from flask import json
 from six import BytesIO
 
 from swagger_server.models.mid_price_response import MidPriceResponse  # noqa: E501
 from swagger_server.models.symbol import Symbol  # noqa: E501
 from swagger_server.test import BaseTestCase
+from swagger_server.test.test_predictor import write_artifacts
+from swagger_server.controllers import mid_price_predictor_controller
+from ecx_analytics.price_predictor.predict import ECXPredictor, LinearScorerBank
+from ecx_analytics.price_predictor.prediction_cache import PredictionCache
 
 
 class TestPriceController(BaseTestCase):
@@ -26,6 +35,209 @@ class TestPriceController(BaseTestCase):
         self.assert200(response,
                        'Response body is : ' + response.data.decode('utf-8'))
 
+    def test_mid_price_prediction_batch_unsupported_symbol(self):
+        """Test case for mid_price_prediction_batch
+
+        Rejects batches containing an unsupported symbol
+        """
+        body = {'symbols': ['LUBP4', 'NOTASYMBOL'], 'target_dates': ['2018-04-02']}
+        response = self.client.open(
+            '/ecx_analytics/price/mid_price_prediction/batch',
+            method='POST',
+            data=json.dumps(body),
+            content_type='application/json')
+        self.assert404(response,
+                       'Response body is : ' + response.data.decode('utf-8'))
+
+    def test_mid_price_prediction_batch_unsupported_date(self):
+        """Test case for mid_price_prediction_batch
+
+        Rejects batches containing a date outside April 2018
+        """
+        body = {'pairs': [{'symbol': 'LUBP4', 'target_date': '2018-05-02'}]}
+        response = self.client.open(
+            '/ecx_analytics/price/mid_price_prediction/batch',
+            method='POST',
+            data=json.dumps(body),
+            content_type='application/json')
+        self.assert400(response,
+                       'Response body is : ' + response.data.decode('utf-8'))
+
+    def test_mid_price_series_reversed_range(self):
+        """Test case for mid_price_series
+
+        Rejects a series whose start is after its end
+        """
+        query_string = [('symbol', 'LUBP4'),
+                        ('start', '2018-04-10'),
+                        ('end', '2018-04-01')]
+        response = self.client.open(
+            '/ecx_analytics/price/mid_price_series',
+            method='GET',
+            query_string=query_string)
+        self.assert400(response,
+                       'Response body is : ' + response.data.decode('utf-8'))
+
+
+
+class TestPriceControllerArtifacts(BaseTestCase):
+    """PriceController tests against artifacts written to a temporary project"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp_dir.cleanup)
+        project_path = pathlib.Path(self.tmp_dir.name)
+        write_artifacts(project_path, 'LUBP4')
+        write_artifacts(project_path, 'LUBP3', seed=1)
+        predictor = ECXPredictor(project_path, prediction_cache=PredictionCache())
+        patcher = mock.patch.object(mid_price_predictor_controller, 'PREDICTOR', predictor)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def get_prediction(self, headers=None, **params):
+        params = {'symbol': 'LUBP4', 'target_date': '2018-04-02', **params}
+        query_string = list(params.items())
+        return self.client.open(
+            '/ecx_analytics/price/mid_price_prediction',
+            method='GET',
+            query_string=query_string,
+            headers=headers)
+
+    def get_batch(self, body):
+        return self.client.open(
+            '/ecx_analytics/price/mid_price_prediction/batch',
+            method='POST',
+            data=json.dumps(body),
+            content_type='application/json')
+
+    def test_mid_price_prediction_batch(self):
+        """Test case for mid_price_prediction_batch
+
+        Returns predictions in request order, each equal to the single prediction
+        """
+        body = {'symbols': ['LUBP4', 'LUBP3'], 'target_dates': ['2018-04-02', '2018-04-05'],
+                'pairs': [{'symbol': 'LUBP3', 'target_date': '2018-04-20'}, {'symbol': 'LUBP4', 'target_date': '2018-04-02'}]}
+        predictor = mid_price_predictor_controller.PREDICTOR
+        with mock.patch.object(predictor, 'score_symbols', wraps=predictor.score_symbols) as score_symbols, \
+                mock.patch('ecx_analytics.price_predictor.predict.LinearScorerBank', wraps=LinearScorerBank) as bank:
+            response = self.get_batch(body)
+        self.assert200(response,
+                       'Response body is : ' + response.data.decode('utf-8'))
+        # both symbols share a feature order, so they are scored together in one bank
+        score_symbols.assert_called_once()
+        bank.assert_called_once()
+        self.assertEqual(len(bank.call_args[0][0]), 2)
+        results = json.loads(response.data)
+        expected_pairs = [('LUBP4', '2018-04-02'), ('LUBP4', '2018-04-05'), ('LUBP3', '2018-04-02'), ('LUBP3', '2018-04-05'),
+                          ('LUBP3', '2018-04-20'), ('LUBP4', '2018-04-02')]
+        self.assertEqual([(r['symbol'], r['target_date']) for r in results], expected_pairs)
+        for r in results:
+            single = json.loads(self.get_prediction(symbol=r['symbol'], target_date=r['target_date']).data)[0]
+            self.assertEqual(r['value'], single['value'])
+            self.assertEqual(r['features'], single['features'][0])
+
+    def test_mid_price_prediction_batch_features(self):
+        """Test case for mid_price_prediction_batch
+
+        Applies the feature selection to every prediction
+        """
+        body = {'pairs': [{'symbol': 'LUBP4', 'target_date': '2018-04-02'}], 'features': 'lag_price'}
+        response = self.get_batch(body)
+        self.assert200(response,
+                       'Response body is : ' + response.data.decode('utf-8'))
+        self.assertEqual(list(json.loads(response.data)[0]['features']), ['lag_price'])
+        response = self.get_batch(dict(body, features='none'))
+        self.assertNotIn('features', json.loads(response.data)[0])
+
+    def get_series(self, start, end):
+        query_string = [('symbol', 'LUBP4'), ('start', start), ('end', end)]
+        return self.client.open(
+            '/ecx_analytics/price/mid_price_series',
+            method='GET',
+            query_string=query_string)
+
+    def test_mid_price_series(self):
+        """Test case for mid_price_series
+
+        Returns one prediction per day of the range, equal to the single predictions
+        """
+        response = self.get_series('2018-04-20', '2018-04-29')
+        self.assert200(response,
+                       'Response body is : ' + response.data.decode('utf-8'))
+        body = json.loads(response.data)
+        self.assertEqual(body['symbol'], 'LUBP4')
+        self.assertEqual([p['target_date'] for p in body['series']], [f'2018-04-{d}' for d in range(20, 30)])
+        for p in body['series']:
+            single = json.loads(self.get_prediction(target_date=p['target_date']).data)[0]
+            self.assertEqual(p['value'], single['value'])
+        response = self.get_series('2018-04-02', '2018-04-02')
+        self.assertEqual(len(json.loads(response.data)['series']), 1)
+
+    def test_mid_price_series_past_feature_store(self):
+        """Test case for mid_price_series
+
+        Rejects a range running past the end of the feature store
+        """
+        # the feature store ends on 2018-04-29
+        response = self.get_series('2018-04-25', '2018-04-30')
+        self.assert404(response,
+                       'Response body is : ' + response.data.decode('utf-8'))
+
+    def test_mid_price_prediction_not_modified(self):
+        """Test case for mid_price_prediction
+
+        Answers 304 without a body when If-None-Match holds the current ETag
+        """
+        response = self.get_prediction()
+        self.assert200(response,
+                       'Response body is : ' + response.data.decode('utf-8'))
+        etag = response.headers['ETag']
+        response = self.get_prediction(headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.headers['ETag'], etag)
+        self.assertEqual(response.data, b'')
+        # weak tags and lists of tags are matched too
+        response = self.get_prediction(headers={'If-None-Match': f'"other" ,  W/{etag}'})
+        self.assertEqual(response.status_code, 304)
+        # the ETag depends on the feature selection
+        response = self.get_prediction(headers={'If-None-Match': etag}, features='none')
+        self.assert200(response,
+                       'Response body is : ' + response.data.decode('utf-8'))
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_mid_price_prediction_not_modified_is_validated(self):
+        """Test case for mid_price_prediction
+
+        Validates the request before answering 304
+        """
+        predictor = mid_price_predictor_controller.PREDICTOR
+        # the feature store ends on 2018-04-29
+        etag = predictor.prediction_etag('LUBP4', dt.datetime(2018, 4, 30), variant=None)
+        response = self.get_prediction(headers={'If-None-Match': f'"{etag}"'}, target_date='2018-04-30')
+        self.assert404(response,
+                       'Response body is : ' + response.data.decode('utf-8'))
+        etag = predictor.prediction_etag('LUBP4', dt.datetime(2018, 4, 2), variant='not_a_feature')
+        response = self.get_prediction(headers={'If-None-Match': f'"{etag}"'}, features='not_a_feature')
+        self.assert400(response,
+                       'Response body is : ' + response.data.decode('utf-8'))
+
+    def test_mid_price_prediction_feature_selection(self):
+        """Test case for mid_price_prediction
+
+        Returns no features, a subset of them or rejects unknown ones
+        """
+        response = self.get_prediction(features='none')
+        self.assert200(response,
+                       'Response body is : ' + response.data.decode('utf-8'))
+        self.assertEqual(list(json.loads(response.data)[0]), ['value'])
+        response = self.get_prediction(features='volume_ton_sum,lag_price')
+        self.assert200(response,
+                       'Response body is : ' + response.data.decode('utf-8'))
+        self.assertEqual(list(json.loads(response.data)[0]['features'][0]), ['volume_ton_sum', 'lag_price'])
+        response = self.get_prediction(features='lag_price,not_a_feature')
+        self.assert400(response,
+                       'Response body is : ' + response.data.decode('utf-8'))
+
 
 if __name__ == '__main__':
     import unittest
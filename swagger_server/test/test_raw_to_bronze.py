@@ -0,0 +1,110 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import pathlib
+import tempfile
+import unittest
+
+import pandas as pd
+
+from ecx_analytics.data_processor.raw_to_bronze import RawToBronze
+
+
+def write_report(path, prices, **columns):
+    # raw reports have two title rows above the header
+    df = pd.DataFrame({'Symbol': ['LUBP4'] * len(prices), 'Closing Price': prices, **columns})
+    df.to_excel(path, sheet_name='rptCoffee', startrow=2, index=False)
+
+
+class TestRawToBronze(unittest.TestCase):
+    """Incremental bronze ingestion through the raw file manifest"""
+
+    storage = 'pickle'
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data_path = pathlib.Path(self.tmp_dir.name)
+        for layer in ['raw', 'bronze']:
+            self.data_path.joinpath(layer).mkdir()
+        self.raw_path = self.data_path.joinpath('raw')
+        write_report(self.raw_path.joinpath('d1.xlsx'), [3000.0, 3010.0])
+        write_report(self.raw_path.joinpath('d2.xlsx'), [3020.0])
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def run_bronze(self, incremental=True):
+        raw_to_bronze = RawToBronze(self.data_path, storage=self.storage)
+        raw_to_bronze.run(incremental=incremental)
+        return raw_to_bronze, raw_to_bronze.load_bronze_df(), raw_to_bronze.load_manifest()
+
+    def assert_matches_rebuild(self, bronze_df):
+        rebuild_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(rebuild_dir.cleanup)
+        rebuild_path = pathlib.Path(rebuild_dir.name)
+        rebuild_path.joinpath('bronze').mkdir()
+        rebuild_path.joinpath('raw').symlink_to(self.raw_path)
+        rebuild = RawToBronze(rebuild_path, storage=self.storage)
+        rebuild.run(incremental=False)
+        pd.testing.assert_frame_equal(bronze_df.reset_index(drop=True), rebuild.load_bronze_df().reset_index(drop=True))
+
+    def test_manifest_flow(self):
+        _, bronze_df, manifest = self.run_bronze()
+        self.assertEqual(sorted(manifest), ['d1.xlsx', 'd2.xlsx'])
+        self.assertEqual(len(bronze_df), 3)
+        # nothing changed
+        _, unchanged_df, _ = self.run_bronze()
+        pd.testing.assert_frame_equal(unchanged_df, bronze_df)
+        # a corrected report replaces its rows, a new one is added, a deleted one is retracted
+        write_report(self.raw_path.joinpath('d2.xlsx'), [3025.0, 3030.0, 3035.0])
+        write_report(self.raw_path.joinpath('d3.xlsx'), [3040.0])
+        self.raw_path.joinpath('d1.xlsx').unlink()
+        raw_to_bronze, bronze_df, manifest = self.run_bronze()
+        self.assertEqual(raw_to_bronze.failures, {})
+        self.assertEqual(sorted(manifest), ['d2.xlsx', 'd3.xlsx'])
+        self.assertEqual(bronze_df['Closing Price'].tolist(), [3025.0, 3030.0, 3035.0, 3040.0])
+        self.assert_matches_rebuild(bronze_df)
+
+    def test_failed_files_do_not_block_ingestion(self):
+        _, _, manifest = self.run_bronze()
+        self.raw_path.joinpath('d3_bad.xlsx').write_bytes(b'not a workbook')
+        self.raw_path.joinpath('d1.xlsx').unlink()
+        # a changed file that fails to parse keeps its previous rows
+        self.raw_path.joinpath('d2.xlsx').write_bytes(b'truncated download')
+        raw_to_bronze, bronze_df, new_manifest = self.run_bronze()
+        self.assertEqual(sorted(raw_to_bronze.failures), ['d2.xlsx', 'd3_bad.xlsx'])
+        self.assertEqual(bronze_df['source_file'].tolist(), ['d2.xlsx'])
+        self.assertEqual(new_manifest, {'d2.xlsx': manifest['d2.xlsx']})
+        # once fixed, the files are picked up by the next run
+        write_report(self.raw_path.joinpath('d2.xlsx'), [3050.0])
+        write_report(self.raw_path.joinpath('d3_bad.xlsx'), [3060.0])
+        raw_to_bronze, bronze_df, new_manifest = self.run_bronze()
+        self.assertEqual(raw_to_bronze.failures, {})
+        self.assertEqual(sorted(new_manifest), ['d2.xlsx', 'd3_bad.xlsx'])
+        self.assert_matches_rebuild(bronze_df)
+
+
+    def test_mixed_type_cells(self):
+        # cells are typed one by one, so a column can mix text with numbers or dates
+        write_report(self.raw_path.joinpath('d3.xlsx'), ['3,050.50', 3060.0],
+                     **{'Trade Date': ['04/02/2018', pd.Timestamp('2018-04-03')], 'Volume (Ton)': [12.5, None]})
+        _, bronze_df, manifest = self.run_bronze()
+        self.assertEqual(sorted(manifest), ['d1.xlsx', 'd2.xlsx', 'd3.xlsx'])
+        rows = bronze_df[bronze_df['source_file'] == 'd3.xlsx']
+        self.assertEqual(rows['Closing Price'].tolist(), ['3,050.50', '3060'])
+        self.assertEqual(rows['Trade Date'].tolist(), ['04/02/2018', '04/03/2018'])
+        # the other reports' prices are numbers, they become text alongside
+        self.assertEqual(bronze_df['Closing Price'].iloc[0], '3000')
+        self.assertEqual(rows['Volume (Ton)'].tolist()[0], 12.5)
+        self.assertTrue(pd.isnull(rows['Volume (Ton)'].tolist()[1]))
+
+
+class TestRawToBronzeParquet(TestRawToBronze):
+    """Incremental bronze ingestion stored as Parquet"""
+
+    storage = 'parquet'
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,40 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import json
+import unittest
+
+import numpy as np
+
+from swagger_server.serializers import PredictionSerializer, parse_feature_selection
+
+
+class TestPredictionSerializer(unittest.TestCase):
+    """Direct JSON serialization of prediction responses"""
+
+    def test_numpy_scalar_value(self):
+        text = PredictionSerializer().prediction(round(np.float64(2808.8512), 2), ('a',), np.array([1.5]))
+        self.assertEqual(text, '{"value":2808.85,"features":{"a":1.5}}')
+        self.assertEqual(json.loads(text)['value'], 2808.85)
+
+    def test_feature_selection(self):
+        serializer = PredictionSerializer()
+        columns, row = ('lag_price', 'spread_mean', 'volume_ton_sum'), np.array([3000.5, np.nan, 12.0])
+        text = serializer.prediction(3001.0, columns, row, as_records=True, extra={'symbol': 'LUBP4'})
+        self.assertEqual(text, '{"symbol":"LUBP4","value":3001.0,"features":[{"lag_price":3000.5,"spread_mean":NaN,"volume_ton_sum":12.0}]}')
+        # a subset is written in the requested order
+        text = serializer.prediction(3001.0, columns, row, indices=[2, 0])
+        self.assertEqual(json.loads(text), {'value': 3001.0, 'features': {'volume_ton_sum': 12.0, 'lag_price': 3000.5}})
+        self.assertEqual(serializer.prediction(3001.0, columns, row, include_features=False), '{"value":3001.0}')
+
+    def test_parse_feature_selection(self):
+        self.assertEqual(parse_feature_selection(None), (True, None))
+        self.assertEqual(parse_feature_selection('all'), (True, None))
+        self.assertEqual(parse_feature_selection('none'), (False, None))
+        self.assertEqual(parse_feature_selection('lag_price, volume_ton_sum,'), (True, ['lag_price', 'volume_ton_sum']))
+        self.assertEqual(parse_feature_selection(['lag_price']), (True, ['lag_price']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,153 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import json
+import pathlib
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from ecx_analytics.data_processor.feature_state import FeatureState
+from ecx_analytics.data_processor.silver_to_feature_store import SilverToFeatureStore
+
+
+def random_silver(n_days=300, symbols=('LUBP4', 'LUBP3', 'ULK5'), seed=0):
+    """Silver trades of `symbols` on irregular days, with missing prices
+    and a symbol starting late."""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2015-01-01', periods=n_days, freq='1D')
+    frames = []
+    for i, s in enumerate(symbols):
+        traded = dates[(rng.random(n_days) < 0.5) & (np.arange(n_days) >= 40 * i)]
+        n = len(traded)
+        frames.append(pd.DataFrame({
+            'symbol': s,
+            'trade_date': traded,
+            'mid_price': 3000 + np.cumsum(rng.normal(0, 25, n)),
+            'spread': rng.uniform(0, 50, n),
+            'volume_ton': rng.uniform(0, 400, n)
+        }))
+    df = pd.concat(frames, ignore_index=True)
+    df.loc[rng.random(len(df)) < 0.05, 'mid_price'] = np.nan
+    df['symbol'] = df['symbol'].astype('category')
+    return df
+
+
+class TestSilverToFeatureStore(unittest.TestCase):
+    """Incremental and grouped feature builds against per-symbol full builds"""
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.data_path = pathlib.Path(self.tmp_dir.name)
+        for layer in ['silver', 'feature_store']:
+            self.data_path.joinpath(layer).mkdir()
+        self.silver_df = random_silver()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def feature_store(self, data_path=None):
+        return SilverToFeatureStore(data_path or self.data_path, symbols=['LUBP4', 'LUBP3', 'ULK5'], storage='parquet',
+                                    start='2015-01-01', end='2016-01-01', features_start='2015-01-01')
+
+    def write_silver(self, df, data_path=None):
+        feature_store = self.feature_store(data_path)
+        feature_store.storage.write_partitioned(df, feature_store.silver_path, 'ecx_silver')
+
+    def rebuild(self, df):
+        rebuild_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(rebuild_dir.cleanup)
+        rebuild_path = pathlib.Path(rebuild_dir.name)
+        for layer in ['silver', 'feature_store']:
+            rebuild_path.joinpath(layer).mkdir()
+        self.write_silver(df, rebuild_path)
+        rebuild = self.feature_store(rebuild_path)
+        rebuild.run(incremental=False)
+        return rebuild
+
+    def assert_states_equal(self, actual, expected):
+        # NaN windows only compare equal once serialized
+        self.assertEqual(json.dumps(actual.to_dict()), json.dumps(expected.to_dict()))
+
+    def assert_matches_rebuild(self, feature_store, df):
+        rebuild = self.rebuild(df)
+        for s in feature_store.symbols:
+            for load in ['load_complete', 'load_targets']:
+                pd.testing.assert_frame_equal(getattr(feature_store, load)(s), getattr(rebuild, load)(s), check_exact=True, obj=f'{s} {load}')
+            self.assert_states_equal(FeatureState.load(feature_store.feature_state_path(s)), FeatureState.load(rebuild.feature_state_path(s)))
+
+    def test_incremental_update_matches_full_build(self):
+        cutoffs = ['2015-04-01', '2015-04-02', '2015-07-15', '2016-01-01']
+        feature_store = self.feature_store()
+        for cutoff in cutoffs:
+            self.write_silver(self.silver_df[self.silver_df['trade_date'] < cutoff])
+            feature_store.run(incremental=True)
+            self.assertEqual(feature_store.failures, {})
+        self.assert_matches_rebuild(feature_store, self.silver_df)
+
+    def test_corrected_history_is_rebuilt(self):
+        feature_store = self.feature_store()
+        early = self.silver_df[self.silver_df['trade_date'] < '2015-07-01']
+        self.write_silver(early)
+        feature_store.run(incremental=True)
+        # a corrected report changes a price before the state's end, the row count stays the same
+        corrected = self.silver_df.copy()
+        corrected.loc[corrected.index[(corrected['symbol'] == 'LUBP4') & (corrected['trade_date'] < '2015-03-01')][-1], 'mid_price'] += 1.0
+        self.write_silver(corrected)
+        self.assertIsNone(feature_store.load_usable_state('LUBP4'))
+        self.assertIsNotNone(feature_store.load_usable_state('ULK5'))
+        feature_store.run(incremental=True)
+        self.assert_matches_rebuild(feature_store, corrected)
+
+    def test_state_json_round_trip(self):
+        self.write_silver(self.silver_df)
+        feature_store = self.feature_store()
+        df = feature_store.load_silver_df(filters=feature_store.silver_filters('LUBP4'))
+        _, state = feature_store.extend_features(df)
+        path = self.data_path.joinpath('state.json')
+        state.store(path)
+        loaded = FeatureState.load(path)
+        self.assert_states_equal(loaded, state)
+        # a loaded state extends exactly like the one it was stored from
+        extra = pd.DataFrame({'trade_date': pd.to_datetime(['2016-02-01', '2016-02-03']), 'mid_price': [3100.0, np.nan],
+                              'spread': [10.0, 12.0], 'volume_ton': [5.0, 7.0]})
+        expected, expected_state = feature_store.extend_features(extra, state)
+        actual, actual_state = feature_store.extend_features(extra, loaded)
+        pd.testing.assert_frame_equal(actual, expected, check_exact=True)
+        self.assert_states_equal(actual_state, expected_state)
+
+    def test_grouped_matches_per_symbol(self):
+        feature_store = self.feature_store()
+        grouped = feature_store.append_features_grouped(self.silver_df)
+        self.assertEqual(sorted(grouped), ['LUBP3', 'LUBP4', 'ULK5'])
+        for s, (features_df, state) in grouped.items():
+            df = self.silver_df[self.silver_df['symbol'] == s].drop(columns='symbol')
+            expected, expected_state = feature_store.extend_features(df)
+            pd.testing.assert_frame_equal(features_df, expected, check_exact=True, obj=s)
+            self.assert_states_equal(state, expected_state)
+
+    def test_grouped_run_matches_per_symbol_run(self):
+        self.write_silver(self.silver_df)
+        feature_store = self.feature_store()
+        feature_store.run(incremental=False, grouped=True)
+        self.assertEqual(feature_store.failures, {})
+        self.assert_matches_rebuild(feature_store, self.silver_df)
+
+    def test_grouped_incremental_run_checks_each_state_once(self):
+        feature_store = self.feature_store()
+        self.write_silver(self.silver_df[self.silver_df['trade_date'] < '2015-07-01'])
+        feature_store.run(incremental=True, grouped=True)
+        self.write_silver(self.silver_df)
+        with mock.patch.object(feature_store, 'load_usable_state', wraps=feature_store.load_usable_state) as load_usable_state:
+            feature_store.run(incremental=True, grouped=True)
+        self.assertEqual(sorted(c.args[0] for c in load_usable_state.call_args_list), sorted(feature_store.symbols))
+        self.assertEqual(feature_store.failures, {})
+        self.assert_matches_rebuild(feature_store, self.silver_df)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+# coding: utf-8
+
+from __future__ import absolute_import
+
+import pathlib
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from ecx_analytics.data_processor.silver_to_gold import SilverToGold, AGGREGATES, ROLLUPS, WEIGHTED_MEASURES, dimension_keys, dimension_name
+from ecx_analytics.data_processor.quantile_sketch import QuantileSketch
+
+
+def random_silver(n_days=400, symbols=('LUBP4', 'LUBP3', 'ULK5'), seed=0):
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range('2016-11-01', periods=n_days, freq='1D')
+    df = pd.concat([pd.DataFrame({'symbol': s, 'trade_date': dates}) for s in symbols], ignore_index=True)
+    n = len(df)
+    df['warehouse_name'] = rng.choice(['Addis Ababa', 'Dire Dawa', 'Hawassa', None], n)
+    df['production_year'] = rng.choice([2015, 2016, 2017], n)
+    df['opening_price'] = 3000 + rng.normal(0, 50, n)
+    df['closing_price'] = df['opening_price'] + rng.normal(0, 10, n)
+    df['high'] = df[['opening_price', 'closing_price']].max(axis=1) + rng.uniform(0, 5, n)
+    df['low'] = df[['opening_price', 'closing_price']].min(axis=1) - rng.uniform(0, 5, n)
+    df['change'] = df['closing_price'] - df['opening_price']
+    df['spread'] = df['high'] - df['low']
+    df['volume_ton'] = rng.uniform(1, 100, n)
+    for c in ['closing_price', 'volume_ton']:
+        df.loc[rng.random(n) < 0.03, c] = np.nan
+    for c in ['symbol', 'warehouse_name']:
+        df[c] = df[c].astype('category')
+    return df
+
+
+def pandas_aggregate(df, dimensions):
+    """Gold statistics from a direct groupby over silver."""
+    df = SilverToGold.add_dimension_columns(df)
+    for c in WEIGHTED_MEASURES:
+        df[f'{c}_x_volume'] = df[c] * df['volume_ton']
+
+    def percentile(n):
+        def percentile_(x):
+            return np.percentile(x.dropna(), n) if x.notnull().any() else np.nan
+        percentile_.__name__ = f'percentile_{n}'
+        return percentile_
+
+    agg_dict = {c: [percentile(int(s.split('_')[1])) if s.startswith('percentile') else s for s in stats] for c, stats in AGGREGATES.items()}
+    agg_df = df.groupby(dimension_keys(dimensions), observed=True).agg(agg_dict)
+    agg_df.columns = ['_'.join(c) for c in agg_df.columns]
+    for c in WEIGHTED_MEASURES:
+        agg_df[f'weighted_mean_{c}'] = agg_df[f'{c}_x_volume_sum'] / agg_df['volume_ton_sum']
+    return agg_df
+
+
+class TestSilverToGold(unittest.TestCase):
+    """Gold cube roll ups against direct aggregation of silver"""
+
+    def assert_gold_equal(self, actual, expected):
+        pd.testing.assert_frame_equal(actual, expected, check_exact=False, rtol=1e-9, check_dtype=False,
+                                      check_index_type=False, check_categorical=False)
+
+    def test_cube_matches_direct_aggregation(self):
+        df = random_silver()
+        cube = SilverToGold(pathlib.Path('.'), quantiles='exact').create_cube(df)
+        self.assertEqual(list(cube), [dimension_name(d) for d, _ in ROLLUPS])
+        for dimensions, _ in ROLLUPS:
+            self.assert_gold_equal(cube[dimension_name(dimensions)], pandas_aggregate(df, dimensions))
+
+    def test_sketched_percentiles_within_relative_accuracy(self):
+        df = random_silver()
+        accuracy = 0.002
+        cube = SilverToGold(pathlib.Path('.'), relative_accuracy=accuracy).create_cube(df)
+        for dimensions, _ in ROLLUPS:
+            actual, expected = cube[dimension_name(dimensions)], pandas_aggregate(df, dimensions)
+            sketched = [c for c in expected.columns if c.endswith(('percentile_25', 'percentile_50'))]
+            self.assert_gold_equal(actual.drop(columns=sketched), expected.drop(columns=sketched))
+            for c in sketched:
+                error = np.abs(actual[c] - expected[c]) / np.abs(expected[c])
+                self.assertTrue(((error <= accuracy * (1 + 1e-9)) | expected[c].isnull()).all(), f'{dimension_name(dimensions)} {c}')
+
+    def test_sketches_merge_in_any_grouping(self):
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame({'cell': rng.integers(0, 5, 2000), 'x': rng.lognormal(0, 3, 2000) * rng.choice([-1, 1, 0], 2000)})
+        sketch = QuantileSketch()
+        whole = sketch.create(df, ['cell'], ['x'])
+        # sketches of chunks merged are the sketch of all the values
+        parts = pd.concat([sketch.create(df.iloc[a:b], ['cell'], ['x']) for a, b in [(0, 10), (10, 1500), (1500, 2000)]], ignore_index=True)
+        merged = sketch.merge(parts, [parts['cell']])
+        pd.testing.assert_frame_equal(merged, whole, check_categorical=False)
+        estimates = sketch.quantiles(merged, ['cell'], ['x'], [0, 25, 50, 90, 100])
+        for q in [0, 25, 50, 90, 100]:
+            exact = df.groupby('cell')['x'].quantile(q / 100)
+            bound = sketch.relative_accuracy * df.groupby('cell')['x'].apply(
+                lambda x: np.abs(np.sort(x.to_numpy())[[int(np.floor(q / 100 * (len(x) - 1))), int(np.ceil(q / 100 * (len(x) - 1)))]]).max())
+            self.assertTrue((np.abs(estimates[f'x_percentile_{q}'] - exact) <= bound * (1 + 1e-9) + 1e-12).all(), q)
+
+    def test_incremental_update_matches_rebuild(self):
+        df = random_silver()
+        days = df['trade_date'].sort_values().unique()
+        with tempfile.TemporaryDirectory() as incremental_dir, tempfile.TemporaryDirectory() as rebuild_dir:
+            paths = {}
+            for k, d in [('incremental', incremental_dir), ('rebuild', rebuild_dir)]:
+                paths[k] = pathlib.Path(d)
+                for layer in ['silver', 'gold']:
+                    paths[k].joinpath(layer).mkdir()
+            gold = SilverToGold(paths['incremental'], storage='pickle')
+            # a first full build, then daily runs each adding new trade dates
+            for end in [days[200], days[-2], days[-1]]:
+                gold.storage.write(df[df['trade_date'] <= end], gold.silver_path, 'ecx_silver')
+                gold.run()
+            self.assertEqual(gold.load_usable_state().n_rows, len(df))
+            rebuild = SilverToGold(paths['rebuild'], storage='pickle')
+            rebuild.storage.write(df, rebuild.silver_path, 'ecx_silver')
+            rebuild.run(incremental=False)
+            for dimensions, _ in ROLLUPS:
+                name = dimension_name(dimensions)
+                self.assert_gold_equal(gold.storage.read(gold.gold_path, name), rebuild.storage.read(rebuild.gold_path, name))
+                pd.testing.assert_frame_equal(gold.storage.read(gold.gold_path, f'{name}_sketch'), rebuild.storage.read(rebuild.gold_path, f'{name}_sketch'))
+
+    def test_corrected_history_is_rebuilt(self):
+        df = random_silver()
+        days = df['trade_date'].sort_values().unique()
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            data_path = pathlib.Path(tmp_dir)
+            for layer in ['silver', 'gold']:
+                data_path.joinpath(layer).mkdir()
+            gold = SilverToGold(data_path, storage='pickle')
+            gold.storage.write(df[df['trade_date'] <= days[200]], gold.silver_path, 'ecx_silver')
+            gold.run()
+            # a corrected report changes a price before the state's end, the row count stays the same
+            corrected = df.copy()
+            corrected.loc[10, 'closing_price'] = 5000.0
+            gold.storage.write(corrected, gold.silver_path, 'ecx_silver')
+            self.assertIsNone(gold.load_usable_state())
+            gold.run()
+            cube = SilverToGold(pathlib.Path('.')).create_cube(corrected)
+            for dimensions, _ in ROLLUPS:
+                name = dimension_name(dimensions)
+                self.assert_gold_equal(gold.storage.read(gold.gold_path, name), cube[name])
+
+
+if __name__ == '__main__':
+    unittest.main()